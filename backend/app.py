@@ -1,16 +1,27 @@
-from fastapi import FastAPI, BackgroundTasks, Query
+import os, orjson, time, uuid, threading
+from fastapi import FastAPI, BackgroundTasks, Query, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Optional
-from backend.rag.ingest import ingest_folder
-from backend.rag.retrieve import Retriever
-from backend.rag.answer import Answerer
+from typing import Dict, List, Optional
 from backend.guard.rails import guard_query
-from backend.obs.logger import log_event
+from backend.obs.logger import log_event, close_logger, logger_stats
+from backend.obs.metrics import METRICS, record_timings, record_request
+from backend.obs.tracing import trace, span, close_exporter
+from backend.models.registry import model_stats, batcher_stats
+from backend.models.llm import LLMUnavailable, llm_stats
+from backend.rag.warmup import Warmup, WARMUP, RELOAD_POLL_S
+from backend.utils.config import EMB_MODEL
+
+# The RAG stack (faiss, torch, transformers, PyMuPDF) is imported on first use, so the
+# server starts and answers /health without paying for it.
 
 app = FastAPI(title="DocuChat Pro", version="0.4.0")
-RET = None
-ANS = None
+# one Retriever / Answerer per process, loaded and warmed in the background at start-up;
+# a newly published artifact generation replaces them without a restart
+STATE = Warmup(art_dir="artifacts")
+_INGEST_LOCK = threading.Lock()
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,21 +31,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def retriever() -> Retriever:
-    global RET
-    if RET is None:
-        RET = Retriever(art_dir="artifacts") # lazy-load on first call
-    return RET
+@app.exception_handler(LLMUnavailable)
+async def _llm_unavailable(request: Request, exc: LLMUnavailable):
+    # no LLM slot in time, or the provider kept failing past our retries: ask the client to come back
+    headers = {"Retry-After": str(max(1, round(exc.retry_after)))} if exc.retry_after else {}
+    return JSONResponse({"status": "unavailable", "reason": str(exc)}, status_code=503, headers=headers)
+
+@app.middleware("http")
+async def _index_version_header(request: Request, call_next):
+    response = await call_next(request)
+    # handlers that searched set the version they actually used
+    if "X-Index-Version" not in response.headers:
+        version = STATE.version()
+        if version:
+            response.headers["X-Index-Version"] = version
+    return response
+
+@app.on_event("startup")
+def _warm_up():
+    if WARMUP:
+        STATE.start()
+    if RELOAD_POLL_S > 0:
+        STATE.watch()
 
-def answerer() -> Answerer:
-    global ANS
-    if ANS is None:
-        ANS = Answerer(art_dir="artifacts")
-    return ANS
+@app.on_event("shutdown")
+def _drain_logs():
+    STATE.stop()
+    # the event log is written by a background thread; flush what is queued
+    close_logger()
+    close_exporter()
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "service": "docuchat-pro", "version": "0.1.0"}
+    return {"status": "ok", "service": "docuchat-pro", "version": "0.1.0",
+            "index_version": STATE.version()}
+
+@app.get("/ready")
+def ready(response: Response):
+    # readiness, unlike /health: 503 until models, index and warm-up queries are done
+    # (a failed warm-up stays 503; the error is in its component). A failed reranker
+    # only degrades search to no-rerank, so it is reported but still ready.
+    if not WARMUP:
+        return {"status": "ready", "warmup": False}
+    st = STATE.status()
+    if not STATE.ready():
+        response.status_code = 503
+    return st
+
+@app.get("/models")
+def models():
+    # load/warm-up time and memory footprint of every shared model loaded so far,
+    # plus queue depth / batch size / wait time of their micro-batchers, and the LLM gateway's
+    # in-flight calls, queue, retries and coalesced requests
+    return {"models": model_stats(), "batchers": batcher_stats(), "llm": llm_stats()}
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus text format; histograms/counters accumulate in-process since start-up
+    gauges = [
+        ("docuchat_log_queue_depth", "Events waiting for the background log writer.", {}, logger_stats()["queue_depth"]),
+        ("docuchat_log_events_dropped", "Events dropped because the log queue was full.", {}, logger_stats()["dropped"]),
+        ("docuchat_ready", "1 once start-up warm-up has finished.", {}, int(STATE.ready() or not WARMUP)),
+    ]
+    llm = llm_stats()
+    gauges += [
+        ("docuchat_llm_inflight", "LLM provider calls in flight.", {}, llm["inflight"]),
+        ("docuchat_llm_queued", "Requests waiting for an LLM slot.", {}, llm["queued"]),
+        ("docuchat_llm_retries", "LLM calls retried since start-up.", {}, llm["retries"]),
+        ("docuchat_llm_coalesced", "Requests served by an identical in-flight LLM call.", {}, llm["coalesced"]),
+    ]
+    for name, st in batcher_stats().items():
+        gauges += [
+            ("docuchat_batcher_queue_depth", "Requests waiting for a micro-batch.", {"model": name}, st["queue_depth"]),
+            ("docuchat_batcher_mean_batch_items", "Mean items per forward pass (last 1024 batches).", {"model": name}, st["mean_batch_items"]),
+            ("docuchat_batcher_p95_wait_ms", "p95 time a request waited for its batch (last 1024).", {"model": name}, st["p95_wait_ms"]),
+        ]
+    return PlainTextResponse(METRICS.render(gauges), media_type="text/plain; version=0.0.4")
+
+class SearchFilters(BaseModel):
+    # applied inside the dense and BM25 searches, not to their results
+    doc_ids: Optional[List[str]] = None
+    source_prefix: Optional[str] = None
+    page_min: Optional[int] = None
+    page_max: Optional[int] = None
+
+def _filters(f: Optional[SearchFilters]) -> Optional[dict]:
+    return f.model_dump(exclude_none=True) if f is not None else None
 
 class ChatRequest(BaseModel):
     query: str
@@ -43,39 +125,117 @@ class ChatRequest(BaseModel):
     top_m: int = 40
     max_tokens: int = 512
     temperature: float = 0.2
+    filters: Optional[SearchFilters] = None
 
 @app.post("/dev/ingest")
-def dev_ingest(background_tasks: BackgroundTasks, input_dir: str = "data"):
+def dev_ingest(background_tasks: BackgroundTasks, input_dir: str = "data", workers: int = 1, build: bool = True):
+    # ingest, then (with build) index the new rows into a new generation and switch to it;
+    # requests keep being served from the current generation meanwhile
+    if not _INGEST_LOCK.acquire(blocking=False):
+        return {"status": "busy", "index_version": STATE.version()}
+    workers = max(1, min(workers, os.cpu_count() or 1))
     def _job():
-        ingest_folder(input_dir, "artifacts")
+        try:
+            from backend.rag.ingest import ingest_folder
+            stats = ingest_folder(input_dir, "artifacts", workers=workers)
+            if build:
+                from backend.rag.index_build import build_generation, update_all
+                chunks = os.path.join("artifacts", "chunks.jsonl")
+                version = build_generation("artifacts", "incremental", lambda out: update_all(chunks, out, EMB_MODEL))
+                STATE.reload()
+                log_event({"route": "dev_ingest", "action": "published", "index_version": version, **stats})
+        finally:
+            _INGEST_LOCK.release()
     background_tasks.add_task(_job)
-    return {"status": "started", "input_dir": input_dir}
+    return {"status": "started", "input_dir": input_dir, "workers": workers, "build": build}
 
 @app.get("/search")
-def search(q: str = Query(..., min_length=2), k: int = 8,
-            rerank: bool = False, top_m: int = 50):
-    r = retriever().hybrid(q, k_dense=max(20, k*3), k_bm25=max(20, k*3),
-                            k_final=k, rerank=rerank, top_m=top_m)
-    return {"query": q, "k": k, "rerank": rerank, "top_m": top_m, "hits": r}
+def search(response: Response, q: str = Query(..., min_length=2), k: int = 8,
+            rerank: bool = False, top_m: int = 50, doc_id: Optional[List[str]] = Query(None),
+            source_prefix: Optional[str] = None, page_min: Optional[int] = None, page_max: Optional[int] = None,
+            x_request_id: Optional[str] = Header(None)):
+    filters = _filters(SearchFilters(doc_ids=doc_id, source_prefix=source_prefix, page_min=page_min, page_max=page_max))
+    rerank = STATE.use_rerank(rerank)
+    t0 = time.perf_counter()
+    with trace("search", x_request_id) as tr:
+        response.headers["X-Request-ID"] = tr.request_id
+        with STATE.lease() as gen:
+            response.headers["X-Index-Version"] = gen.version
+            timings: Dict = {}
+            r = gen.retriever.hybrid(q, k_dense=max(20, k*3), k_bm25=max(20, k*3),
+                                     k_final=k, rerank=rerank, top_m=top_m, filters=filters, timings=timings)
+    record_timings("search", timings, "hybrid", rerank)
+    record_request("search", "ok", time.perf_counter() - t0)
+    return {"query": q, "k": k, "rerank": rerank, "top_m": top_m, "filters": filters or None, "hits": r,
+            "index_version": gen.version}
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    mode: str = "hybrid"
+    k: int = 8
+    rerank: bool = False
+    top_m: int = 50
+    filters: Optional[SearchFilters] = None
+
+@app.post("/search/batch")
+def search_batch(req: BatchSearchRequest, response: Response, x_request_id: Optional[str] = Header(None)):
+    # one embedding batch, one FAISS search and shared rerank batches for all queries
+    k = req.k
+    req.rerank = STATE.use_rerank(req.rerank)
+    t0 = time.perf_counter()
+    with trace("search_batch", x_request_id) as tr:
+        response.headers["X-Request-ID"] = tr.request_id
+        with STATE.lease() as gen:
+            response.headers["X-Index-Version"] = gen.version
+            hits, timings = gen.retriever.search_many(req.queries, mode=req.mode, k=k,
+                                                      k_dense=max(20, k*3), k_bm25=max(20, k*3),
+                                                      rerank=req.rerank, top_m=req.top_m,
+                                                      filters=_filters(req.filters))
+    record_timings("search_batch", timings, req.mode, req.rerank)
+    record_request("search_batch", "ok", time.perf_counter() - t0)
+    results = [
+        {"query": q, "hits": [{f: v for f, v in h.items() if f != "text"} for h in hs]}
+        for q, hs in zip(req.queries, hits)
+    ]
+    return {"mode": req.mode, "k": k, "rerank": req.rerank, "top_m": req.top_m,
+            "results": results, "metrics": timings, "index_version": gen.version}
 
 @app.post("/chat")
-def chat(req: ChatRequest):
+def chat(req: ChatRequest, response: Response, x_request_id: Optional[str] = Header(None)):
+    # X-Request-ID is reused if the caller sent one; every log event and span carries it
+    with trace("chat", x_request_id) as tr:
+        response.headers["X-Request-ID"] = tr.request_id
+        return _chat(req, response)
+
+def _chat(req: ChatRequest, response: Response):
+    t0 = time.perf_counter()
+    req.rerank = STATE.use_rerank(req.rerank)  # no cross-encoder in degraded mode
     # Guard input
-    verdict = guard_query(req.query)
+    with span("guard"):
+        verdict = guard_query(req.query)
     if not verdict['ok']:
         log_event({"route": "chat", "action": "blocked",
             "reason": verdict["reason"], "q": req.query})
+        record_request("chat", "blocked", time.perf_counter() - t0)
         return {
             "status": "blocked",
             "reason": verdict["reason"],
-            "message": "Your request violates the assistant's safety rules or includes sensitive content."
+            "message": "Your request violates the assistant's safety rules or includes sensitive content.",
+            "index_version": STATE.version(),
         }
 
-    # Route to the Answerer, which internally calls retriever
-    res = answerer().answer(
-        q=req.query, k=req.k, rerank=req.rerank, top_m=req.top_m,
-        max_tokens=req.max_tokens, temperature=req.temperature
-    )
+    # Route to the Answerer, which internally calls retriever; one generation for the
+    # whole answer, even if a reload swaps it out meanwhile
+    with STATE.lease() as gen:
+        response.headers["X-Index-Version"] = gen.version
+        try:
+            res = gen.answerer().answer(
+                q=req.query, k=req.k, rerank=req.rerank, top_m=req.top_m,
+                max_tokens=req.max_tokens, temperature=req.temperature, filters=_filters(req.filters)
+            )
+        except LLMUnavailable:
+            record_request("chat", "unavailable", time.perf_counter() - t0)
+            raise  # -> 503
 
     # Log outcome
     out = {
@@ -90,8 +250,80 @@ def chat(req: ChatRequest):
         "reason": res.get("reason"),
     }
     log_event(out)
+    record_timings("chat", res.get("metrics", {}), "hybrid", req.rerank)
+    record_request("chat", res.get("status"), time.perf_counter() - t0)
 
-    return res
+    return {**res, "index_version": gen.version}
 
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest, x_request_id: Optional[str] = Header(None)):
+    """
+    Server-sent events: `hits` first, then one `token` event per LLM delta, then
+    `metrics` (full answer, timings incl. t_first_token_ms). Blocked or no-context
+    requests get a single `blocked` / `no_context` event; an LLM that can't be reached
+    in time ends the stream with an `error` event.
+    """
+    request_id = x_request_id or uuid.uuid4().hex
+
+    async def events():
+        # the trace lives in the streaming task, so it covers generation to the last token
+        with trace("chat_stream", request_id):
+            async for chunk in _chat_events(req):
+                yield chunk
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                      "X-Request-ID": request_id})
+
+async def _chat_events(req: ChatRequest):
+    t0 = time.perf_counter()
+    req.rerank = STATE.use_rerank(req.rerank)
+    with span("guard"):
+        verdict = guard_query(req.query)
+    if not verdict['ok']:
+        log_event({"route": "chat", "action": "blocked",
+            "reason": verdict["reason"], "q": req.query})
+        record_request("chat_stream", "blocked", time.perf_counter() - t0)
+        body = {
+            "status": "blocked",
+            "reason": verdict["reason"],
+            "message": "Your request violates the assistant's safety rules or includes sensitive content.",
+            "index_version": STATE.version(),
+        }
+        yield _sse("blocked", body)
+        return
 
+    # first call loads models; don't do that on the event loop
+    gen = await run_in_threadpool(STATE.acquire)
+    try:
+        ans = await run_in_threadpool(gen.answerer)
+        n_hits, status, reason, metrics = 0, None, None, {}
+        try:
+            async for ev in ans.answer_stream(
+                q=req.query, k=req.k, rerank=req.rerank, top_m=req.top_m,
+                max_tokens=req.max_tokens, temperature=req.temperature, filters=_filters(req.filters)
+            ):
+                if ev["event"] == "hits":
+                    n_hits = len(ev["data"]["hits"])
+                elif ev["event"] in ("metrics", "no_context"):
+                    status, reason = ev["data"].get("status"), ev["data"].get("reason")
+                    metrics = ev["data"].get("metrics", {})
+                if ev["event"] != "token":
+                    ev["data"]["index_version"] = gen.version
+                yield _sse(ev["event"], ev["data"])
+        except LLMUnavailable as e:
+            # the response has started, so the status code can't change: end with an error event
+            status, reason = "unavailable", str(e)
+            yield _sse("error", {"status": status, "reason": reason, "retry_after": e.retry_after,
+                                 "index_version": gen.version})
+    finally:
+        STATE.release(gen)
+    log_event({"route": "chat", "action": "answered", "stream": True, "status": status,
+               "q": req.query, "rerank": req.rerank, "k": req.k, "top_m": req.top_m,
+               "n_hits": n_hits, "reason": reason})
+    record_timings("chat_stream", metrics, "hybrid", req.rerank)
+    record_request("chat_stream", status, time.perf_counter() - t0)
 
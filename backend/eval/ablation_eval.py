@@ -6,6 +6,7 @@ from ragas.metrics import faithfulness, answer_relevancy, context_precision, con
 
 from backend.rag.answer import Answerer
 from backend.rag.retrieve import Retriever
+from backend.rag.chunk_store import open_chunk_store
 
 MODES = [
 	("bm25", "BM25"),
@@ -24,14 +25,7 @@ def load_samples(path: str) -> List[Dict]:
 	return items
 
 def get_context_texts(art_dir: str, hits: List[Dict]) -> List[str]:
-	out = []
-	with open(os.path.join(art_dir, "chunks.jsonl"), "rb") as f:
-		lines = f.readlines()
-	for h in hits:
-		idx = h["row"]
-		rec = orjson.loads(lines[idx])
-		out.append(rec["text"])
-	return out
+	return open_chunk_store(art_dir).texts(h["row"] for h in hits)
 
 def run_once(samples: List[Dict], art_dir: str, retrieval_mode: str) -> Dict:
 	ans = Answerer(art_dir=art_dir)
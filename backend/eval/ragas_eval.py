@@ -6,6 +6,7 @@ from ragas import evaluate
 
 from backend.rag.retrieve import Retriever
 from backend.rag.answer import Answerer
+from backend.rag.chunk_store import open_chunk_store
 
 def load_samples(path: str) -> List[Dict]:
 	items = []
@@ -32,16 +33,7 @@ def run_pipeline(answerer: Answerer, q: str, k: int = 6, rerank: bool = True, to
 
 def get_context_texts(art_dir: str, hits: List[Dict]) -> List[str]:
 	"""Helper to map hits (row indices) to raw chunk texts"""
-	r = Retriever(art_dir=art_dir)
-	out = []
-	for h in hits:
-		idx = h["row"]
-		with open(os.path.join(art_dir, "chunks.jsonl"), "rb") as f:
-			for i, l in enumerate(f):
-				if i == idx:
-					out.append(orjson.loads(l)["text"])
-					break
-	return out
+	return open_chunk_store(art_dir).texts(h["row"] for h in hits)
 
 def prepare_ragas_dataset(samples_path: str, art_dir: str = "artifacts") -> Dataset:
 	ans = Answerer(art_dir=art_dir)
@@ -0,0 +1,145 @@
+"""
+Dynamic micro-batching: concurrent callers submit small requests (one query's
+texts or rerank pairs), a single worker thread packs them into one forward pass
+of up to `max_batch` items, waiting at most `max_wait_ms` for company, and hands
+each caller back its slice of the results. Each caller's context is captured on
+submit, so the shared forward pass shows up as a span in every caller's trace.
+"""
+import time, queue, threading, contextvars
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from backend.obs.tracing import record_span
+
+class _Request:
+	__slots__ = ("items", "future", "t_enq", "ctx")
+
+	def __init__(self, items: Sequence[Any]):
+		self.items = items
+		self.future: Future = Future()
+		self.t_enq = time.perf_counter()
+		# the worker thread runs outside the caller's trace; spans are attached through this
+		self.ctx = contextvars.copy_context()
+
+class MicroBatcher:
+	"""
+	`fn(items) -> results` must return one result per item, in order (list or array).
+	A request is never split: one larger than `max_batch` runs as its own batch.
+	"""
+	def __init__(self, fn: Callable[[List[Any]], Sequence[Any]], max_batch: int = 64,
+				 max_wait_ms: float = 2.0, name: str = "batcher"):
+		self.fn = fn
+		self.max_batch = max_batch
+		self.max_wait = max_wait_ms / 1000
+		self.name = name
+		self._q: "queue.Queue[_Request]" = queue.Queue()
+		self._carry: Optional[_Request] = None
+		self._lock = threading.Lock()
+		# metrics
+		self.n_batches = 0
+		self.n_requests = 0
+		self.n_items = 0
+		self.max_queue_depth = 0
+		self._batch_sizes: deque = deque(maxlen=1024)
+		self._waits_ms: deque = deque(maxlen=1024)
+		self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+		self._worker.start()
+
+	def submit(self, items: Sequence[Any]) -> Future:
+		req = _Request(list(items))
+		self._q.put(req)
+		depth = self._q.qsize()
+		if depth > self.max_queue_depth:
+			self.max_queue_depth = depth
+		return req.future
+
+	def __call__(self, items: Sequence[Any]) -> List[Any]:
+		"""Blocking submit; returns this caller's results."""
+		if not items:
+			return []
+		return self.submit(items).result()
+
+	def _next(self, timeout: Optional[float]) -> Optional[_Request]:
+		if self._carry is not None:
+			req, self._carry = self._carry, None
+			return req
+		try:
+			return self._q.get(timeout=timeout)
+		except queue.Empty:
+			return None
+
+	def _next_nowait(self) -> Optional[_Request]:
+		try:
+			return self._q.get_nowait()
+		except queue.Empty:
+			return None
+
+	def _collect(self) -> List[_Request]:
+		first = self._next(None)
+		batch, n = [first], len(first.items)
+		deadline = first.t_enq + self.max_wait
+		while n < self.max_batch:
+			remaining = deadline - time.perf_counter()
+			# past the deadline, still take whatever is already queued
+			req = self._next(remaining) if remaining > 0 else self._next_nowait()
+			if req is None:
+				break
+			if n + len(req.items) > self.max_batch:
+				self._carry = req  # starts the next batch
+				break
+			batch.append(req)
+			n += len(req.items)
+		return batch
+
+	def _run(self):
+		while True:
+			batch = self._collect()
+			items = [it for req in batch for it in req.items]
+			t0 = time.perf_counter()
+			t0_ns = time.perf_counter_ns()
+			try:
+				results = self.fn(items)
+			except BaseException as e:
+				self._trace(batch, t0, t0_ns, len(items), type(e).__name__)
+				for req in batch:
+					req.future.set_exception(e)
+				continue
+			# spans go in before the results, so they land before the caller's trace is exported
+			self._trace(batch, t0, t0_ns, len(items))
+			pos = 0
+			for req in batch:
+				req.future.set_result(results[pos:pos + len(req.items)])
+				pos += len(req.items)
+			with self._lock:
+				self.n_batches += 1
+				self.n_requests += len(batch)
+				self.n_items += len(items)
+				self._batch_sizes.append(len(items))
+				self._waits_ms.extend((t0 - req.t_enq) * 1000 for req in batch)
+
+	def _trace(self, batch: List[_Request], t0: float, t0_ns: int, n_items: int,
+			   error: Optional[str] = None):
+		t1_ns = time.perf_counter_ns()
+		for req in batch:
+			req.ctx.run(record_span, "infer_batch", t0_ns, t1_ns, error, batcher=self.name,
+						n_items=len(req.items), batch_items=n_items, batch_requests=len(batch),
+						queue_wait_ms=round((t0 - req.t_enq) * 1000, 3))
+
+	def stats(self) -> Dict:
+		with self._lock:
+			sizes = sorted(self._batch_sizes)
+			waits = sorted(self._waits_ms)
+			return {
+				"max_batch": self.max_batch,
+				"max_wait_ms": self.max_wait * 1000,
+				"queue_depth": self._q.qsize(),
+				"max_queue_depth": self.max_queue_depth,
+				"batches": self.n_batches,
+				"requests": self.n_requests,
+				"items": self.n_items,
+				"mean_batch_items": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+				"mean_requests_per_batch": round(self.n_requests / self.n_batches, 2) if self.n_batches else 0.0,
+				"p50_wait_ms": round(waits[len(waits) // 2], 3) if waits else 0.0,
+				"p95_wait_ms": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+			}
@@ -1,34 +1,521 @@
-import os, time
-from typing import Optional
+import os, re, time, random, asyncio, threading
+from collections import deque
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Optional, Dict, AsyncIterator, List, Tuple
 from dotenv import load_dotenv
+from backend.obs.tracing import span, current_request_id
+from backend.obs.logger import log_event
 
 load_dotenv()
 
+SYSTEM_MSG = "You are a careful assistant that cites sources."
+
+# Gateway (see LLMGateway); one per process, shared by every Answerer
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "8"))           # provider calls at once; 0 = unbounded
+LLM_QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "30"))  # longest wait for a slot
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))             # on 408/409/429/5xx and connection errors
+LLM_BACKOFF_S = float(os.getenv("LLM_BACKOFF_S", "0.5"))             # first backoff; doubles per retry, full jitter
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "20"))      # longest wait, incl. the provider's Retry-After
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))              # per provider call
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") == "1"                 # identical concurrent calls share one completion
+
+def _messages(prompt: str):
+	return [
+		{"role": "system", "content": SYSTEM_MSG},
+		{"role": "user", "content": prompt}
+	]
+
+def _headers() -> Dict[str, str]:
+	# forward the request id so provider-side logs can be joined with our traces
+	rid = current_request_id()
+	return {"X-Request-ID": rid} if rid else {}
+
+class LLMUnavailable(RuntimeError):
+	"""No provider slot within LLM_QUEUE_TIMEOUT_S, or a transient failure outlasted the retries."""
+	def __init__(self, message: str, retry_after: Optional[float] = None):
+		super().__init__(message)
+		self.retry_after = retry_after
+
+# ------------------------------
+# Retry policy
+# ------------------------------
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_S = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def _duration_s(v: str) -> Optional[float]:
+	"""'2', '1.5s', '20ms', '6m0s' (x-ratelimit-reset-* format) -> seconds."""
+	v = v.strip()
+	try:
+		return float(v)
+	except ValueError:
+		pass
+	parts = _DURATION.findall(v)
+	return sum(float(n) * _UNIT_S[u] for n, u in parts) if parts else None
+
+def retry_after(e: BaseException) -> Optional[float]:
+	"""
+	Seconds the provider asked us to wait, from the failed response's headers:
+	retry-after-ms, retry-after (seconds or HTTP date), else the reset time of an
+	exhausted x-ratelimit-remaining-{requests,tokens} budget.
+	"""
+	h = getattr(getattr(e, "response", None), "headers", None)
+	if not h:
+		return None
+	if h.get("retry-after-ms"):
+		s = _duration_s(h["retry-after-ms"])
+		if s is not None:
+			return s / 1000
+	if h.get("retry-after"):
+		s = _duration_s(h["retry-after"])
+		if s is None:
+			try:
+				s = parsedate_to_datetime(h["retry-after"]).timestamp() - time.time()
+			except (TypeError, ValueError):
+				s = None
+		if s is not None:
+			return max(s, 0.0)
+	resets = [_duration_s(h[f"x-ratelimit-reset-{kind}"]) for kind in ("requests", "tokens")
+			  if h.get(f"x-ratelimit-remaining-{kind}") == "0" and h.get(f"x-ratelimit-reset-{kind}")]
+	resets = [s for s in resets if s is not None]
+	return max(resets) if resets else None
+
+# ------------------------------
+# Concurrency limit
+# ------------------------------
+class _Waiter:
+	__slots__ = ("granted", "event", "loop", "future")
+
+	def __init__(self, event: Optional[threading.Event] = None, loop=None, future=None):
+		self.granted = False
+		self.event, self.loop, self.future = event, loop, future
+
+def _wake(fut: "asyncio.Future"):
+	if not fut.done():
+		fut.set_result(None)
+
+class Gate:
+	"""
+	FIFO concurrency limit shared by threads (acquire) and coroutines (aacquire):
+	a released slot goes straight to the longest waiter, whichever kind it is.
+	"""
+	def __init__(self, limit: int):
+		self.limit = limit
+		self.active = 0
+		self._waiters: deque = deque()
+		self._lock = threading.Lock()
+		# metrics
+		self.n_acquired = 0
+		self.n_abandoned = 0
+		self.max_queued = 0
+		self._waits_ms: deque = deque(maxlen=1024)
+
+	def _enter(self, w: _Waiter) -> bool:
+		"""Take a free slot (True) or queue `w` (False); called with the lock held."""
+		if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+			self.active += 1
+			return True
+		self._waiters.append(w)
+		self.max_queued = max(self.max_queued, len(self._waiters))
+		return False
+
+	def _abandon(self, w: _Waiter) -> bool:
+		"""A waiter gave up: True if it was still queued, False if a slot reached it meanwhile."""
+		with self._lock:
+			if w.granted:
+				return False
+			self._waiters.remove(w)
+			self.n_abandoned += 1
+			return True
+
+	def _granted(self, t0: float) -> float:
+		waited = time.perf_counter() - t0
+		with self._lock:
+			self.n_acquired += 1
+			self._waits_ms.append(waited * 1000)
+		return waited
+
+	def acquire(self, timeout: Optional[float] = None) -> float:
+		"""Block for a slot; returns the seconds waited. Raises LLMUnavailable after `timeout`."""
+		t0 = time.perf_counter()
+		w = _Waiter(event=threading.Event())
+		with self._lock:
+			ok = self._enter(w)
+		if not ok and not w.event.wait(timeout) and self._abandon(w):
+			raise LLMUnavailable(f"no LLM slot within {timeout}s ({self.limit} in flight)", timeout)
+		return self._granted(t0)
+
+	async def aacquire(self, timeout: Optional[float] = None) -> float:
+		t0 = time.perf_counter()
+		loop = asyncio.get_running_loop()
+		w = _Waiter(loop=loop, future=loop.create_future())
+		with self._lock:
+			ok = self._enter(w)
+		if not ok:
+			try:
+				await asyncio.wait_for(w.future, timeout)
+			except BaseException as e:  # timed out, or the request went away
+				if not self._abandon(w):
+					self.release()
+				if isinstance(e, asyncio.TimeoutError):
+					raise LLMUnavailable(f"no LLM slot within {timeout}s ({self.limit} in flight)", timeout) from None
+				raise
+		return self._granted(t0)
+
+	def release(self):
+		with self._lock:
+			if not self._waiters:
+				self.active -= 1
+				return
+			w = self._waiters.popleft()
+			w.granted = True  # the slot passes on; `active` is unchanged
+		if w.event is not None:
+			w.event.set()
+			return
+		try:
+			w.loop.call_soon_threadsafe(_wake, w.future)
+		except RuntimeError:
+			self.release()  # its event loop is gone
+
+	def stats(self) -> Dict:
+		with self._lock:
+			waits = sorted(self._waits_ms)
+			return {
+				"max_inflight": self.limit,
+				"inflight": self.active,
+				"queued": len(self._waiters),
+				"max_queued": self.max_queued,
+				"acquired": self.n_acquired,
+				"queue_abandoned": self.n_abandoned,  # timed out or cancelled while queued
+				"p50_queue_ms": round(waits[len(waits) // 2], 3) if waits else 0.0,
+				"p95_queue_ms": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0,
+			}
+
+# ------------------------------
+# Gateway
+# ------------------------------
+class _StreamFlight:
+	"""One provider stream, replayed to every request subscribed to it."""
+	def __init__(self):
+		self.tokens: List[str] = []
+		self.usage: Dict = {}
+		self.error: Optional[BaseException] = None
+		self.done = False
+		self.subscribers = 0
+		self.task: Optional[asyncio.Task] = None
+		self.changed = asyncio.Event()
+
+	def _notify(self):
+		ev, self.changed = self.changed, asyncio.Event()
+		ev.set()
+
+	def push(self, tok: str):
+		self.tokens.append(tok)
+		self._notify()
+
+	def finish(self):
+		self.done = True
+		self._notify()
+
+def _coalesced_usage(usage: Dict) -> Dict:
+	# the provider billed the leader; followers cost nothing
+	return {**usage, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+			"queue_ms": 0, "retries": 0, "coalesced": True}
+
+class LLMGateway:
+	"""
+	Every provider call goes through here: at most `max_inflight` at once (callers
+	queue FIFO, up to `queue_timeout` seconds), transient failures are retried with
+	exponential backoff that defers to the provider's rate-limit headers, and
+	identical concurrent calls (same model, prompt and params) share one completion.
+	"""
+	def __init__(self, max_inflight: int = LLM_MAX_INFLIGHT, queue_timeout: float = LLM_QUEUE_TIMEOUT_S,
+				 max_retries: int = LLM_MAX_RETRIES, backoff: float = LLM_BACKOFF_S,
+				 backoff_max: float = LLM_BACKOFF_MAX_S, coalesce: bool = LLM_COALESCE):
+		self.gate = Gate(max_inflight)
+		self.queue_timeout = queue_timeout
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.backoff_max = backoff_max
+		self.coalesce = coalesce
+		self._flights: Dict[Tuple, Any] = {}
+		self._lock = threading.Lock()
+		# metrics
+		self.n_calls = 0
+		self.n_provider_calls = 0
+		self.n_retries = 0
+		self.n_coalesced = 0
+		self.n_failed = 0
+
+	def _count(self, **inc: int):
+		with self._lock:
+			for name, n in inc.items():
+				setattr(self, name, getattr(self, name) + n)
+
+	def _retry_delay(self, llm: "LLMBase", e: BaseException, attempt: int) -> Optional[float]:
+		"""Seconds to wait before retrying after failed attempt `attempt`; None to give up."""
+		if attempt > self.max_retries or not llm.transient(e):
+			return None
+		hinted = retry_after(e)
+		if hinted is not None:
+			# a provider asking for longer than we'd wait won't be ready sooner
+			return hinted if hinted <= self.backoff_max else None
+		return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+
+	def _failed(self, llm: "LLMBase", e: BaseException, attempt: int) -> BaseException:
+		self._count(n_failed=1)
+		if llm.transient(e):
+			return LLMUnavailable(f"{llm.provider} call failed after {attempt} attempt(s): {type(e).__name__}: {e}",
+								  retry_after(e))
+		return e
+
+	def _retrying(self, llm: "LLMBase", e: BaseException, attempt: int, delay: float):
+		self._count(n_retries=1)
+		log_event({"route": "llm", "stage": "retry", "provider": llm.provider, "model": llm.model,
+				   "attempt": attempt, "delay_ms": int(delay * 1000), "status": getattr(e, "status_code", None),
+				   "error": f"{type(e).__name__}: {e}"})
+
+	def _key(self, llm: "LLMBase", *params) -> Tuple:
+		return (llm.provider, llm.model, *params)
+
+	# ---- blocking ----
+	def generate(self, llm: "LLMBase", prompt: str, max_tokens: int, temperature: float) -> Tuple[str, Dict]:
+		self._count(n_calls=1)
+		if not self.coalesce:
+			return self._call(llm, prompt, max_tokens, temperature)
+		key = self._key(llm, prompt, max_tokens, temperature)
+		with self._lock:
+			fut = self._flights.get(key)
+			leader = fut is None
+			if leader:
+				fut = self._flights[key] = Future()
+		if not leader:
+			with span("llm_coalesced", provider=llm.provider, model=llm.model):
+				text, usage = fut.result()  # raises the leader's error
+			self._count(n_coalesced=1)
+			return text, _coalesced_usage(usage)
+		try:
+			res = self._call(llm, prompt, max_tokens, temperature)
+		except BaseException as e:
+			self._land(key, fut)
+			fut.set_exception(e)
+			raise
+		self._land(key, fut)
+		fut.set_result(res)
+		return res
+
+	def _land(self, key: Tuple, flight: Any):
+		with self._lock:
+			if self._flights.get(key) is flight:
+				del self._flights[key]
+
+	def _call(self, llm: "LLMBase", prompt: str, max_tokens: int, temperature: float) -> Tuple[str, Dict]:
+		with span("llm_queue", inflight=self.gate.active):
+			queued = self.gate.acquire(self.queue_timeout)
+		try:
+			attempt = 0
+			while True:
+				attempt += 1
+				self._count(n_provider_calls=1)
+				try:
+					text, usage = llm._generate(prompt, max_tokens, temperature)
+					break
+				except Exception as e:
+					delay = self._retry_delay(llm, e, attempt)
+					if delay is None:
+						raise self._failed(llm, e, attempt) from e
+					self._retrying(llm, e, attempt, delay)
+					# backing off inside the slot keeps our load down while the provider sheds it
+					time.sleep(delay)
+		finally:
+			self.gate.release()
+		return text, {**usage, "queue_ms": int(queued * 1000), "retries": attempt - 1}
+
+	# ---- streaming ----
+	async def astream(self, llm: "LLMBase", prompt: str, max_tokens: int, temperature: float,
+					  usage: Optional[Dict] = None) -> AsyncIterator[str]:
+		self._count(n_calls=1)
+		key = self._key(llm, prompt, max_tokens, temperature, "stream", id(asyncio.get_running_loop()))
+		with self._lock:
+			fl = self._flights.get(key) if self.coalesce else None
+			leader = fl is None
+			if leader:
+				fl = _StreamFlight()
+				if self.coalesce:
+					self._flights[key] = fl
+		if leader:
+			fl.task = asyncio.create_task(self._produce(llm, fl, key, prompt, max_tokens, temperature))
+		else:
+			self._count(n_coalesced=1)
+		fl.subscribers += 1
+		try:
+			i = 0
+			while True:
+				while i < len(fl.tokens):
+					yield fl.tokens[i]
+					i += 1
+				if fl.done:
+					break
+				await fl.changed.wait()
+			if fl.error is not None:
+				raise fl.error
+			if usage is not None:
+				usage.update(fl.usage if leader else _coalesced_usage(fl.usage))
+		finally:
+			fl.subscribers -= 1
+			if not fl.subscribers and not fl.done:
+				# every client went away: stop paying for tokens (and let no one join a cancelled stream)
+				self._land(key, fl)
+				fl.task.cancel()
+
+	async def _produce(self, llm: "LLMBase", fl: _StreamFlight, key: Tuple, prompt: str,
+					   max_tokens: int, temperature: float):
+		try:
+			queued = await self.gate.aacquire(self.queue_timeout)
+			try:
+				attempt = 0
+				while True:
+					attempt += 1
+					self._count(n_provider_calls=1)
+					u: Dict = {}
+					agen = llm._astream(prompt, max_tokens, temperature, u)
+					try:
+						async for tok in agen:
+							fl.push(tok)
+						break
+					except Exception as e:
+						# once tokens went out the stream can't be replayed
+						delay = None if fl.tokens else self._retry_delay(llm, e, attempt)
+						if delay is None:
+							raise self._failed(llm, e, attempt) from e
+						self._retrying(llm, e, attempt, delay)
+						await asyncio.sleep(delay)
+					finally:
+						await agen.aclose()
+			finally:
+				self.gate.release()
+			fl.usage = {**u, "queue_ms": int(queued * 1000), "retries": attempt - 1}
+		except BaseException as e:  # incl. cancellation; subscribers re-raise it
+			fl.error = e
+		finally:
+			self._land(key, fl)
+			fl.finish()
+
+	def stats(self) -> Dict:
+		with self._lock:
+			counts = {"calls": self.n_calls, "provider_calls": self.n_provider_calls, "retries": self.n_retries,
+					  "coalesced": self.n_coalesced, "failed": self.n_failed, "in_flight_keys": len(self._flights)}
+		return {**self.gate.stats(), **counts}
+
+GATEWAY = LLMGateway()
+
+def llm_stats() -> Dict:
+	return GATEWAY.stats()
+
+# ------------------------------
+# Providers
+# ------------------------------
+# Tokenizers for prompt budgeting (see generate.pack_context), loaded once per process
+@lru_cache(maxsize=None)
+def _tiktoken_encoding(model: str):
+	try:
+		import tiktoken
+	except ImportError:
+		return None
+	try:
+		try:
+			return tiktoken.encoding_for_model(model)
+		except KeyError:
+			return tiktoken.get_encoding("o200k_base")  # newer models share the gpt-4o vocabulary
+	except Exception:
+		return None  # vocab not cached and not downloadable (offline): estimate instead
+
+@lru_cache(maxsize=None)
+def _hf_tokenizer(name: str):
+	from transformers import AutoTokenizer
+	return AutoTokenizer.from_pretrained(name)
+
 class LLMBase:
-	def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.2) -> str:
+	"""
+	Providers implement _generate / _astream (one raw call); generate / astream go
+	through the process's gateway.
+	"""
+	provider = "base"
+	model = ""
+	tokenizer = "estimate"
+
+	def count_tokens(self, text: str) -> int:
+		"""
+		Prompt tokens `text` costs with this model. Base: an estimate (~4 bytes per token
+		for English BPE vocabularies) for providers without a local tokenizer.
+		"""
+		return (len(text.encode("utf-8")) + 3) // 4
+
+	def transient(self, e: BaseException) -> bool:
+		"""Worth retrying: timeouts, conflicts, rate limits, server errors, lost connections."""
+		status = getattr(e, "status_code", None)
+		if isinstance(status, int) and status > 0:
+			return status in (408, 409, 429) or status >= 500
+		return isinstance(e, (ConnectionError, TimeoutError))
+
+	def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.2) -> Tuple[str, Dict]:
+		return GATEWAY.generate(self, prompt, max_tokens, temperature)
+
+	async def astream(self, prompt: str, max_tokens: int = 512, temperature: float = 0.2,
+					  usage: Optional[Dict] = None) -> AsyncIterator[str]:
+		"""Async token iterator. Token counts are written into `usage` once the stream ends."""
+		async for tok in GATEWAY.astream(self, prompt, max_tokens, temperature, usage):
+			yield tok
+
+	def _generate(self, prompt: str, max_tokens: int, temperature: float) -> Tuple[str, Dict]:
 		raise NotImplementedError
 
+	async def _astream(self, prompt: str, max_tokens: int, temperature: float, usage: Dict) -> AsyncIterator[str]:
+		# default: run the blocking call off the event loop and yield it whole
+		text, u = await asyncio.to_thread(self._generate, prompt, max_tokens, temperature)
+		usage.update(u)
+		yield text
+
 class OpenAIChat(LLMBase):
 	"""
 	Simple wrapper for OpenAI Chat Completions (o4-mini / gpt-4o-mini / gpt-4o).
-	Replace with your preferred model. Requires OPENAI_API_KEY in env.
+	Replace with your preferred model. Requires OPENAI_API_KEY in env; OPENAI_BASE_URL
+	points it at any compatible server (e.g. benchmarks/mock_llm.py).
 	"""
+	provider = "openai"
+
 	def __init__(self, model: str = None):
-		from openai import OpenAI
-		self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+		import openai
+		from openai import OpenAI, AsyncOpenAI
+		self._conn_errors = (openai.APIConnectionError,)
+		# one client pair per process: requests reuse its keep-alive connection pool.
+		# Retries are the gateway's, so the SDK's own are off.
+		self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, timeout=LLM_TIMEOUT_S)
+		self.aclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, timeout=LLM_TIMEOUT_S)
 		self.model = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+		self._enc = _tiktoken_encoding(self.model)  # None without tiktoken: estimate instead
+		if self._enc is not None:
+			self.tokenizer = f"tiktoken:{self._enc.name}"
+
+	def count_tokens(self, text: str) -> int:
+		if self._enc is None:
+			return super().count_tokens(text)
+		return len(self._enc.encode_ordinary(text))
 
-	def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.2) -> str:
+	def transient(self, e: BaseException) -> bool:
+		return isinstance(e, self._conn_errors) or super().transient(e)
+
+	def _generate(self, prompt: str, max_tokens: int, temperature: float) -> Tuple[str, Dict]:
 		t0 = time.time()
-		resp = self.client.chat.completions.create(
-			model=self.model,
-			temperature=temperature,
-			max_tokens=max_tokens,
-			messages=[
-				{"role": "system", "content": "You are a careful assistant that cites sources."},
-				{"role": "user", "content": prompt}
-			],
-		)
+		with span("llm", provider="openai", model=self.model, stream=False):
+			resp = self.client.chat.completions.create(
+				model=self.model,
+				temperature=temperature,
+				max_tokens=max_tokens,
+				messages=_messages(prompt),
+				extra_headers=_headers(),
+			)
 		dt = time.time() - t0
 		text = resp.choices[0].message.content.strip() or ""
 		u = getattr(resp, "usage", None)
@@ -49,34 +536,106 @@ class OpenAIChat(LLMBase):
 
 		usage = {
 			"prompt_tokens": _get_u("prompt_tokens"),
-			"completions_tokens": _get_u("completions_tokens"),
+			"completion_tokens": _get_u("completion_tokens"),
 			"total_tokens": _get_u("total_tokens"),
-			"gen_ms": int((time.time() - dt) * 1000),
+			"gen_ms": int(dt * 1000),
 		}
 		return text, usage
 
+	async def _astream(self, prompt: str, max_tokens: int, temperature: float, usage: Dict) -> AsyncIterator[str]:
+		t0 = time.time()
+		with span("llm", provider="openai", model=self.model, stream=True):
+			stream = await self.aclient.chat.completions.create(
+				model=self.model,
+				temperature=temperature,
+				max_tokens=max_tokens,
+				messages=_messages(prompt),
+				stream=True,
+				stream_options={"include_usage": True},
+				extra_headers=_headers(),
+			)
+			async for chunk in stream:
+				if chunk.choices and chunk.choices[0].delta.content:
+					yield chunk.choices[0].delta.content
+				u = getattr(chunk, "usage", None)
+				if u is not None:
+					usage.update({
+						"prompt_tokens": u.prompt_tokens,
+						"completion_tokens": u.completion_tokens,
+						"total_tokens": u.total_tokens,
+					})
+		usage["gen_ms"] = int((time.time() - t0) * 1000)
+
+def _set_request_id(request):
+	request.headers.update(_headers())
+
+async def _aset_request_id(request):
+	request.headers.update(_headers())
+
 class OllamaChat(LLMBase):
 	"""
 	Local alternative via Ollama (e.g., llama3). Requires `pip install ollama`.
 	"""
+	provider = "ollama"
+
 	def __init__(self, model: str = None):
-		import ollama
-		self.ollama = ollama
+		import httpx, ollama
+		self._conn_errors = (httpx.TransportError,)
+		# shared clients (OLLAMA_HOST) with keep-alive pools; the request id is added per request
+		self.client = ollama.Client(timeout=LLM_TIMEOUT_S, event_hooks={"request": [_set_request_id]})
+		self.aclient = ollama.AsyncClient(timeout=LLM_TIMEOUT_S, event_hooks={"request": [_aset_request_id]})
 		self.model = model or os.getenv("OLLAMA_MODEL", "llama3")
+		# Ollama has no tokenize API; OLLAMA_TOKENIZER names the model's HF tokenizer
+		# (e.g. meta-llama/Meta-Llama-3-8B-Instruct), else token counts are estimated
+		name = os.getenv("OLLAMA_TOKENIZER")
+		self._tok = _hf_tokenizer(name) if name else None
+		if self._tok is not None:
+			self.tokenizer = f"hf:{name}"
 
-	def generate(self, prompt: str, max_tokens: int = 512, temperature: float = 0.2) -> str:
-		r = self.ollama.chat(model=self.model, message=[
-			{"role": "system", "content": "You are a careful assistant that cites sources."},
-			{"role": "user", "content": prompt}
-		], options={"temperature": temperature, "num_predict": max_tokens})
-		return r["message"]["content"].strip()
+	def count_tokens(self, text: str) -> int:
+		if self._tok is None:
+			return super().count_tokens(text)
+		return len(self._tok.encode(text, add_special_tokens=False))
 
-def get_llm():
-	provider = os.getenv("MODEL_PROVIDER", "openai").lower()
-	if provider == "ollama":
-		return OllamaChat()
-	return OpenAIChat()
+	def transient(self, e: BaseException) -> bool:
+		return isinstance(e, self._conn_errors) or super().transient(e)
+
+	@staticmethod
+	def _usage(r, t0: float) -> Dict:
+		p, c = r.get("prompt_eval_count"), r.get("eval_count")
+		return {
+			"prompt_tokens": p,
+			"completion_tokens": c,
+			"total_tokens": p + c if p is not None and c is not None else None,
+			"gen_ms": int((time.time() - t0) * 1000),
+		}
 
+	def _generate(self, prompt: str, max_tokens: int, temperature: float) -> Tuple[str, Dict]:
+		t0 = time.time()
+		with span("llm", provider="ollama", model=self.model, stream=False):
+			r = self.client.chat(model=self.model, messages=_messages(prompt),
+								 options={"temperature": temperature, "num_predict": max_tokens})
+		return r["message"]["content"].strip(), self._usage(r, t0)
 
+	async def _astream(self, prompt: str, max_tokens: int, temperature: float, usage: Dict) -> AsyncIterator[str]:
+		t0 = time.time()
+		with span("llm", provider="ollama", model=self.model, stream=True):
+			parts = await self.aclient.chat(model=self.model, messages=_messages(prompt), stream=True,
+											options={"temperature": temperature, "num_predict": max_tokens})
+			async for part in parts:
+				tok = part["message"]["content"]
+				if tok:
+					yield tok
+				if part.get("done"):
+					usage.update(self._usage(part, t0))
 
+_LLMS: Dict[str, LLMBase] = {}
+_LLMS_LOCK = threading.Lock()
 
+def get_llm() -> LLMBase:
+	"""The process's client for MODEL_PROVIDER, shared by every Answerer (and its connection pool)."""
+	provider = os.getenv("MODEL_PROVIDER", "openai").lower()
+	with _LLMS_LOCK:
+		if provider not in _LLMS:
+			_LLMS[provider] = OllamaChat() if provider == "ollama" else OpenAIChat()
+		return _LLMS[provider]
@@ -0,0 +1,110 @@
+"""
+Process-wide model registry: each (kind, name) is loaded once, warmed up with a
+dummy batch, and shared by every Retriever / Answerer in the process. Online
+inference goes through one micro-batcher per model, so concurrent requests share
+forward passes instead of contending for cores.
+"""
+import os, time, threading
+from typing import Any, Callable, Dict, Tuple
+
+from backend.utils.config import EMB_MODEL, RERANK_MODEL
+from backend.models.batching import MicroBatcher
+
+_MODELS: Dict[Tuple[str, str], Any] = {}
+_STATS: Dict[str, Dict] = {}
+_LOCK = threading.Lock()
+_KEY_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+_BATCHERS: Dict[Tuple[str, str], MicroBatcher] = {}
+
+# INFER_MAX_BATCH items per forward pass; INFER_MAX_WAIT_MS to fill one (0 = no batching)
+INFER_MAX_BATCH = int(os.getenv("INFER_MAX_BATCH", "64"))
+INFER_MAX_WAIT_MS = float(os.getenv("INFER_MAX_WAIT_MS", "2"))
+
+def _rss_mb() -> float:
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+	except (OSError, ValueError, IndexError):
+		import resource  # peak RSS; best effort off Linux
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _param_mb(module: Any) -> float:
+	params = getattr(module, "parameters", None)
+	if params is None:
+		return 0.0
+	return sum(p.numel() * p.element_size() for p in params()) / 2**20
+
+def _get(kind: str, name: str, load: Callable[[], Any], warmup: Callable[[Any], None],
+		 torch_module: Callable[[Any], Any]) -> Any:
+	key = (kind, name)
+	model = _MODELS.get(key)
+	if model is not None:
+		return model
+	with _LOCK:
+		key_lock = _KEY_LOCKS.setdefault(key, threading.Lock())
+	# per-model lock: concurrent first callers wait for one load instead of loading twice
+	with key_lock:
+		model = _MODELS.get(key)
+		if model is not None:
+			return model
+		rss0 = _rss_mb()
+		t0 = time.perf_counter()
+		model = load()
+		t1 = time.perf_counter()
+		warmup(model)
+		t2 = time.perf_counter()
+		_STATS[f"{kind}:{name}"] = {
+			"kind": kind,
+			"name": name,
+			"load_ms": int((t1 - t0) * 1000),
+			"warmup_ms": int((t2 - t1) * 1000),
+			"param_mb": round(_param_mb(torch_module(model)), 1),
+			"rss_delta_mb": round(_rss_mb() - rss0, 1),
+		}
+		_MODELS[key] = model
+		return model
+
+def get_embedder(name: str = EMB_MODEL):
+	from sentence_transformers import SentenceTransformer
+	return _get("embedder", name,
+				lambda: SentenceTransformer(name),
+				lambda m: m.encode(["warm-up query"], normalize_embeddings=True),
+				lambda m: m)
+
+def get_reranker(name: str = RERANK_MODEL, max_length: int = 512):
+	from backend.rag.rerank import Reranker
+	return _get("reranker", f"{name}@{max_length}",
+				lambda: Reranker(name, max_length=max_length),
+				lambda r: r.score_pairs("warm-up query", ["warm-up passage"] * 2),
+				lambda r: getattr(r.model, "model", None))
+
+def _batcher(kind: str, name: str, fn: Callable[[list], Any]) -> Callable[[list], Any]:
+	if INFER_MAX_WAIT_MS <= 0:
+		return fn
+	key = (kind, name)
+	b = _BATCHERS.get(key)
+	if b is None:
+		with _LOCK:
+			b = _BATCHERS.get(key)
+			if b is None:
+				b = _BATCHERS[key] = MicroBatcher(fn, max_batch=INFER_MAX_BATCH,
+												  max_wait_ms=INFER_MAX_WAIT_MS, name=f"{kind}:{name}")
+	return b
+
+def embed_batcher(name: str = EMB_MODEL) -> Callable[[list], Any]:
+	"""texts -> (n, dim) normalized float32 embeddings, batched across concurrent callers."""
+	model = get_embedder(name)
+	return _batcher("embedder", name, lambda texts: model.encode(
+		texts, batch_size=max(min(len(texts), INFER_MAX_BATCH), 1), normalize_embeddings=True))
+
+def rerank_batcher(name: str = RERANK_MODEL, max_length: int = 512) -> Callable[[list], Any]:
+	"""(query, text) pairs -> scores, batched across concurrent callers."""
+	model = get_reranker(name, max_length)
+	return _batcher("reranker", f"{name}@{max_length}", lambda pairs: model.score_pair_list(
+		pairs, batch_size=max(min(len(pairs), INFER_MAX_BATCH), 1)))
+
+def model_stats() -> Dict[str, Dict]:
+	return {k: dict(v) for k, v in _STATS.items()}
+
+def batcher_stats() -> Dict[str, Dict]:
+	return {b.name: b.stats() for b in list(_BATCHERS.values())}
@@ -1,10 +1,175 @@
-import json, time, os
-from typing import Any, Dict
+import os, time, queue, atexit, threading, orjson
+from typing import Any, Dict, List, Optional
+from backend.obs.tracing import current_request_id
 
 LOG_PATH = os.getenv("OBS_LOG_PATH", "runtime/requests.log")
+QUEUE_SIZE = int(os.getenv("OBS_LOG_QUEUE", "10000"))           # events buffered before dropping
+FLUSH_INTERVAL_S = float(os.getenv("OBS_LOG_FLUSH_S", "0.5"))
+FLUSH_BYTES = int(os.getenv("OBS_LOG_FLUSH_BYTES", str(64 * 1024)))
+MAX_BYTES = int(os.getenv("OBS_LOG_MAX_BYTES", str(50 * 2**20)))  # rotate by size; 0 = never
+ROTATE_S = float(os.getenv("OBS_LOG_ROTATE_S", "0"))              # rotate by age; 0 = never
+BACKUPS = int(os.getenv("OBS_LOG_BACKUPS", "5"))
+
+_OPTS = orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY
+
+class EventLogger:
+	"""
+	JSON-lines event log written by a background thread. log() only enqueues; the
+	writer serializes with orjson and appends in batches every `flush_interval` seconds
+	or `flush_bytes`, rotating to path.1 .. path.N by size or age. When the queue is
+	full, events are dropped and counted rather than blocking the request.
+	"""
+	def __init__(self, path: str = LOG_PATH, queue_size: int = QUEUE_SIZE,
+				 flush_interval: float = FLUSH_INTERVAL_S, flush_bytes: int = FLUSH_BYTES,
+				 max_bytes: int = MAX_BYTES, rotate_s: float = ROTATE_S, backups: int = BACKUPS):
+		self.path = path
+		self.flush_interval = flush_interval
+		self.flush_bytes = flush_bytes
+		self.max_bytes = max_bytes
+		self.rotate_s = rotate_s
+		self.backups = backups
+		self._q: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+		self._f = None
+		self._opened = 0.0
+		self.enqueued = 0
+		self.written = 0
+		self.dropped = 0
+		self.errors = 0
+		self.flushes = 0
+		self.rotations = 0
+		self._closed = False
+		self._thread = threading.Thread(target=self._run, name="event-logger", daemon=True)
+		self._thread.start()
+
+	def log(self, event: Dict[str, Any]):
+		if self._closed:
+			self.dropped += 1
+			return
+		try:
+			self._q.put_nowait(event)
+			self.enqueued += 1
+		except queue.Full:
+			self.dropped += 1
+
+	def _open(self):
+		os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+		self._f = open(self.path, "ab")
+		self._opened = time.time()
+
+	def _rotate(self):
+		self._f.close()
+		self._f = None
+		if self.backups > 0:
+			for i in range(self.backups - 1, 0, -1):
+				src = f"{self.path}.{i}"
+				if os.path.exists(src):
+					os.replace(src, f"{self.path}.{i + 1}")
+			os.replace(self.path, f"{self.path}.1")
+		else:
+			os.remove(self.path)
+		self.rotations += 1
+
+	def _due(self, pending: int, line: int) -> bool:
+		"""Would `line` more bytes after `pending` unwritten ones overflow a non-empty file?"""
+		size = self._f.tell() + pending
+		return bool(self.max_bytes) and size > 0 and size + line > self.max_bytes
+
+	def _write(self, lines: List[bytes]):
+		try:
+			if self._f is None:
+				self._open()
+			if self.rotate_s and time.time() - self._opened > self.rotate_s:
+				self._rotate()
+				self._open()
+			# size is checked per event, so one large batch still rotates at max_bytes
+			chunk = bytearray()
+			for line in lines:
+				if self._due(len(chunk), len(line)):
+					self._f.write(chunk)
+					chunk.clear()
+					self._rotate()
+					self._open()
+				chunk += line
+			self._f.write(chunk)
+			self._f.flush()
+			self.written += len(lines)
+			self.flushes += 1
+		except OSError:
+			self.errors += len(lines)
+
+	def _run(self):
+		lines: List[bytes] = []
+		n_bytes = 0
+		last = time.monotonic()
+		while True:
+			timeout = max(0.0, self.flush_interval - (time.monotonic() - last))
+			try:
+				evt = self._q.get(timeout=timeout if lines else None)
+			except queue.Empty:
+				evt = ...
+			if evt is None:  # close() sentinel: everything queued before it is in `lines`
+				if lines:
+					self._write(lines)
+				if self._f is not None:
+					self._f.close()
+				return
+			if evt is not ...:
+				try:
+					line = orjson.dumps(evt, default=str, option=_OPTS)
+					lines.append(line)
+					n_bytes += len(line)
+				except TypeError:
+					self.errors += 1
+			if lines and (n_bytes >= self.flush_bytes or time.monotonic() - last >= self.flush_interval):
+				self._write(lines)
+				lines = []
+				n_bytes = 0
+				last = time.monotonic()
+			elif not lines:
+				last = time.monotonic()
+
+	def close(self, timeout: float = 5.0):
+		"""Drain queued events to disk and stop the writer."""
+		if self._closed:
+			return
+		self._closed = True
+		try:
+			if not self._thread.is_alive():
+				raise queue.Full
+			self._q.put(None, timeout=timeout)
+		except queue.Full:
+			# the writer died or is stuck on a full queue: don't hang shutdown on it
+			self.dropped += self._q.qsize()
+			return
+		self._thread.join(timeout)
+
+	def stats(self) -> Dict[str, int]:
+		return {"enqueued": self.enqueued, "written": self.written, "dropped": self.dropped,
+				"errors": self.errors, "queue_depth": self._q.qsize(),
+				"flushes": self.flushes, "rotations": self.rotations}
+
+_LOGGER: Optional[EventLogger] = None
+_LOCK = threading.Lock()
+
+def get_logger() -> EventLogger:
+	global _LOGGER
+	if _LOGGER is None:
+		with _LOCK:
+			if _LOGGER is None:
+				_LOGGER = EventLogger()
+				atexit.register(_LOGGER.close)
+	return _LOGGER
 
 def log_event(event: Dict[str, Any]) -> None:
-	os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+	rid = current_request_id()
 	evt = {"ts": time.time(), **event}
-	with open(LOG_PATH, 'a') as f:
-		f.write(json.dumps(evt, ensure_ascii=False) + "\n")
\ No newline at end of file
+	if rid is not None:
+		evt.setdefault("request_id", rid)
+	get_logger().log(evt)
+
+def logger_stats() -> Dict[str, int]:
+	return get_logger().stats()
+
+def close_logger():
+	if _LOGGER is not None:
+		_LOGGER.close()
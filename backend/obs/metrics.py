@@ -0,0 +1,145 @@
+"""
+In-process metrics in Prometheus text format: fixed-bucket latency histograms per
+stage, token counters and request status counts. Pure stdlib so obs.report can use
+the same histograms offline.
+"""
+import bisect, threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# seconds; the same buckets serve every stage from a BM25 lookup to LLM generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+				   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# metrics key -> stage label
+STAGE_KEYS = {
+	"t_bm25_ms": "bm25",
+	"t_dense_ms": "dense",
+	"t_rrf_ms": "rrf",
+	"t_rerank_ms": "rerank",
+	"t_retrieve_ms": "retrieve",
+	"t_gen_ms": "generate",
+	"t_first_token_ms": "first_token",
+	"t_llm_queue_ms": "llm_queue",
+	"t_cache_ms": "cache_lookup",
+}
+TOKEN_KEYS = ("prompt_tokens", "completion_tokens")
+
+class Histogram:
+	"""Fixed-bucket histogram; constant memory regardless of how many values are observed."""
+	def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, v: float):
+		self.counts[bisect.bisect_left(self.buckets, v)] += 1
+		self.sum += v
+		self.count += 1
+
+	def quantile(self, q: float) -> Optional[float]:
+		"""Estimate by linear interpolation inside the bucket holding the q-th value."""
+		if not self.count:
+			return None
+		rank = q * self.count
+		cum = 0
+		for i, c in enumerate(self.counts):
+			if c and cum + c >= rank:
+				lo = self.buckets[i - 1] if i > 0 else 0.0
+				if i == len(self.buckets):  # +Inf bucket: best we can say is its lower edge
+					return lo
+				return lo + (self.buckets[i] - lo) * (rank - cum) / c
+			cum += c
+		return self.buckets[-1]
+
+def _labels(labels: Tuple[Tuple[str, str], ...], le: Optional[str] = None) -> str:
+	parts = [f'{k}="{v}"' for k, v in labels]
+	if le is not None:
+		parts.append(f'le="{le}"')
+	return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metrics:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._hists: Dict[str, Dict[tuple, Histogram]] = defaultdict(dict)
+		self._counters: Dict[str, Dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+		self._help: Dict[str, str] = {}
+
+	def observe(self, name: str, value: float, help: str = "", **labels):
+		key = tuple(sorted(labels.items()))
+		with self._lock:
+			h = self._hists[name].get(key)
+			if h is None:
+				h = self._hists[name][key] = Histogram()
+				self._help.setdefault(name, help)
+			h.observe(value)
+
+	def inc(self, name: str, value: float = 1, help: str = "", **labels):
+		key = tuple(sorted(labels.items()))
+		with self._lock:
+			self._counters[name][key] += value
+			self._help.setdefault(name, help)
+
+	def render(self, gauges: Optional[List[Tuple[str, str, Dict[str, str], float]]] = None) -> str:
+		"""Prometheus text exposition (version 0.0.4). `gauges` are (name, help, labels, value) read at scrape time."""
+		out: List[str] = []
+		with self._lock:
+			for name, series in sorted(self._counters.items()):
+				out += [f"# HELP {name} {self._help.get(name, '')}", f"# TYPE {name} counter"]
+				for key, v in sorted(series.items()):
+					out.append(f"{name}{_labels(key)} {v:g}")
+			for name, series in sorted(self._hists.items()):
+				out += [f"# HELP {name} {self._help.get(name, '')}", f"# TYPE {name} histogram"]
+				for key, h in sorted(series.items()):
+					cum = 0
+					for le, c in zip(h.buckets, h.counts):
+						cum += c
+						out.append(f"{name}_bucket{_labels(key, format(le, 'g'))} {cum}")
+					out.append(f"{name}_bucket{_labels(key, '+Inf')} {h.count}")
+					out.append(f"{name}_sum{_labels(key)} {h.sum:.6f}")
+					out.append(f"{name}_count{_labels(key)} {h.count}")
+		seen = set()
+		for name, help, labels, value in gauges or []:
+			if name not in seen:
+				out += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+				seen.add(name)
+			out.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value:g}")
+		return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+
+def stages_run(mode: str, rerank: bool) -> Tuple[str, ...]:
+	"""Retrieval stages a search in `mode` actually executes (the rest report 0 ms)."""
+	mode = mode.lower()
+	if mode == "bm25":
+		return ("bm25",)
+	if mode == "dense":
+		return ("dense",)
+	return ("bm25", "dense", "rrf") + (("rerank",) if rerank or mode == "hybrid_rerank" else ())
+
+def record_timings(route: str, timings: Dict, mode: str = "hybrid", rerank: bool = False):
+	"""Observe every stage timing present in a search/answer metrics dict."""
+	ran = stages_run(mode, rerank)
+	retrieval = {"bm25", "dense", "rrf", "rerank"}
+	for key, stage in STAGE_KEYS.items():
+		v = timings.get(key)
+		if not isinstance(v, (int, float)) or (stage in retrieval and stage not in ran):
+			continue
+		METRICS.observe("docuchat_stage_latency_seconds", v / 1000, route=route, stage=stage,
+						help="Per-stage latency, from the timings returned with each response.")
+	for key in TOKEN_KEYS:
+		v = timings.get(key)
+		if isinstance(v, int):
+			METRICS.inc("docuchat_llm_tokens_total", v, kind=key[:-len("_tokens")],
+						help="LLM tokens used for answers.")
+	if timings.get("cache") in ("hit", "miss"):
+		METRICS.inc("docuchat_answer_cache_total", result=timings["cache"],
+					help="Semantic answer cache lookups.")
+
+def record_request(route: str, status: str, seconds: Optional[float] = None):
+	METRICS.inc("docuchat_requests_total", route=route, status=str(status),
+				help="Requests by route and outcome status.")
+	if seconds is not None:
+		METRICS.observe("docuchat_request_latency_seconds", seconds, route=route,
+						help="End-to-end request latency.")
@@ -1,5 +1,6 @@
 import json, argparse, statistics as stats
 from collections import defaultdict
+from backend.obs.metrics import Histogram
 
 def load(path):
 	with open(path, "r") as f:
@@ -14,26 +15,97 @@ def load(path):
 def fmt(ms_list):
 	if not ms_list: return "-"
 	p50 = f"p50={int(stats.median(ms_list))}ms"
-	p95 = f"p95={int(stats.quantiles(ms_list, n=20)[18])}ms"
+	# quantiles() needs two points
+	p95 = f"p95={int(stats.quantiles(ms_list, n=20)[18] if len(ms_list) > 1 else ms_list[0])}ms"
 	n = f"n={len(ms_list)}"
 	return  f"{p50} {p95} {n}"
 
+# geometric ms buckets (10% apart, 0.1ms .. ~16min): constant memory, percentiles within ~5%
+STREAM_BUCKETS_MS = tuple(0.1 * 1.1 ** i for i in range(170))
+STREAM_KEYS = [("retrieve", "t_retrieve_ms"), ("generate", "t_gen_ms"), ("first token", "t_first_token_ms"),
+			   ("bm25", "t_bm25_ms"), ("dense", "t_dense_ms"), ("rrf", "t_rrf_ms"), ("rerank", "t_rerank_ms")]
+
+def fmt_hist(h):
+	if not h.count: return "-"
+	return f"p50~{int(h.quantile(0.5))}ms p95~{int(h.quantile(0.95))}ms n={h.count}"
+
+def stream_report(path):
+	"""
+	Single pass in constant memory: fixed-bucket histograms instead of value lists,
+	so percentiles are bucket-interpolated estimates.
+	"""
+	hists = {name: Histogram(STREAM_BUCKETS_MS) for name, _ in STREAM_KEYS}
+	tok_sum, tok_n = defaultdict(int), defaultdict(int)
+	by_status = defaultdict(int)
+	n_rows = n_hit = n_cached = 0
+	for e in load(path):
+		if e.get("route") != "chat" or e.get("stage") != "answer":
+			continue
+		n_rows += 1
+		by_status[e.get("status")] += 1
+		if e.get("cache") in ("hit", "miss"):
+			n_cached += 1
+			if e["cache"] == "hit":
+				n_hit += 1
+				continue
+		for name, key in STREAM_KEYS:
+			if isinstance(e.get(key), int):
+				hists[name].observe(e[key])
+		for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+			if isinstance(e.get(key), int):
+				tok_sum[key] += e[key]
+				tok_n[key] += 1
+	if not n_rows:
+		print("No chat answer events found")
+		return
+
+	print("\n=== Latency Summary ===")
+	print("retrieve:", fmt_hist(hists["retrieve"]))
+	print("generate:", fmt_hist(hists["generate"]))
+	if hists["first token"].count:
+		print("first token:", fmt_hist(hists["first token"]))
+	print("\nsub-stages:  bm25:", fmt_hist(hists["bm25"]), " dense:", fmt_hist(hists["dense"]),
+		  " rrf:", fmt_hist(hists["rrf"]), " rerank:", fmt_hist(hists["rerank"]))
+	if tok_n["total_tokens"]:
+		mean = {k: int(tok_sum[k] / tok_n[k]) if tok_n[k] else 0 for k in tok_sum}
+		print("\n=== Token Usage ===")
+		print(f"prompt: mean={mean.get('prompt_tokens', 0)}  completion: mean={mean.get('completion_tokens', 0)}  total: mean={mean['total_tokens']}")
+	if n_cached:
+		print("\n=== Answer Cache ===")
+		print(f"hit rate: {n_hit / n_cached:.1%} ({n_hit}/{n_cached})")
+	print("\n=== Status Counts ===")
+	for k,v in by_status.items(): print(f"{k}: {v}")
+
 def main():
 	ap = argparse.ArgumentParser()
 	ap.add_argument("--log", default="runtime/requests.log")
+	ap.add_argument("--stream", action="store_true",
+					help="constant-memory single pass with bucketed percentiles (for very large logs)")
 	args = ap.parse_args()
 
+	if args.stream:
+		stream_report(args.log)
+		return
+
 	rows = [e for e in load(args.log) if e.get("route")=="chat" and e.get("stage")=="answer"]
 	if not rows:
 		print("No chat answer events found")
 		return
 
+	# Answer cache: hits skip retrieval and generation, so keep them out of the stage latencies
+	cached = [e for e in rows if e.get("cache") in ("hit", "miss")]
+	hits = [e for e in cached if e["cache"] == "hit"]
+	rows = [e for e in rows if e.get("cache") != "hit"]
+
 	# Overall latency
 	t_retrieve = [e.get("t_retrieve_ms") for e in rows if isinstance(e.get("t_retrieve_ms"), int)]
-	t_gen = [e.get("t_gen_ms") for e in rows if instance(e.get("t_gen_ms"), int)]
+	t_gen = [e.get("t_gen_ms") for e in rows if isinstance(e.get("t_gen_ms"), int)]
 	print("\n=== Latency Summary ===")
 	print("retrieve:", fmt(t_retrieve))
 	print("generate:", fmt(t_gen))
+	t_first = [e.get("t_first_token_ms") for e in rows if isinstance(e.get("t_first_token_ms"), int)]
+	if t_first:
+		print("first token:", fmt(t_first))
 
 	# Sub-stage timings
 	t_bm25 = [e.get("t_bm25_ms") for e in rows if isinstance(e.get("t_bm25_ms"), int)]
@@ -51,9 +123,14 @@ def main():
 		print("\n=== Token Usage ===")
 		print(f"prompt: mean={int(stats.mean(ptoks))}  completion: mean={int(stats.mean(ctoks))}  total: mean={int(stats.mean(ttoks))}")
 
+	if cached:
+		print("\n=== Answer Cache ===")
+		print(f"hit rate: {len(hits) / len(cached):.1%} ({len(hits)}/{len(cached)})  "
+			  f"lookup: {fmt([e.get('t_cache_ms') for e in hits if isinstance(e.get('t_cache_ms'), int)])}")
+
 	# Status breakdown
 	by_status = defaultdict(int)
-	for e in rows: by_status[e.get("status")] += 1
+	for e in rows + hits: by_status[e.get("status")] += 1
 	print("\n=== Status Counts ===")
 	for k,v in by_status.items(): print(f"{k}: {v}")
 
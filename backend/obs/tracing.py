@@ -0,0 +1,178 @@
+"""
+Lightweight request tracing. `trace()` opens a request (id from the caller or a new
+one) and `span()` times a nested step with perf_counter_ns. The active trace lives
+in a contextvar, so it follows the request into asyncio.to_thread / threadpool calls
+without being passed around; outside a trace `span()` is a no-op.
+
+Finished traces go to the event log (stage="trace") and/or an OTLP/JSON file,
+one ExportTraceServiceRequest per line (TRACE_EXPORT=log|otlp|log,otlp|off).
+"""
+import os, time, uuid, atexit, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACE_EXPORT = {m.strip() for m in os.getenv("TRACE_EXPORT", "log").split(",") if m.strip()}
+TRACE_OTLP_PATH = os.getenv("TRACE_OTLP_PATH", "runtime/traces.otlp.jsonl")
+SERVICE_NAME = "docuchat-pro"
+
+class Span:
+	__slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attrs", "error")
+
+	def __init__(self, name: str, span_id: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+		self.name = name
+		self.span_id = span_id
+		self.parent_id = parent_id
+		self.start_ns = time.perf_counter_ns()
+		self.end_ns = 0
+		self.attrs = attrs
+		self.error: Optional[str] = None
+
+	def set(self, **attrs):
+		self.attrs.update(attrs)
+
+class _NoopSpan:
+	def set(self, **attrs):
+		pass
+
+_NOOP = _NoopSpan()
+
+class Trace:
+	def __init__(self, name: str, request_id: Optional[str] = None):
+		self.name = name
+		self.request_id = request_id or uuid.uuid4().hex
+		self.trace_id = uuid.uuid4().hex
+		# perf_counter for durations; one wall-clock reading to place them in time
+		self.t0_ns = time.perf_counter_ns()
+		self.epoch_ns = time.time_ns()
+		self.spans: List[Span] = []
+		self._lock = threading.Lock()
+
+	def add(self, sp: Span):
+		with self._lock:
+			self.spans.append(sp)
+
+	def to_event(self) -> Dict[str, Any]:
+		spans = sorted(self.spans, key=lambda s: s.start_ns)
+		return {
+			"route": self.name,
+			"stage": "trace",
+			"request_id": self.request_id,
+			"trace_id": self.trace_id,
+			"dur_ms": round((max((s.end_ns for s in spans), default=self.t0_ns) - self.t0_ns) / 1e6, 3),
+			"spans": [{
+				"name": s.name,
+				"span_id": s.span_id,
+				"parent_id": s.parent_id,
+				"start_ms": round((s.start_ns - self.t0_ns) / 1e6, 3),
+				"dur_ms": round((s.end_ns - s.start_ns) / 1e6, 3),
+				**({"error": s.error} if s.error else {}),
+				**s.attrs,
+			} for s in spans],
+		}
+
+	def to_otlp(self) -> Dict[str, Any]:
+		def wall(ns: int) -> str:
+			return str(self.epoch_ns + ns - self.t0_ns)
+
+		def attr(k: str, v: Any) -> Dict[str, Any]:
+			if isinstance(v, bool):
+				return {"key": k, "value": {"boolValue": v}}
+			if isinstance(v, int):
+				return {"key": k, "value": {"intValue": str(v)}}
+			if isinstance(v, float):
+				return {"key": k, "value": {"doubleValue": v}}
+			return {"key": k, "value": {"stringValue": str(v)}}
+
+		spans = [{
+			"traceId": self.trace_id,
+			"spanId": s.span_id,
+			**({"parentSpanId": s.parent_id} if s.parent_id else {}),
+			"name": s.name,
+			"kind": 1,  # SPAN_KIND_INTERNAL
+			"startTimeUnixNano": wall(s.start_ns),
+			"endTimeUnixNano": wall(s.end_ns),
+			"attributes": [attr("request.id", self.request_id)] + [attr(k, v) for k, v in s.attrs.items()],
+			"status": {"code": 2, "message": s.error} if s.error else {},
+		} for s in self.spans]
+		return {"resourceSpans": [{
+			"resource": {"attributes": [attr("service.name", SERVICE_NAME)]},
+			"scopeSpans": [{"scope": {"name": "backend.obs.tracing"}, "spans": spans}],
+		}]}
+
+_TRACE: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_SPAN: ContextVar[Optional[str]] = ContextVar("span", default=None)
+_OTLP = None
+_OTLP_LOCK = threading.Lock()
+
+def current_trace() -> Optional[Trace]:
+	return _TRACE.get()
+
+def current_request_id() -> Optional[str]:
+	tr = _TRACE.get()
+	return tr.request_id if tr is not None else None
+
+def _reset(var: ContextVar, token):
+	try:
+		var.reset(token)
+	except ValueError:
+		# an async generator closed from another task (client went away): nothing to restore
+		pass
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Any]:
+	"""Time a step of the current request; `.set(**attrs)` adds attributes."""
+	tr = _TRACE.get()
+	if tr is None:
+		yield _NOOP
+		return
+	sp = Span(name, os.urandom(8).hex(), _SPAN.get(), attrs)
+	token = _SPAN.set(sp.span_id)
+	try:
+		yield sp
+	except BaseException as e:
+		sp.error = type(e).__name__
+		raise
+	finally:
+		sp.end_ns = time.perf_counter_ns()
+		_reset(_SPAN, token)
+		tr.add(sp)
+
+def record_span(name: str, start_ns: int, end_ns: int, error: Optional[str] = None, **attrs):
+	"""Attach an already-timed step (perf_counter_ns bounds) under the current span."""
+	tr = _TRACE.get()
+	if tr is None:
+		return
+	sp = Span(name, os.urandom(8).hex(), _SPAN.get(), attrs)
+	sp.start_ns, sp.end_ns, sp.error = start_ns, end_ns, error
+	tr.add(sp)
+
+@contextmanager
+def trace(name: str, request_id: Optional[str] = None, **attrs) -> Iterator[Trace]:
+	"""Open a request trace with a root span `name`; exported when the block exits."""
+	tr = Trace(name, request_id)
+	token = _TRACE.set(tr)
+	try:
+		with span(name, **attrs):
+			yield tr
+	finally:
+		_reset(_TRACE, token)
+		export(tr)
+
+def export(tr: Trace):
+	global _OTLP
+	if "log" in TRACE_EXPORT:
+		from backend.obs.logger import log_event
+		log_event(tr.to_event())
+	if "otlp" in TRACE_EXPORT:
+		from backend.obs.logger import EventLogger
+		if _OTLP is None:
+			with _OTLP_LOCK:
+				if _OTLP is None:
+					_OTLP = EventLogger(path=TRACE_OTLP_PATH)
+					atexit.register(_OTLP.close)
+		_OTLP.log(tr.to_otlp())
+
+def close_exporter():
+	if _OTLP is not None:
+		_OTLP.close()
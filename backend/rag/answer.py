@@ -1,18 +1,25 @@
-from typing import List, Dict, Optional
-import statistics, time
+from typing import List, Dict, Optional, AsyncIterator
+import statistics, time, asyncio
 
 from backend.rag.retrieve import Retriever
+from backend.rag.shards import open_retriever
+from backend.rag.filters import normalize_filters, filters_key
 from backend.rag.generate import build_prompt
 from backend.models.llm import get_llm
+from backend.rag.answer_cache import cache_from_env
 from backend.obs.logger import log_event
+from backend.obs.tracing import span
 
 class Answerer:
 	"""
 	Orchestrates: retrieve -> gate -> generate -> package
 	"""
-	def __init__(self, art_dir: str = "artifacts"):
-		self.retriever = Retriever(art_dir=art_dir)
+	def __init__(self, art_dir: str = "artifacts", retriever: Optional[Retriever] = None):
+		# pass the process's Retriever to avoid loading the index twice
+		self.retriever = retriever or open_retriever(art_dir)
 		self.llm = get_llm()
+		# semantic answer cache (None when ANSWER_CACHE_SIZE=0)
+		self.cache = cache_from_env()
 
 	def _contains_any(self, text: str, terms: List[str]) -> bool:
 		t = text.lower()
@@ -46,69 +53,186 @@ class Answerer:
 
 		return None
 
+	def _retrieve(self, q: str, k: int, rerank: bool, top_m: int, retrieval_mode: str,
+				  filters: Optional[Dict] = None):
+		t0 = time.time()
+		require_terms = [t for t in q.lower().split() if len(t) > 3]
+		mode = retrieval_mode.lower()
+		with span("retrieve"):
+			hits, rt = self.retriever.search(
+				q,
+				mode=("hybrid_rerank" if (mode == "hybrid" and rerank) else mode),
+				k=k,
+				k_dense=max(20, k*3),
+				k_bm25=max(20, k*3),
+				rerank=rerank,
+				top_m=top_m,
+				filters=filters
+			)
+			t_retrieve_ms = int((time.time() - t0) * 1000)
+			with span("post_filter", n_in=len(hits)) as sp:
+				hits = [h for h in hits if any(t in h["text"].lower() for t in require_terms)]
+				sp.set(n_out=len(hits))
+		return hits, rt, t_retrieve_ms
+
+	def _no_context(self, q: str, reason: str, rt: Dict, t_retrieve_ms: int) -> Dict:
+		res = {
+			"status": "no_context",
+			"reason": reason,
+			"answer": "I don't have enough information in the provided documents.",
+			"query": q,
+			"hits": [],
+			"metrics": {**rt, "t_retrieve_ms": t_retrieve_ms}
+		}
+		log_event({"route": "chat", "stage": "answer", "status": "no_context", "q": q, **res["metrics"]})
+		return res
+
+	@staticmethod
+	def _metrics(rt: Dict, t_retrieve_ms: int, t_gen_ms: int, usage: Dict) -> Dict:
+		return {
+			**rt,
+			"t_retrieve_ms": t_retrieve_ms,
+			"t_gen_ms": max(usage.get("gen_ms") or 0, t_gen_ms),
+			"prompt_tokens": usage.get("prompt_tokens"),
+			"completion_tokens": usage.get("completion_tokens"),
+			"total_tokens": usage.get("total_tokens"),
+			# LLM gateway: wait for a provider slot, retries, and whether an identical
+			# concurrent request's completion was shared
+			"t_llm_queue_ms": usage.get("queue_ms"),
+			"llm_retries": usage.get("retries"),
+			"llm_coalesced": bool(usage.get("coalesced")),
+		}
+
+	def _prompt(self, q: str, hits: List[Dict]):
+		"""Prompt with the context packed into CONTEXT_TOKENS of the LLM's tokens, and the packing stats."""
+		packed: Dict = {}
+		with span("build_prompt", n_hits=len(hits)) as sp:
+			prompt = build_prompt(q, hits, self.llm.count_tokens, stats=packed)
+			sp.set(**packed)
+		return prompt, packed
+
+	@staticmethod
+	def _public_hits(hits: List[Dict]) -> List[Dict]:
+		return [{k: v for k, v in h.items() if k != "text"} for h in hits]
+
+	def _cache_lookup(self, q: str, **params):
+		"""
+		(scope, query vector, cached response) for `q`; the response is None on a miss.
+		The query embedding lands in the retriever's cache, so a miss doesn't embed twice.
+		"""
+		if self.cache is None:
+			return None, None, None
+		t0 = time.time()
+		with span("answer_cache") as sp:
+			scope = self.cache.scope(self.retriever.index_version, model=getattr(self.llm, "model", ""), **params)
+			qvec = self.retriever.embed_query(q)[0]
+			cached, sim = self.cache.get(scope, qvec)
+			sp.set(hit=cached is not None)
+		if cached is None:
+			return scope, qvec, None
+		cached["query"] = q
+		cached["metrics"] = {"cache": "hit", "cache_sim": round(sim, 4),
+							 "t_cache_ms": int((time.time() - t0) * 1000)}
+		log_event({"route": "chat", "stage": "answer", "status": cached["status"], "q": q, **cached["metrics"]})
+		return scope, qvec, cached
+
 	# ---- public entry ----
 	def answer(self, q: str, k: int = 4, rerank: bool = True, top_m: int = 24,
 				max_tokens: int = 384, temperature: float = 0.1,
-				retrieval_mode: str = "hybrid") -> Dict:
+				retrieval_mode: str = "hybrid", filters: Optional[Dict] = None) -> Dict:
 
-		t0 = time.time()
-		require_terms = [t for t in q.lower().split() if len(t) > 3]
-		mode = retrieval_mode.lower()
-		hits, rt = self.retriever.search(
-			q,
-			mode=("hybrid_rerank" if (mode == "hybrid" and rerank) else mode),
-			k=k,
-			k_dense=max(20, k*3),
-			k_bm25=max(20, k*3),
-			rerank=rerank,
-			top_m=top_m
-		)
-		t_retrieve_ms = int((time.time() - t0) * 1000)
-		hits = [h for h in hits if any(t in h["text"].lower() for t in require_terms)]
+		filters = normalize_filters(filters)
+		scope, qvec, cached = self._cache_lookup(q, k=k, rerank=rerank, top_m=top_m, max_tokens=max_tokens,
+												 temperature=temperature, retrieval_mode=retrieval_mode,
+												 filters=filters_key(filters))
+		if cached is not None:
+			return cached
+
+		hits, rt, t_retrieve_ms = self._retrieve(q, k, rerank, top_m, retrieval_mode, filters)
+		if scope is not None:
+			rt["cache"] = "miss"
 
 		abstain_reason = self._should_abstain(q, hits, rerank)
 		if abstain_reason:
-			res = {
-				"status": "no_context",
-				"reason": abstain_reason,
-				"answer": "I don't have enough information in the provided documents.",
-				"query": q,
-				"hits": [],
-				"metrics": {**rt, "t_retrieve_ms": t_retrieve_ms}
-			}
-			log_event({"route": "chat", "stage": "answer", "status": "no_context", "q": q, **res["metrics"]})
-			return res
+			return self._no_context(q, abstain_reason, rt, t_retrieve_ms)
 
 		# build rpompt with context
-		prompt = build_prompt(q, hits)
+		prompt, packed = self._prompt(q, hits)
 		t1 = time.time()
 		# call LLM
 		text, usage = self.llm.generate(prompt, max_tokens=max_tokens, temperature=temperature)
 		t_gen_ms = int((time.time() - t1) * 1000)
 
-		metrics = {
-			**rt,
-			"t_retrieve_ms": t_retrieve_ms,
-			"t_gen_ms": max(usage.get("gen_ms", t_gen_ms), t_gen_ms),
-			"prompt_tokens": usage.get("prompt_tokens"),
-			"completion_tokens": usage.get("completion_tokens"),
-			"total_tokens": usage.get("total_tokens"),
-		}
+		metrics = {**self._metrics(rt, t_retrieve_ms, t_gen_ms, usage), **packed}
 
 		log_event({"route": "chat", "stage": "answer", "status": "ok", "q": q, **metrics})
 
-		return{
+		res = {
 			"status": "ok",
 			"query": q,
 			"rerank": rerank,
 			"top_m": top_m,
-			"hits": [
-				{k: v for k, v in h.items() if k != "text"}
-				for h in hits
-			],
+			"hits": self._public_hits(hits),
 			"answer": text,
 			"metrics": metrics,
-	}
+		}
+		if scope is not None:
+			self.cache.put(scope, qvec, res)
+		return res
+
+	async def answer_stream(self, q: str, k: int = 4, rerank: bool = True, top_m: int = 24,
+							max_tokens: int = 384, temperature: float = 0.1,
+							retrieval_mode: str = "hybrid", filters: Optional[Dict] = None) -> AsyncIterator[Dict]:
+		"""
+		Streaming variant of answer(). Yields events in order:
+		{"event": "hits"}, then {"event": "token"} per LLM delta, then {"event": "metrics"}
+		with the full answer; or a single {"event": "no_context"}.
+		A cache hit replays the same events, with the answer as a single token.
+		"""
+		filters = normalize_filters(filters)
+		scope, qvec, cached = await asyncio.to_thread(
+			self._cache_lookup, q, k=k, rerank=rerank, top_m=top_m, max_tokens=max_tokens,
+			temperature=temperature, retrieval_mode=retrieval_mode, filters=filters_key(filters))
+		if cached is not None:
+			yield {"event": "hits", "data": {"query": q, "rerank": cached["rerank"], "top_m": cached["top_m"],
+											 "hits": cached["hits"]}}
+			yield {"event": "token", "data": cached["answer"]}
+			yield {"event": "metrics", "data": {"status": "ok", "query": q,
+												"answer": cached["answer"], "metrics": cached["metrics"]}}
+			return
+
+		# retrieval is CPU-bound and blocking: keep it off the event loop
+		hits, rt, t_retrieve_ms = await asyncio.to_thread(self._retrieve, q, k, rerank, top_m, retrieval_mode, filters)
+		if scope is not None:
+			rt["cache"] = "miss"
+
+		abstain_reason = self._should_abstain(q, hits, rerank)
+		if abstain_reason:
+			yield {"event": "no_context", "data": self._no_context(q, abstain_reason, rt, t_retrieve_ms)}
+			return
+
+		yield {"event": "hits", "data": {"query": q, "rerank": rerank, "top_m": top_m,
+										 "hits": self._public_hits(hits)}}
 
+		# context packing runs the LLM's tokenizer: also off the loop
+		prompt, packed = await asyncio.to_thread(self._prompt, q, hits)
+		usage: Dict = {}
+		parts: List[str] = []
+		t1 = time.time()
+		t_first = None
+		async for tok in self.llm.astream(prompt, max_tokens=max_tokens, temperature=temperature, usage=usage):
+			if t_first is None:
+				t_first = time.time()
+			parts.append(tok)
+			yield {"event": "token", "data": tok}
+		t_gen_ms = int((time.time() - t1) * 1000)
 
+		metrics = {**self._metrics(rt, t_retrieve_ms, t_gen_ms, usage), **packed}
+		metrics["t_first_token_ms"] = int(((t_first or time.time()) - t1) * 1000)
+		log_event({"route": "chat", "stage": "answer", "status": "ok", "stream": True, "q": q, **metrics})
 
+		answer = "".join(parts).strip()
+		if scope is not None:
+			self.cache.put(scope, qvec, {"status": "ok", "query": q, "rerank": rerank, "top_m": top_m,
+										 "hits": self._public_hits(hits), "answer": answer, "metrics": metrics})
+		yield {"event": "metrics", "data": {"status": "ok", "query": q, "answer": answer, "metrics": metrics}}
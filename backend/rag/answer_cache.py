@@ -0,0 +1,160 @@
+import os, time, sqlite3, threading, orjson
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+class _Scope:
+	"""Unit vectors of one scope as rows of a contiguous matrix, so a lookup is one matmul."""
+	__slots__ = ("vecs", "ids", "created", "n")
+
+	def __init__(self, dim: int):
+		self.vecs = np.zeros((8, dim), dtype=np.float32)
+		self.ids = np.zeros(8, dtype=np.int64)
+		self.created = np.zeros(8, dtype=np.float64)
+		self.n = 0
+
+	def add(self, eid: int, vec: np.ndarray, created: float) -> int:
+		if self.n == len(self.ids):
+			cap = 2 * len(self.ids)
+			self.vecs = np.resize(self.vecs, (cap, self.vecs.shape[1]))
+			self.ids = np.resize(self.ids, cap)
+			self.created = np.resize(self.created, cap)
+		row = self.n
+		self.vecs[row], self.ids[row], self.created[row] = vec, eid, created
+		self.n += 1
+		return row
+
+	def remove(self, row: int) -> Optional[int]:
+		"""Drop `row` by moving the last row into it; returns the id of the moved entry."""
+		self.n -= 1
+		last = self.n
+		if row == last:
+			return None
+		self.vecs[row], self.ids[row], self.created[row] = self.vecs[last], self.ids[last], self.created[last]
+		return int(self.ids[row])
+
+class SemanticAnswerCache:
+	"""
+	Answers keyed on query-embedding similarity within a scope. The scope is the
+	index version plus every generation parameter that changes the answer, so a
+	paraphrase only hits when it would have been answered from the same corpus the
+	same way. Memory tier: LRU bounded by `maxsize` with a TTL. Optional SQLite tier
+	at `path`: written through, and reloaded on start-up.
+
+	Each scope keeps its vectors in one matrix, so a lookup is a single matmul; rows
+	past the TTL are masked out there and removed by a sweep on `put`, at most every
+	ttl/4 seconds.
+	"""
+	def __init__(self, threshold: float = 0.95, maxsize: int = 1024, ttl: float = 3600,
+				 path: Optional[str] = None, disk_maxsize: int = 100_000):
+		self.threshold = threshold
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.disk_maxsize = disk_maxsize
+		self._lock = threading.Lock()
+		# id -> [scope, row in the scope matrix, response bytes]; order is LRU
+		self._entries: "OrderedDict[int, List]" = OrderedDict()
+		self._scopes: Dict[str, _Scope] = {}
+		self._next_id = 0
+		self._swept = time.time()
+		self.hits = 0
+		self.misses = 0
+		self._db = None
+		if path:
+			os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+			self._db = sqlite3.connect(path, check_same_thread=False)
+			self._db.execute("CREATE TABLE IF NOT EXISTS answers "
+							 "(scope TEXT, emb BLOB, response BLOB, created REAL)")
+			self._load()
+
+	@staticmethod
+	def scope(index_version: str, **params) -> str:
+		return index_version + "|" + "|".join(f"{k}={params[k]}" for k in sorted(params))
+
+	def _expired(self, created: float, now: float) -> bool:
+		return self.ttl > 0 and now - created > self.ttl
+
+	def _load(self):
+		now = time.time()
+		rows = self._db.execute("SELECT scope, emb, response, created FROM answers "
+								"ORDER BY created DESC LIMIT ?", (self.maxsize,)).fetchall()
+		for scope, emb, response, created in reversed(rows):
+			if not self._expired(created, now):
+				self._insert(scope, np.frombuffer(emb, dtype=np.float32), response, created)
+
+	def _insert(self, scope: str, vec: np.ndarray, response: bytes, created: float):
+		sc = self._scopes.get(scope)
+		if sc is None:
+			sc = self._scopes[scope] = _Scope(len(vec))
+		eid = self._next_id
+		self._next_id += 1
+		self._entries[eid] = [scope, sc.add(eid, vec, created), response]
+		while len(self._entries) > self.maxsize:
+			self._remove(next(iter(self._entries)))
+
+	def _remove(self, eid: int):
+		scope, row, _ = self._entries.pop(eid)
+		sc = self._scopes[scope]
+		moved = sc.remove(row)
+		if moved is not None:
+			self._entries[moved][1] = row
+		if sc.n == 0:
+			del self._scopes[scope]
+
+	def _sweep(self, now: float):
+		if self.ttl <= 0 or now - self._swept < self.ttl / 4:
+			return
+		self._swept = now
+		for sc in list(self._scopes.values()):
+			for eid in sc.ids[:sc.n][sc.created[:sc.n] < now - self.ttl].tolist():
+				self._remove(eid)
+
+	def get(self, scope: str, qvec: np.ndarray) -> Tuple[Optional[Dict], float]:
+		"""Best cached response in `scope` with cosine >= threshold, and its similarity."""
+		q = np.asarray(qvec, dtype=np.float32).ravel()
+		now = time.time()
+		with self._lock:
+			sc = self._scopes.get(scope)
+			best_sim = -1.0
+			if sc is not None:
+				sims = sc.vecs[:sc.n] @ q
+				if self.ttl > 0:
+					sims[sc.created[:sc.n] < now - self.ttl] = -np.inf
+				row = int(np.argmax(sims))
+				best_sim = float(sims[row])
+			if best_sim < self.threshold:
+				self.misses += 1
+				return None, max(best_sim, -1.0)
+			eid = int(sc.ids[row])
+			self._entries.move_to_end(eid)
+			self.hits += 1
+			blob = self._entries[eid][2]
+		return orjson.loads(blob), best_sim
+
+	def put(self, scope: str, qvec: np.ndarray, response: Dict):
+		vec = np.array(qvec, dtype=np.float32).ravel()
+		blob = orjson.dumps(response)
+		created = time.time()
+		with self._lock:
+			self._sweep(created)
+			self._insert(scope, vec, blob, created)
+			if self._db is not None:
+				self._db.execute("INSERT INTO answers VALUES (?, ?, ?, ?)", (scope, vec.tobytes(), blob, created))
+				self._db.execute("DELETE FROM answers WHERE rowid NOT IN "
+								 "(SELECT rowid FROM answers ORDER BY created DESC LIMIT ?)", (self.disk_maxsize,))
+				self._db.commit()
+
+	def stats(self) -> Dict[str, int]:
+		return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+def cache_from_env() -> Optional[SemanticAnswerCache]:
+	"""ANSWER_CACHE_SIZE=0 disables the cache; ANSWER_CACHE_PATH enables the SQLite tier."""
+	size = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+	if size <= 0:
+		return None
+	return SemanticAnswerCache(
+		threshold=float(os.getenv("ANSWER_CACHE_SIM", "0.95")),
+		maxsize=size,
+		ttl=float(os.getenv("ANSWER_CACHE_TTL_S", "3600")),
+		path=os.getenv("ANSWER_CACHE_PATH") or None,
+	)
@@ -0,0 +1,262 @@
+import os, mmap, orjson
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Tuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from backend.rag.filters import RowSet
+
+# Okapi BM25 defaults (same as rank_bm25.BM25Okapi)
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+META_FILE = "bm25_meta.json"
+TERMS_FILE = "bm25_terms.bin"
+TERM_OFFSETS_FILE = "bm25_term_offsets.npy"
+INDPTR_FILE = "bm25_indptr.npy"
+DOCS_FILE = "bm25_docs.npy"
+TFS_FILE = "bm25_tfs.npy"
+WEIGHTS_FILE = "bm25_weights.npy"
+DOC_LENS_FILE = "bm25_doc_lens.npy"
+
+def tokenize(text: str) -> List[str]:
+	# keep in sync with the query side: plain whitespace split
+	return text.split()
+
+def okapi_idf(df: np.ndarray, n_docs: int, epsilon: float = EPSILON) -> np.ndarray:
+	"""
+	BM25Okapi idf, including its floor: negative idfs are replaced by
+	epsilon * mean(idf) so very common terms still score a little.
+	"""
+	idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+	if len(idf):
+		idf[idf < 0] = epsilon * float(idf.mean())
+	return idf
+
+def corpus_stats(tokenized: List[List[str]], live: Optional[np.ndarray] = None,
+				 epsilon: float = EPSILON) -> Dict:
+	"""
+	Corpus-wide idf per term and average doc length over live rows. Shards built with
+	these get the weights (and so the scores) of one index over the whole corpus.
+	"""
+	df: Counter = Counter()
+	n_docs = total = 0
+	for i, toks in enumerate(tokenized):
+		if live is not None and not live[i]:
+			continue
+		df.update(set(toks))
+		total += len(toks)
+		n_docs += 1
+	terms = list(df)
+	idf = okapi_idf(np.asarray([df[t] for t in terms], dtype=np.float64), n_docs, epsilon)
+	return {"idf": dict(zip(terms, idf.tolist())), "avgdl": total / n_docs if n_docs else 0.0, "n_docs": n_docs}
+
+def term_weights(tfs: np.ndarray, dl: np.ndarray, idf: np.ndarray, avgdl: float,
+				k1: float = K1, b: float = B) -> np.ndarray:
+	tfs = tfs.astype(np.float64)
+	return idf * (tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * dl / avgdl)))
+
+def write_bm25_index(out_dir: str, terms: List[bytes], t_ids: np.ndarray, d_ids: np.ndarray,
+					tfs: np.ndarray, doc_lens: np.ndarray, live: Optional[np.ndarray] = None,
+					k1: float = K1, b: float = B, epsilon: float = EPSILON,
+					corpus: Optional[Dict] = None) -> Dict:
+	"""
+	Write a CSR inverted index from (term id, doc, tf) triplets. `terms` must be sorted
+	bytewise. Rows outside `live` (tombstones) keep their row number but get no postings
+	and are left out of the corpus statistics, so scores equal a fresh build over live rows.
+	`corpus` (see corpus_stats) replaces this index's own idf / avgdl, for shards.
+	"""
+	os.makedirs(out_dir, exist_ok=True)
+	n_rows = len(doc_lens)
+	live = np.ones(n_rows, dtype=bool) if live is None else live
+	keep = live[d_ids]
+	t_ids, d_ids, tfs = t_ids[keep], d_ids[keep], tfs[keep]
+	doc_lens = np.where(live, doc_lens, 0)
+
+	# drop terms that only occurred in dead rows, renumbering the rest
+	used = np.bincount(t_ids, minlength=len(terms)) > 0
+	remap = np.cumsum(used) - 1
+	terms = [t for t, u in zip(terms, used) if u]
+	t_ids = remap[t_ids]
+
+	perm = np.lexsort((d_ids, t_ids))
+	t_ids, d_ids, tfs = t_ids[perm], d_ids[perm], tfs[perm]
+	indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+	np.cumsum(np.bincount(t_ids, minlength=len(terms)), out=indptr[1:])
+
+	n_docs = int(live.sum())
+	if corpus is None:
+		avgdl = float(doc_lens.sum()) / n_docs if n_docs else 0.0
+		idf = okapi_idf(np.diff(indptr).astype(np.float64), n_docs, epsilon)
+	else:
+		avgdl = float(corpus["avgdl"])
+		idf = np.asarray([corpus["idf"][t.decode("utf-8")] for t in terms], dtype=np.float64)
+	if len(d_ids) and avgdl > 0:
+		w = term_weights(tfs, doc_lens[d_ids], idf[t_ids], avgdl, k1, b)
+	else:
+		w = np.zeros(len(d_ids))
+
+	offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+	with open(os.path.join(out_dir, TERMS_FILE), "wb") as f:
+		for i, t in enumerate(terms):
+			f.write(t)
+			offsets[i + 1] = offsets[i] + len(t)
+	np.save(os.path.join(out_dir, TERM_OFFSETS_FILE), offsets)
+	np.save(os.path.join(out_dir, INDPTR_FILE), indptr)
+	np.save(os.path.join(out_dir, DOCS_FILE), d_ids.astype(np.int32))
+	np.save(os.path.join(out_dir, TFS_FILE), tfs.astype(np.int32))
+	np.save(os.path.join(out_dir, WEIGHTS_FILE), w.astype(np.float32))
+	np.save(os.path.join(out_dir, DOC_LENS_FILE), doc_lens.astype(np.int32))
+	meta = {"n_docs": n_rows, "n_live": n_docs, "n_terms": len(terms), "n_postings": int(len(d_ids)),
+			"avgdl": avgdl, "k1": k1, "b": b, "epsilon": epsilon,
+			"corpus_n_docs": n_docs if corpus is None else int(corpus["n_docs"])}
+	with open(os.path.join(out_dir, META_FILE), "wb") as f:
+		f.write(orjson.dumps(meta))
+	return meta
+
+def _triplets(tokenized: List[List[str]], vocab: Dict[str, int], row0: int = 0):
+	t_ids: List[int] = []
+	d_ids: List[int] = []
+	tf_list: List[int] = []
+	doc_lens = np.zeros(len(tokenized), dtype=np.int64)
+	for d, toks in enumerate(tokenized):
+		doc_lens[d] = len(toks)
+		for term, tf in Counter(toks).items():
+			t_ids.append(vocab.setdefault(term, len(vocab)))
+			d_ids.append(row0 + d)
+			tf_list.append(tf)
+	return (np.asarray(t_ids, dtype=np.int64), np.asarray(d_ids, dtype=np.int64),
+			np.asarray(tf_list, dtype=np.int64), doc_lens)
+
+def _sorted_vocab(vocab: Dict[str, int]) -> Tuple[List[bytes], np.ndarray]:
+	# renumber term ids in byte order so lookups can binary-search the term blob
+	terms = [t.encode("utf-8") for t in vocab]
+	order = sorted(range(len(terms)), key=terms.__getitem__)
+	remap = np.empty(len(terms), dtype=np.int64)
+	remap[order] = np.arange(len(terms))
+	return [terms[i] for i in order], remap
+
+def build_bm25_index(tokenized: List[List[str]], out_dir: str, live: Optional[np.ndarray] = None,
+					k1: float = K1, b: float = B, epsilon: float = EPSILON,
+					corpus: Optional[Dict] = None) -> Dict:
+	vocab: Dict[str, int] = {}
+	t_ids, d_ids, tfs, doc_lens = _triplets(tokenized, vocab)
+	terms, remap = _sorted_vocab(vocab)
+	return write_bm25_index(out_dir, terms, remap[t_ids], d_ids, tfs, doc_lens, live, k1, b, epsilon, corpus)
+
+def update_bm25_index(out_dir: str, new_tokenized: List[List[str]], live: np.ndarray) -> Dict:
+	"""
+	Append rows to an existing index and apply tombstones. Only the new rows are
+	tokenized/counted; existing postings are merged from their stored tfs and all
+	weights are recomputed vectorized, since idf/avgdl are corpus-global.
+	"""
+	with open(os.path.join(out_dir, META_FILE), "rb") as f:
+		meta = orjson.loads(f.read())
+	load = lambda name: np.load(os.path.join(out_dir, name))
+	offsets = load(TERM_OFFSETS_FILE)
+	indptr = load(INDPTR_FILE)
+	with open(os.path.join(out_dir, TERMS_FILE), "rb") as f:
+		blob = f.read()
+	old_terms = [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+	vocab = {t: i for i, t in enumerate(old_terms)}
+	n_old = int(meta["n_docs"])
+	t_new, d_new, tf_new, dl_new = _triplets(new_tokenized, vocab, row0=n_old)
+	terms, remap = _sorted_vocab(vocab)
+	t_old = np.repeat(np.arange(len(old_terms)), np.diff(indptr))
+	return write_bm25_index(
+		out_dir, terms,
+		remap[np.concatenate([t_old, t_new])],
+		np.concatenate([load(DOCS_FILE).astype(np.int64), d_new]),
+		np.concatenate([load(TFS_FILE).astype(np.int64), tf_new]),
+		np.concatenate([load(DOC_LENS_FILE).astype(np.int64), dl_new]),
+		live, meta["k1"], meta["b"], meta["epsilon"])
+
+class BM25Index:
+	"""
+	Memory-mapped inverted index. A query only reads the postings of its own terms;
+	scores match rank_bm25.BM25Okapi.get_scores up to float32 rounding of the weights.
+	"""
+	def __init__(self, art_dir: str):
+		with open(os.path.join(art_dir, META_FILE), "rb") as f:
+			self.meta = orjson.loads(f.read())
+		self.n_docs = int(self.meta["n_docs"])
+		load = lambda name: np.load(os.path.join(art_dir, name), mmap_mode="r")
+		self.term_offsets = load(TERM_OFFSETS_FILE)
+		self.indptr = load(INDPTR_FILE)
+		self.docs = load(DOCS_FILE)
+		self.weights = load(WEIGHTS_FILE)
+		self._f = open(os.path.join(art_dir, TERMS_FILE), "rb")
+		size = os.fstat(self._f.fileno()).st_size
+		self._terms = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+	def _term(self, i: int) -> bytes:
+		return self._terms[int(self.term_offsets[i]):int(self.term_offsets[i + 1])]
+
+	def term_id(self, term: str) -> int:
+		key = term.encode("utf-8")
+		lo, hi = 0, len(self.term_offsets) - 1
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._term(mid) < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo < len(self.term_offsets) - 1 and self._term(lo) == key:
+			return lo
+		return -1
+
+	def postings(self, term: str, rows: Optional["RowSet"] = None) -> Tuple[np.ndarray, np.ndarray]:
+		"""(docs, weights) of `term`; with `rows`, only the postings of those rows."""
+		tid = self.term_id(term)
+		if tid < 0:
+			return self.docs[:0], self.weights[:0]
+		s, e = int(self.indptr[tid]), int(self.indptr[tid + 1])
+		if rows is None:
+			return self.docs[s:e], self.weights[s:e]
+		# postings are sorted by row, so a filter reads its slices, not the whole list
+		pos = s + rows.positions(self.docs[s:e])
+		return self.docs[pos], self.weights[pos]
+
+	def candidates(self, tokens: List[str], _postings: Optional[Dict] = None) -> Tuple[np.ndarray, np.ndarray]:
+		"""Docs touched by the query and their accumulated scores (unsorted)."""
+		docs, ws = [], []
+		# repeated query terms count repeatedly, as in BM25Okapi
+		for term, qf in Counter(tokens).items():
+			d, w = self.postings(term) if _postings is None else _postings[term]
+			if len(d):
+				docs.append(d)
+				ws.append(w.astype(np.float64) * qf)
+		if not docs:
+			return np.zeros(0, dtype=np.int64), np.zeros(0)
+		docs = np.concatenate(docs)
+		uniq, inv = np.unique(docs, return_inverse=True)
+		return uniq.astype(np.int64), np.bincount(inv, weights=np.concatenate(ws))
+
+	def top_k(self, tokens: List[str], k: int = 20, _postings: Optional[Dict] = None) -> List[Tuple[int, float]]:
+		docs, scores = self.candidates(tokens, _postings)
+		if not len(docs) or k <= 0:
+			return []
+		if k < len(docs):
+			part = np.argpartition(-scores, k - 1)[:k]
+		else:
+			part = np.arange(len(docs))
+		# stable on doc id for equal scores
+		part = part[np.lexsort((docs[part], -scores[part]))]
+		return [(int(docs[i]), float(scores[i])) for i in part]
+
+	def top_k_many(self, token_lists: List[List[str]], k: int = 20,
+				   rows: Optional["RowSet"] = None) -> List[List[Tuple[int, float]]]:
+		"""top_k for several queries, optionally only over `rows`; each distinct term is looked up and read once."""
+		if rows is not None and not len(rows):
+			return [[] for _ in token_lists]
+		postings = {t: self.postings(t, rows) for t in dict.fromkeys(t for toks in token_lists for t in toks)}
+		return [self.top_k(toks, k, postings) for toks in token_lists]
+
+	def get_scores(self, tokens: List[str]) -> np.ndarray:
+		"""Dense score vector over all docs (for parity checks, not the hot path)."""
+		out = np.zeros(self.n_docs)
+		docs, scores = self.candidates(tokens)
+		out[docs] = scores
+		return out
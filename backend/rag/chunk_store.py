@@ -0,0 +1,78 @@
+import os, mmap
+import numpy as np
+from typing import List, Dict, Tuple, Iterable
+
+TEXT_FILE = "chunks.bin"
+OFFSETS_FILE = "chunk_offsets.npy"
+
+def write_chunk_store(texts: Iterable[str], out_dir: str) -> int:
+	"""
+	Pack chunk texts into one UTF-8 blob plus an int64 offsets array (n_rows + 1),
+	so row i lives at blob[offsets[i]:offsets[i+1]].
+	"""
+	os.makedirs(out_dir, exist_ok=True)
+	offsets: List[int] = [0]
+	with open(os.path.join(out_dir, TEXT_FILE), "wb") as f:
+		for t in texts:
+			b = t.encode("utf-8")
+			f.write(b)
+			offsets.append(offsets[-1] + len(b))
+	np.save(os.path.join(out_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+	return len(offsets) - 1
+
+def append_chunk_store(texts: Iterable[str], out_dir: str) -> int:
+	"""Append rows to an existing store; returns the new row count."""
+	path = os.path.join(out_dir, OFFSETS_FILE)
+	offsets: List[int] = np.load(path).tolist()
+	with open(os.path.join(out_dir, TEXT_FILE), "ab") as f:
+		for t in texts:
+			b = t.encode("utf-8")
+			f.write(b)
+			offsets.append(offsets[-1] + len(b))
+	np.save(path, np.asarray(offsets, dtype=np.int64))
+	return len(offsets) - 1
+
+class ChunkStore:
+	"""
+	Read-only, memory-mapped view over the packed chunk texts: O(1) lookup by row.
+	"""
+	def __init__(self, art_dir: str):
+		self.art_dir = art_dir
+		self.offsets = np.load(os.path.join(art_dir, OFFSETS_FILE), mmap_mode="r")
+		self._f = open(os.path.join(art_dir, TEXT_FILE), "rb")
+		size = os.fstat(self._f.fileno()).st_size
+		# mmap refuses zero-length files; an empty corpus just has no rows
+		self._buf = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+	def __len__(self) -> int:
+		return len(self.offsets) - 1
+
+	def text(self, row_idx: int) -> str:
+		if row_idx < 0 or row_idx >= len(self):
+			return ""
+		s, e = int(self.offsets[row_idx]), int(self.offsets[row_idx + 1])
+		return self._buf[s:e].decode("utf-8")
+
+	def texts(self, rows: Iterable[int]) -> List[str]:
+		return [self.text(int(r)) for r in rows]
+
+	def close(self):
+		if isinstance(self._buf, mmap.mmap):
+			self._buf.close()
+		self._f.close()
+
+_OPEN: Dict[Tuple[str, int], ChunkStore] = {}
+
+def open_chunk_store(art_dir: str) -> ChunkStore:
+	"""Process-wide handle per artifact dir, so callers share one mapping."""
+	# keyed on the offsets file's mtime too, so a rebuilt store is picked up
+	key = (os.path.abspath(art_dir), os.stat(os.path.join(art_dir, OFFSETS_FILE)).st_mtime_ns)
+	if key not in _OPEN:
+		_OPEN[key] = ChunkStore(art_dir)
+	return _OPEN[key]
+
+def release_chunk_store(art_dir: str):
+	"""Drop and unmap the shared handles for `art_dir`; callers must be done with them."""
+	path = os.path.abspath(art_dir)
+	for key in [k for k in _OPEN if k[0] == path]:
+		_OPEN.pop(key).close()
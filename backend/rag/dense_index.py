@@ -0,0 +1,363 @@
+import os, math, time, orjson
+import numpy as np, faiss
+from typing import Dict, List, Optional, Tuple
+from backend.rag.filters import RowSet
+
+CONFIG_FILE = "dense_index.json"
+INDEX_FILE = "faiss.index"
+EMB_FILE = "embeddings.npy"
+SCALE_FILE = "embeddings_scale.npy"
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+QUANT_TYPES = ("fp32", "fp16", "int8", "binary")
+STORE_TYPES = ("float32", "float16", "int8")
+# a filtered search over at most this many rows scores them exactly instead of using the index
+FILTER_EXACT_ROWS = int(os.getenv("FILTER_EXACT_ROWS", "20000"))
+
+DEFAULTS = {
+	"type": "flat",
+	"nlist": None,         # IVF: number of lists (None -> ~4*sqrt(n), capped by training size)
+	"nprobe": 16,          # IVF: lists visited per query
+	"pq_m": 16,            # IVF-PQ: sub-quantizers (must divide the embedding dim)
+	"pq_nbits": 8,         # IVF-PQ: bits per sub-quantizer code
+	"hnsw_m": 32,          # HNSW: graph degree
+	"ef_construction": 200,
+	"ef_search": 64,
+	"train_size": 100_000, # IVF: vectors sampled for k-means / PQ training
+	"seed": 123,
+	"quant": "fp32",       # codes in the FAISS index: fp32 | fp16 | int8 (scalar quantizer) | binary (1 bit/dim)
+	"store": "float32",    # dtype of embeddings.npy, used for rescoring and rebuilds: float32 | float16 | int8
+	"rescore": None,       # shortlist = k * rescore, re-scored exactly; None -> 4 for lossy indexes, else 0
+}
+
+def dense_config(**overrides) -> Dict:
+	cfg = dict(DEFAULTS)
+	cfg.update({k: v for k, v in overrides.items() if v is not None})
+	if cfg["type"] not in INDEX_TYPES:
+		raise ValueError(f"unknown index type {cfg['type']!r}; expected one of {INDEX_TYPES}")
+	if cfg["quant"] not in QUANT_TYPES:
+		raise ValueError(f"unknown quantization {cfg['quant']!r}; expected one of {QUANT_TYPES}")
+	if cfg["store"] not in STORE_TYPES:
+		raise ValueError(f"unknown embedding store {cfg['store']!r}; expected one of {STORE_TYPES}")
+	if cfg["type"] == "ivf_pq" and cfg["quant"] != "fp32":
+		raise ValueError("ivf_pq already compresses vectors with PQ; use quant=fp32")
+	if cfg["quant"] == "binary" and cfg["type"] not in ("flat", "hnsw"):
+		raise ValueError("binary quantization supports flat and hnsw indexes")
+	return cfg
+
+def is_lossy(cfg: Dict) -> bool:
+	return cfg["quant"] != "fp32" or cfg["type"] == "ivf_pq"
+
+def rescore_factor(cfg: Dict) -> int:
+	"""Shortlist multiplier for the exact rescoring pass (0 = index scores are final)."""
+	if cfg.get("rescore") is not None:
+		return int(cfg["rescore"])
+	return 4 if is_lossy(cfg) else 0
+
+def save_dense_config(cfg: Dict, out_dir: str):
+	with open(os.path.join(out_dir, CONFIG_FILE), "wb") as f:
+		f.write(orjson.dumps(cfg, option=orjson.OPT_INDENT_2))
+
+def load_dense_config(art_dir: str) -> Dict:
+	"""Config recorded at build time; artifacts without one are an exact flat index."""
+	path = os.path.join(art_dir, CONFIG_FILE)
+	if not os.path.exists(path):
+		return dense_config()
+	with open(path, "rb") as f:
+		return dense_config(**orjson.loads(f.read()))
+
+def _train_sample(embs: np.ndarray, n: int, seed: int) -> np.ndarray:
+	if len(embs) <= n:
+		return np.ascontiguousarray(embs, dtype="float32")
+	idx = np.random.default_rng(seed).choice(len(embs), n, replace=False)
+	return np.ascontiguousarray(embs[np.sort(idx)], dtype="float32")
+
+def binarize(x: np.ndarray) -> np.ndarray:
+	"""Sign bits, packed 8 per byte (the layout FAISS binary indexes take)."""
+	return np.packbits(np.asarray(x) > 0, axis=1)
+
+def _sq_type(quant: str):
+	return faiss.ScalarQuantizer.QT_fp16 if quant == "fp16" else faiss.ScalarQuantizer.QT_8bit
+
+def make_index(embs: np.ndarray, cfg: Dict):
+	"""
+	Build and fill a FAISS index of the configured type. Vectors are L2-normalized,
+	so every variant uses inner product (cosine); binary indexes use Hamming distance
+	over sign bits. Resolved training parameters (nlist, pq_nbits) are written back
+	into `cfg`.
+	"""
+	n, d = embs.shape
+	kind, quant = cfg["type"], cfg["quant"]
+	ip = faiss.METRIC_INNER_PRODUCT
+	train = None
+	if quant == "binary":
+		if d % 8:
+			raise ValueError(f"binary quantization needs a dimension divisible by 8, got {d}")
+		if kind == "flat":
+			index = faiss.IndexBinaryFlat(d)
+		else:
+			index = faiss.IndexBinaryHNSW(d, cfg["hnsw_m"])
+			index.hnsw.efConstruction = cfg["ef_construction"]
+		add_vectors(index, embs, cfg)
+		return index
+	if kind == "flat":
+		index = faiss.IndexFlatIP(d) if quant == "fp32" else faiss.IndexScalarQuantizer(d, _sq_type(quant), ip)
+	elif kind == "hnsw":
+		if quant == "fp32":
+			index = faiss.IndexHNSWFlat(d, cfg["hnsw_m"], ip)
+		else:
+			index = faiss.IndexHNSWSQ(d, _sq_type(quant), cfg["hnsw_m"], ip)
+		index.hnsw.efConstruction = cfg["ef_construction"]
+	else:
+		train = _train_sample(embs, cfg["train_size"], cfg["seed"])
+		# k-means wants ~39 points per centroid
+		nlist = cfg["nlist"] or int(4 * math.sqrt(max(n, 1)))
+		nlist = max(1, min(nlist, len(train) // 39 or 1))
+		cfg["nlist"] = nlist
+		quantizer = faiss.IndexFlatIP(d)
+		if kind == "ivf_flat" and quant == "fp32":
+			index = faiss.IndexIVFFlat(quantizer, d, nlist, ip)
+		elif kind == "ivf_flat":
+			index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, _sq_type(quant), ip)
+		else:
+			nbits = max(1, min(cfg["pq_nbits"], int(math.log2(max(len(train) // 39, 2)))))
+			cfg["pq_nbits"] = nbits
+			index = faiss.IndexIVFPQ(quantizer, d, nlist, cfg["pq_m"], nbits, ip)
+	if not index.is_trained:
+		# IVF k-means / PQ codebooks, or the int8 scalar quantizer's per-dimension ranges
+		index.train(train if train is not None else _train_sample(embs, cfg["train_size"], cfg["seed"]))
+	add_vectors(index, embs, cfg)
+	return index
+
+def add_vectors(index, embs: np.ndarray, cfg: Dict):
+	if cfg["quant"] == "binary":
+		index.add(binarize(embs))
+	else:
+		index.add(np.ascontiguousarray(embs, dtype="float32"))
+
+def write_index(index, out_dir: str, cfg: Dict):
+	path = os.path.join(out_dir, INDEX_FILE)
+	if cfg["quant"] == "binary":
+		faiss.write_index_binary(index, path)
+	else:
+		faiss.write_index(index, path)
+
+def read_index(art_dir: str, cfg: Dict):
+	path = os.path.join(art_dir, INDEX_FILE)
+	return faiss.read_index_binary(path) if cfg["quant"] == "binary" else faiss.read_index(path)
+
+def index_bytes(index, cfg: Dict) -> int:
+	"""Serialized size, a close proxy for the index's resident memory."""
+	if cfg["quant"] == "binary":
+		return int(faiss.serialize_index_binary(index).nbytes)
+	return int(faiss.serialize_index(index).nbytes)
+
+# ------------------------------
+# Stored embedding matrix (rescoring, incremental adds, compaction)
+# ------------------------------
+def _quantize_store(embs: np.ndarray, store: str, scale: Optional[np.ndarray]):
+	embs = np.asarray(embs, dtype="float32")
+	if store == "float32":
+		return embs, None
+	if store == "float16":
+		return embs.astype(np.float16), None
+	if scale is None:
+		# symmetric per-dimension int8; dims of normalized vectors rarely reach +-1
+		scale = np.maximum(np.abs(embs).max(axis=0) if len(embs) else np.ones(embs.shape[1]), 1e-6) / 127.0
+		scale = scale.astype("float32")
+	return np.clip(np.rint(embs / scale), -127, 127).astype(np.int8), scale
+
+def save_embeddings(embs: np.ndarray, out_dir: str, cfg: Dict, append: bool = False):
+	"""
+	Write float32 `embs` as embeddings.npy in the configured store dtype. With
+	append=True they are added after the existing rows, reusing the int8 scale.
+	"""
+	emb_path, scale_path = os.path.join(out_dir, EMB_FILE), os.path.join(out_dir, SCALE_FILE)
+	scale = np.load(scale_path) if append and os.path.exists(scale_path) else None
+	q, scale = _quantize_store(embs, cfg["store"], scale)
+	if append:
+		old = np.load(emb_path, mmap_mode="r")
+		if old.dtype != q.dtype:
+			raise ValueError(f"{EMB_FILE} is {old.dtype}, config says {cfg['store']}; rebuild instead")
+		q = np.concatenate([old, q])
+		del old
+	np.save(emb_path, q)
+	if scale is not None:
+		np.save(scale_path, scale)
+	elif os.path.exists(scale_path) and not append:
+		os.remove(scale_path)
+	return q.shape
+
+class StoredEmbeddings:
+	"""
+	Memory-mapped embeddings.npy; `rows()` returns float32 vectors for a shortlist,
+	so only the pages of the rows touched are read.
+	"""
+	def __init__(self, art_dir: str):
+		self.data = np.load(os.path.join(art_dir, EMB_FILE), mmap_mode="r")
+		# int8 rows are dequantized with the per-dimension scale written next to them
+		self.scale = np.load(os.path.join(art_dir, SCALE_FILE)) if self.data.dtype == np.int8 else None
+
+	def __len__(self) -> int:
+		return len(self.data)
+
+	@property
+	def nbytes(self) -> int:
+		return int(self.data.nbytes)
+
+	def rows(self, idx: np.ndarray) -> np.ndarray:
+		x = np.asarray(self.data[idx], dtype="float32")
+		return x * self.scale if self.scale is not None else x
+
+	def all(self) -> np.ndarray:
+		return self.rows(slice(None))
+
+def dense_search(index, qmat: np.ndarray, k: int, cfg: Dict, params=None,
+				 embs: Optional[StoredEmbeddings] = None, rescore: Optional[int] = None):
+	"""
+	(scores, ids), each (n, k), ids -1 where fewer than k rows exist. With `embs` and a
+	rescore factor, k * factor candidates come from the index and are re-ranked by
+	exact float32 inner product against the stored vectors.
+	"""
+	qmat = np.ascontiguousarray(qmat, dtype="float32")
+	factor = rescore_factor(cfg) if rescore is None else rescore
+	binary = cfg["quant"] == "binary"
+	k_index = k * factor if (factor and embs is not None) else k
+	D, I = index.search(binarize(qmat) if binary else qmat, k_index, params=params)
+	if k_index == k:
+		if binary:
+			# Hamming distance -> cosine estimate of sign vectors, higher is better
+			D = 1.0 - 2.0 * D.astype("float32") / qmat.shape[1]
+		return D, I
+	out_d = np.full((len(qmat), k), -np.inf, dtype="float32")
+	out_i = np.full((len(qmat), k), -1, dtype=np.int64)
+	for n, (q, ids) in enumerate(zip(qmat, I)):
+		ids = ids[ids != -1]
+		if not len(ids):
+			continue
+		order = np.argsort(ids)  # ascending rows: sequential reads from the mapped file
+		scores = np.empty(len(ids), dtype="float32")
+		scores[order] = embs.rows(ids[order]) @ q
+		top = np.argsort(-scores, kind="stable")[:k]
+		out_d[n, :len(top)], out_i[n, :len(top)] = scores[top], ids[top]
+	return out_d, out_i
+
+def exact_search(embs: StoredEmbeddings, rows: np.ndarray, qmat: np.ndarray, k: int,
+				 block: int = 8192) -> Tuple[np.ndarray, np.ndarray]:
+	"""dense_search's (scores, ids) by exact inner product against only `rows` (ascending) of the stored vectors."""
+	qmat = np.ascontiguousarray(qmat, dtype="float32")
+	out_d = np.full((len(qmat), k), -np.inf, dtype="float32")
+	out_i = np.full((len(qmat), k), -1, dtype=np.int64)
+	cand_d, cand_i = [], []
+	for s in range(0, len(rows), block):
+		r = rows[s:s + block]
+		E = embs.rows(r)
+		# one product per query, as dense_search rescores: a batched matmul can round
+		# differently, and search_many must return exactly what search() does
+		S = np.stack([E @ q for q in qmat])
+		kk = min(k, len(r))
+		part = np.argpartition(-S, kk - 1, axis=1)[:, :kk]
+		cand_d.append(np.take_along_axis(S, part, axis=1))
+		cand_i.append(r[part])
+	if not cand_d:
+		return out_d, out_i
+	D, I = np.concatenate(cand_d, axis=1), np.concatenate(cand_i, axis=1)
+	for n in range(len(qmat)):
+		top = np.lexsort((I[n], -D[n]))[:k]  # lower row first on ties
+		out_d[n, :len(top)], out_i[n, :len(top)] = D[n, top], I[n, top]
+	return out_d, out_i
+
+def row_selector(rows: RowSet):
+	"""FAISS ID selector for a RowSet: a range for one run, else a bitmap (O(1) membership)."""
+	if len(rows.starts) == 1:
+		return faiss.IDSelectorRange(int(rows.starts[0]), int(rows.ends[0]))
+	mask = np.zeros(int(rows.ends[-1]), dtype=bool)
+	mask[rows.rows] = True
+	bitmap = np.packbits(mask, bitorder="little")
+	sel = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+	sel.referenced_objects = [bitmap]  # the selector only holds a pointer
+	return sel
+
+def dense_search_rows(index, qmat: np.ndarray, k: int, cfg: Dict, rows: RowSet,
+					  embs: Optional[StoredEmbeddings] = None, rescore: Optional[int] = None):
+	"""
+	dense_search restricted to `rows`. Up to FILTER_EXACT_ROWS rows are scored exactly
+	against the stored vectors, which reads only those rows and beats scanning the
+	index (it also avoids HNSW / IVF recall loss under a tight filter); larger sets
+	search the index with an ID selector.
+	"""
+	if embs is not None and len(rows) <= max(FILTER_EXACT_ROWS, k):
+		return exact_search(embs, rows.rows, qmat, k)
+	if not len(rows):
+		return (np.full((len(qmat), k), -np.inf, dtype="float32"), np.full((len(qmat), k), -1, dtype=np.int64))
+	sel = row_selector(rows)  # referenced here until the search returns
+	return dense_search(index, qmat, k, cfg, search_params(cfg, sel), embs, rescore)
+
+def search_params(cfg: Dict, sel=None, **overrides):
+	"""Per-query FAISS parameters for the configured index type (optionally with an ID selector)."""
+	kind = cfg["type"]
+	kw = {} if sel is None else {"sel": sel}
+	if kind in ("ivf_flat", "ivf_pq"):
+		return faiss.SearchParametersIVF(nprobe=int(overrides.get("nprobe", cfg["nprobe"])), **kw)
+	if kind == "hnsw":
+		return faiss.SearchParametersHNSW(efSearch=int(overrides.get("ef_search", cfg["ef_search"])), **kw)
+	return faiss.SearchParameters(**kw) if kw else None
+
+def _sweep(cfg: Dict) -> List[Dict]:
+	if cfg["type"] in ("ivf_flat", "ivf_pq"):
+		vals = sorted({v for v in (1, 2, 4, 8, 16, 32, 64, 128, 256, cfg["nprobe"]) if v <= cfg["nlist"]})
+		return [{"nprobe": v} for v in vals]
+	if cfg["type"] == "hnsw":
+		return [{"ef_search": v} for v in sorted({16, 32, 64, 128, 256, 512, cfg["ef_search"]})]
+	return [{}]
+
+def _timed_search(index, qs: np.ndarray, k: int, cfg: Dict, params=None,
+				  embs: Optional[StoredEmbeddings] = None, rescore: int = 0):
+	# one query at a time, as served online
+	lat = []
+	found = np.empty((len(qs), k), dtype=np.int64)
+	for i in range(len(qs)):
+		s0 = time.perf_counter()
+		_, I = dense_search(index, qs[i:i + 1], k, cfg, params, embs, rescore)
+		lat.append((time.perf_counter() - s0) * 1000)
+		found[i] = I[0]
+	return found, {"p50_ms": round(float(np.percentile(lat, 50)), 4),
+				   "p95_ms": round(float(np.percentile(lat, 95)), 4)}
+
+def recall_report(index, embs: np.ndarray, cfg: Dict, k: int = 10, n_queries: int = 500,
+				  seed: int = 7, stored: Optional[StoredEmbeddings] = None) -> Dict:
+	"""
+	recall@k and per-query latency of `index` against an exact float32 flat search, for
+	a sweep of nprobe / efSearch values. Queries are corpus vectors sampled at random.
+	For lossy indexes each point is measured with and without the rescoring pass over
+	`stored`; the memory section compares index and stored-matrix size with float32.
+	"""
+	embs = np.asarray(embs, dtype="float32")
+	n, d = embs.shape
+	k = min(k, n)
+	rng = np.random.default_rng(seed)
+	qs = embs[rng.choice(n, min(n_queries, n), replace=False)]
+
+	flat_cfg = dense_config()
+	exact = faiss.IndexFlatIP(d)
+	exact.add(embs)
+	gt, flat_lat = _timed_search(exact, qs, k, flat_cfg)
+
+	factor = rescore_factor(cfg) if stored is not None else 0
+	rows = []
+	for point in _sweep(cfg):
+		for r in sorted({0, factor}):
+			found, lat = _timed_search(index, qs, k, cfg, search_params(cfg, **point), stored, r)
+			recall = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, gt)]))
+			rows.append({**point, **({"rescore": r} if factor else {}), f"recall@{k}": round(recall, 4), **lat})
+	fp32_bytes = n * d * 4
+	idx_bytes = index_bytes(index, cfg)
+	memory = {
+		"index_bytes": idx_bytes,
+		"fp32_flat_index_bytes": fp32_bytes,
+		"index_ratio": round(fp32_bytes / max(idx_bytes, 1), 2),
+	}
+	if stored is not None:
+		memory.update(stored_bytes=stored.nbytes, stored_dtype=str(stored.data.dtype),
+					  stored_ratio=round(fp32_bytes / max(stored.nbytes, 1), 2))
+	return {"type": cfg["type"], "quant": cfg["quant"], "store": cfg["store"], "rescore": factor,
+			"n_vectors": n, "n_queries": len(qs), "k": k, "flat": flat_lat, "points": rows, "memory": memory}
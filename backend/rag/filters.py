@@ -0,0 +1,73 @@
+"""
+Metadata filters for search. A filter is a dict with any of
+
+	doc_ids: ["handbook", ...]     source_prefix: "data/hr/"     page_min / page_max: 1-based, inclusive
+
+and is resolved against the meta store (doc table + doc -> row-range index, see
+MetaStore.select) into the RowSet a query may return. Dense search then scores only
+those rows and BM25 reads only their slices of each posting list, so a narrower
+filter means less work, not an over-fetch followed by a post-filter.
+"""
+import numpy as np
+from typing import Any, Dict, Optional
+
+FILTER_KEYS = ("doc_ids", "source_prefix", "page_min", "page_max")
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+	"""Validated filter with empty fields dropped; None when nothing is filtered."""
+	if not filters:
+		return None
+	unknown = set(filters) - set(FILTER_KEYS)
+	if unknown:
+		raise ValueError(f"unknown filter fields: {sorted(unknown)} (expected {list(FILTER_KEYS)})")
+	out: Dict[str, Any] = {}
+	if filters.get("doc_ids") is not None:
+		ids = filters["doc_ids"]
+		out["doc_ids"] = sorted({ids} if isinstance(ids, str) else {str(d) for d in ids})
+	if filters.get("source_prefix"):
+		out["source_prefix"] = str(filters["source_prefix"])
+	for key in ("page_min", "page_max"):
+		if filters.get(key) is not None:
+			out[key] = int(filters[key])
+	return out or None
+
+def filters_key(filters: Optional[Dict[str, Any]]) -> str:
+	"""Canonical string for a normalized filter (cache scopes, logs)."""
+	if not filters:
+		return ""
+	return ";".join(f"{k}={','.join(v) if isinstance(v, list) else v}" for k, v in sorted(filters.items()))
+
+def ranges_to_indices(starts: np.ndarray, lens: np.ndarray) -> np.ndarray:
+	"""Concatenated aranges [s, s + n) without a Python loop."""
+	keep = lens > 0
+	starts, lens = starts[keep], lens[keep]
+	if not len(lens):
+		return np.zeros(0, dtype=np.int64)
+	return np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(int(lens.sum()))
+
+class RowSet:
+	"""Sorted rows a filtered query may return, with their contiguous runs [starts, ends)."""
+	def __init__(self, rows: np.ndarray):
+		self.rows = np.asarray(rows, dtype=np.int64)
+		if len(self.rows):
+			brk = np.flatnonzero(np.diff(self.rows) != 1) + 1
+			self.starts = self.rows[np.r_[0, brk]]
+			self.ends = self.rows[np.r_[brk - 1, len(self.rows) - 1]] + 1
+		else:
+			self.starts = self.ends = self.rows
+
+	def __len__(self) -> int:
+		return len(self.rows)
+
+	def contains(self, ids: np.ndarray) -> np.ndarray:
+		j = np.searchsorted(self.starts, ids, side="right") - 1
+		return (j >= 0) & (ids < self.ends[np.maximum(j, 0)])
+
+	def positions(self, sorted_ids: np.ndarray) -> np.ndarray:
+		"""Indices into ascending `sorted_ids` (e.g. a posting list) of the ids in the set."""
+		if len(self.starts) * 16 < len(sorted_ids):
+			# few runs: two binary searches per run, then only the matching slices are read
+			lo = np.searchsorted(sorted_ids, self.starts)
+			hi = np.searchsorted(sorted_ids, self.ends)
+			return ranges_to_indices(lo, hi - lo)
+		return np.flatnonzero(self.contains(sorted_ids))
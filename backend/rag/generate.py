@@ -1,4 +1,5 @@
-from typing import List, Dict
+import os, re
+from typing import Callable, List, Dict, Optional, Tuple
 
 SYSTEM_PROMPT = """
 You are a cautious assistant that answers using ONLY the provided context.
@@ -19,17 +20,121 @@ Write a helpful answer grounded ONLY in the context, with inline citations like
 If information is missing, explicitly say you don't have enough information.
 """
 
-def format_context(chunks: List[Dict], max_chars_per_chunk: int = 1200) -> str:
-	lines = []
-	for i, c in enumerate(chunks, 1):
-		doc = c.get("doc_id", "doc")
-		page = c.get("page", "?")
-		text = c.get("text", "")[:max_chars_per_chunk].replace("\n", " ").strip()
-		lines.append(f"[{doc}:{page}] {text}")
-	return "\n".join(lines)
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "1500"))  # context budget, in the LLM's tokens
+MERGE_GAP = 2  # chunks of a page this many chars apart (whitespace) are joined into one block
 
-def build_prompt(question: str, chunks: List[Dict]) -> str:
+_SENT_END = re.compile(r"(?<=[.!?])\s+")
+_WS = re.compile(r"\s+")
+
+def estimate_tokens(text: str) -> int:
+	# same estimate as LLMBase.count_tokens, for callers without an LLM
+	return (len(text.encode("utf-8")) + 3) // 4
+
+def _has_span(c: Dict) -> bool:
+	s, e = c.get("start_char"), c.get("end_char")
+	return s is not None and e is not None and e - s == len(c.get("text", ""))
+
+def merge_chunks(chunks: List[Dict]) -> List[Dict]:
+	"""
+	Hits -> context blocks. Chunks of one page whose stored spans overlap or abut are
+	merged into one block (the overlap appears once); the rest stay as they are.
+	Blocks keep the rank order of their best hit.
+	"""
+	blocks: List[Tuple[int, Dict]] = []
+	pages: Dict[Tuple, List[Tuple[int, Dict]]] = {}
+	for rank, c in enumerate(chunks):
+		key = (c.get("doc_id", "doc"), c.get("page", "?"))
+		if _has_span(c):
+			pages.setdefault(key, []).append((rank, c))
+		else:
+			blocks.append((rank, {"doc_id": key[0], "page": key[1], "text": c.get("text", ""), "n_chunks": 1}))
+	for (doc, page), hits in pages.items():
+		hits.sort(key=lambda h: h[1]["start_char"])
+		cur = None
+		for rank, c in hits:
+			s, e, t = c["start_char"], c["end_char"], c["text"]
+			if cur is not None and s <= cur["end"] + MERGE_GAP:
+				if e > cur["end"]:
+					# chunk texts are exact slices of the page, so the tail past the block's end is t[end - s:]
+					cur["text"] += t[cur["end"] - s:] if s <= cur["end"] else " " + t
+					cur["end"] = e
+				cur["rank"] = min(cur["rank"], rank)
+				cur["n_chunks"] += 1
+				continue
+			cur = {"doc_id": doc, "page": page, "text": t, "end": e, "rank": rank, "n_chunks": 1}
+			blocks.append((rank, cur))
+	blocks.sort(key=lambda b: b[1].get("rank", b[0]))
+	return [b for _, b in blocks]
+
+def _sentences(text: str) -> List[str]:
+	return [s for s in _SENT_END.split(_WS.sub(" ", text).strip()) if s]
+
+def pack_context(chunks: List[Dict], budget: int = CONTEXT_TOKENS,
+				 count_tokens: Optional[Callable[[str], int]] = None) -> Tuple[str, Dict]:
+	"""
+	Context for the prompt, packed into `budget` tokens of `count_tokens` (the LLM's
+	tokenizer): overlapping chunks are merged (merge_chunks), sentences already in
+	the context are dropped, and blocks are filled sentence by sentence in rank order.
+	A block stops at its first sentence that doesn't fit, so it is always a contiguous
+	prefix; the next block may still fit. Returns (context, stats); stats compare against concatenating every hit whole.
+	"""
+	count = count_tokens or estimate_tokens
+	raw = "\n".join(f"[{c.get('doc_id', 'doc')}:{c.get('page', '?')}] {_WS.sub(' ', c.get('text', '')).strip()}"
+					for c in chunks)
+	seen = set()
+	lines: List[Tuple[str, List[str]]] = []
+	used = n_dup = n_cut = 0
+	for b in merge_chunks(chunks):
+		header = f"[{b['doc_id']}:{b['page']}]"
+		cost = count(header) + (1 if lines else 0)  # + the newline
+		kept: List[str] = []
+		sents = _sentences(b["text"])
+		for i, sent in enumerate(sents):
+			key = sent.lower()
+			if key in seen:
+				n_dup += 1
+				continue
+			n = count(" " + sent)
+			if used + cost + n > budget:
+				# the block ends here: later, shorter sentences would leave a gap under one header
+				n_cut += len(sents) - i
+				break
+			seen.add(key)
+			kept.append(sent)
+			cost += n
+		if kept:
+			lines.append((header, kept))
+			used += cost
+	context = "\n".join(f"{h} {' '.join(s)}" for h, s in lines)
+	# per-piece counts can differ from the joined text by a merge at a boundary: trim to be exact
+	n_tokens = count(context)
+	while n_tokens > budget and lines:
+		lines[-1][1].pop()
+		if not lines[-1][1]:
+			lines.pop()
+		n_cut += 1
+		context = "\n".join(f"{h} {' '.join(s)}" for h, s in lines)
+		n_tokens = count(context)
+	n_raw = count(raw)
+	return context, {
+		"context_tokens": n_tokens,
+		"context_tokens_raw": n_raw,
+		"context_tokens_saved": max(n_raw - n_tokens, 0),
+		"context_dup_sentences": n_dup,
+		"context_cut_sentences": n_cut,
+	}
+
+def format_context(chunks: List[Dict], budget: int = CONTEXT_TOKENS,
+				   count_tokens: Optional[Callable[[str], int]] = None) -> str:
+	return pack_context(chunks, budget, count_tokens)[0]
+
+def build_prompt(question: str, chunks: List[Dict], count_tokens: Optional[Callable[[str], int]] = None,
+				 budget: int = CONTEXT_TOKENS, stats: Optional[Dict] = None) -> str:
+	"""Prompt with the packed context; packing stats are written into `stats`."""
+	context, st = pack_context(chunks, budget, count_tokens)
+	if stats is not None:
+		stats.update(st)
 	return SYSTEM_PROMPT + "\n\n" + USER_TEMPLATE.format(
 		question=question,
-		context=format_context(chunks)
-	)
\ No newline at end of file
+		context=context
+	)
@@ -0,0 +1,98 @@
+"""
+Versioned artifact generations. Every index build writes a complete, self-contained
+index into artifacts/generations/<version>/ and then publishes it by atomically
+replacing the CURRENT pointer file, so a reader only ever resolves a finished
+generation and nothing it has open is modified underneath it. Ingest outputs
+(chunks.jsonl, manifest.json, meta.json) stay at the top of artifacts/ as the build
+input. A dir without CURRENT is read as-is (the layout before generations, and
+dirs written with index_build --in-place).
+"""
+import os, time, shutil, orjson
+from typing import Dict, List, Optional, Tuple
+
+GENERATIONS_DIR = "generations"
+CURRENT_FILE = "CURRENT"               # name of the published generation
+GENERATION_FILE = "generation.json"    # written into a generation when it is published
+SOURCE_FILES = ("chunks.jsonl", "manifest.json", "meta.json", CURRENT_FILE, GENERATIONS_DIR)
+
+GENERATIONS_KEEP = int(os.getenv("GENERATIONS_KEEP", "2"))  # older published generations kept on disk
+
+def generation_dir(art_dir: str, version: str) -> str:
+	return os.path.join(art_dir, GENERATIONS_DIR, version)
+
+def current_version(art_dir: str) -> Optional[str]:
+	try:
+		with open(os.path.join(art_dir, CURRENT_FILE), "r") as f:
+			return f.read().strip() or None
+	except FileNotFoundError:
+		return None
+
+def resolve(art_dir: str) -> Tuple[Optional[str], str]:
+	"""(published version, dir to load); (None, art_dir) for a dir without generations."""
+	version = current_version(art_dir)
+	if version is None:
+		return None, art_dir
+	return version, generation_dir(art_dir, version)
+
+def new_generation(art_dir: str, base: bool = False) -> Tuple[str, str]:
+	"""
+	Create an empty generation dir named by creation time (names sort in build order).
+	With `base`, it starts as a copy of the index being served, for builds that update
+	an index rather than rewrite it (incremental, compaction).
+	"""
+	os.makedirs(os.path.join(art_dir, GENERATIONS_DIR), exist_ok=True)
+	stamp = time.strftime("%Y%m%d-%H%M%S")
+	for n in range(100):
+		version = f"{stamp}-{n:02d}"
+		path = generation_dir(art_dir, version)
+		try:
+			os.mkdir(path)
+			break
+		except FileExistsError:
+			continue
+	else:
+		raise RuntimeError(f"no free generation name for {stamp}")
+	if base:
+		src = resolve(art_dir)[1]
+		for name in os.listdir(src):
+			if name in SOURCE_FILES or name == GENERATION_FILE or name.endswith(".tmp"):
+				continue
+			s, d = os.path.join(src, name), os.path.join(path, name)
+			if os.path.isdir(s):
+				shutil.copytree(s, d)
+			else:
+				shutil.copy2(s, d)
+	return version, path
+
+def publish(art_dir: str, version: str, info: Optional[Dict] = None):
+	"""Make `version` the one readers resolve: stamp it, then swap CURRENT in one rename."""
+	path = generation_dir(art_dir, version)
+	with open(os.path.join(path, GENERATION_FILE), "wb") as f:
+		f.write(orjson.dumps({"version": version, "published_at": time.time(), **(info or {})}))
+	tmp = os.path.join(art_dir, CURRENT_FILE + ".tmp")
+	with open(tmp, "w") as f:
+		f.write(version)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, os.path.join(art_dir, CURRENT_FILE))
+
+def discard(art_dir: str, version: str):
+	"""Remove an unpublished generation (a failed build)."""
+	shutil.rmtree(generation_dir(art_dir, version), ignore_errors=True)
+
+def prune(art_dir: str, keep: int = GENERATIONS_KEEP) -> List[str]:
+	"""
+	Delete generations older than the current one, except the `keep` newest published
+	ones (a server may still be serving or draining them). Returns the removed versions.
+	"""
+	current = current_version(art_dir)
+	root = os.path.join(art_dir, GENERATIONS_DIR)
+	if current is None or not os.path.isdir(root):
+		return []
+	older = sorted((v for v in os.listdir(root) if v < current), reverse=True)
+	published = [v for v in older if os.path.exists(os.path.join(root, v, GENERATION_FILE))]
+	kept = set(published[:keep])
+	removed = [v for v in older if v not in kept]  # incl. leftovers of crashed builds
+	for v in removed:
+		shutil.rmtree(os.path.join(root, v), ignore_errors=True)
+	return removed
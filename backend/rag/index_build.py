@@ -1,13 +1,25 @@
-import os, orjson, argparse, numpy as np, faiss, pickle, math
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer
-from rank_bm25 import BM25Okapi
+import os, shutil, orjson, argparse, numpy as np, math
+from typing import Any, Callable, List, Dict, Optional
+from backend.models.registry import get_embedder
+from backend.rag.chunk_store import write_chunk_store, append_chunk_store
+from backend.rag.meta_store import write_meta_store, append_meta_store
+from backend.rag.bm25_index import build_bm25_index, update_bm25_index, tokenize, corpus_stats
+from backend.rag.dense_index import (INDEX_TYPES, QUANT_TYPES, STORE_TYPES, dense_config, make_index,
+									save_dense_config, load_dense_config, recall_report, add_vectors,
+									write_index, read_index, save_embeddings, StoredEmbeddings)
+from backend.rag.manifest import (MANIFEST_FILE, load_manifest, save_manifest, new_manifest, live_mask,
+								  write_tombstones)
+from backend.rag.shards import SHARDS_FILE, is_sharded, assign_shards, shard_dir, write_shard_map
+from backend.rag.generations import new_generation, publish, discard, prune
 
 ART = "artifacts"
+STAGED = ".compact.tmp"  # suffix of compacted chunks.jsonl / manifest.json awaiting commit_compaction
 
-def read_chunks(chunks_path: str):
+def read_chunks(chunks_path: str, offset: int = 0):
+	"""Read chunks.jsonl from byte `offset` (0 = whole file)."""
 	texts, metas = [], []
 	with open(chunks_path, "rb") as f:
+		f.seek(offset)
 		for line in f:
 			rec = orjson.loads(line)
 			texts.append(rec["text"])
@@ -17,36 +29,304 @@ def read_chunks(chunks_path: str):
 				"page": rec["page"],
 				"source_path": rec["source_path"],
 				"n_tokens": rec["n_tokens"],
+				"start_char": rec.get("start_char", -1),
+				"end_char": rec.get("end_char", -1),
 				})
 	return texts, metas
 
-def build_bm25(texts: List[str], out_dir: str):
-	tokenized = [t.split() for t in texts]
-	bm25 = BM25Okapi(tokenized)
-	os.makedirs(out_dir, exist_ok=True)
-	with open(os.path.join(out_dir, "bm25_tokens.pkl"), "wb") as f:
-		pickle.dump(tokenized, f)
-	return len(tokenized)
+def build_bm25(texts: List[str], out_dir: str, live: Optional[np.ndarray] = None):
+	# CSR inverted index with precomputed Okapi weights (see bm25_index.py)
+	tokenized = [tokenize(t) for t in texts]
+	meta = build_bm25_index(tokenized, out_dir, live)
+	return meta["n_live"], meta["n_terms"]
 
-def build_dense(texts: List[str], out_dir: str, model_name="BAAI/bge-small-en-v1.5", batch_size=64):
-	model = SentenceTransformer(model_name)
+def encode(texts: List[str], model_name="BAAI/bge-small-en-v1.5", batch_size=64) -> np.ndarray:
+	model = get_embedder(model_name)
 	# Encode in batches
 	embs = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=True)
-	embs = np.asarray(embs, dtype="float32")
-	# FAISS for cosine -> use inner product with normalized vectors
-	index = faiss.IndexFlatIP(embs.shape[1])
-	index.add(embs)
+	return np.asarray(embs, dtype="float32")
+
+def build_dense(texts: List[str], out_dir: str, model_name="BAAI/bge-small-en-v1.5", batch_size=64,
+				cfg: Optional[Dict] = None, report_queries: int = 0, report_k: int = 10,
+				embs: Optional[np.ndarray] = None):
+	"""
+	Encode and index. `cfg` picks the FAISS index type and quantization (see
+	dense_index.DEFAULTS); it is recorded in dense_index.json so Retriever applies the
+	same search parameters. With report_queries > 0, a recall@k vs latency sweep
+	against exact float32 search, plus index / stored-matrix sizes, is written to
+	dense_report.json.
+	"""
+	cfg = cfg or dense_config()
+	if embs is None:
+		embs = encode(texts, model_name, batch_size)
+	index = make_index(embs, cfg)
 	os.makedirs(out_dir, exist_ok=True)
-	faiss.write_index(index, os.path.join(out_dir, "faiss.index"))
-	np.save(os.path.join(out_dir, "embeddings.npy"), embs) # for testing
+	write_index(index, out_dir, cfg)
+	save_dense_config(cfg, out_dir)
+	save_embeddings(embs, out_dir, cfg) # kept for rescoring, compaction and rebuilds
+	if report_queries > 0 and len(embs):
+		report = recall_report(index, embs, cfg, k=report_k, n_queries=report_queries,
+							   stored=StoredEmbeddings(out_dir))
+		with open(os.path.join(out_dir, "dense_report.json"), "wb") as f:
+			f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+		print_report(report)
 	return embs.shape
 
-def write_meta(metas: List[Dict], out_dir: str):
-	with open(os.path.join(out_dir, "meta_rows.jsonl"), "wb") as f:
-		for m in metas:
-			f.write(orjson.dumps(m) + b"\n")
+def print_report(report: Dict):
+	k = report["k"]
+	print(f"Dense report ({report['type']}/{report['quant']}, n={report['n_vectors']}, queries={report['n_queries']}):")
+	print(f"  flat (exact): p50={report['flat']['p50_ms']}ms p95={report['flat']['p95_ms']}ms")
+	for row in report["points"]:
+		knob = " ".join(f"{a}={b}" for a, b in row.items() if a in ("nprobe", "ef_search", "rescore"))
+		print(f"  {knob or 'exact':24s} recall@{k}={row[f'recall@{k}']:.4f} p50={row['p50_ms']}ms p95={row['p95_ms']}ms")
+	mem = report["memory"]
+	print(f"  index: {mem['index_bytes'] / 2**20:.1f} MiB ({mem['index_ratio']}x smaller than float32 flat)")
+	if "stored_bytes" in mem:
+		print(f"  {'embeddings.npy'}: {mem['stored_bytes'] / 2**20:.1f} MiB {mem['stored_dtype']} ({mem['stored_ratio']}x smaller than float32)")
+
+def update_dense(texts: List[str], out_dir: str, model_name="BAAI/bge-small-en-v1.5", batch_size=64):
+	"""Embed only the new rows and add them; FAISS ids stay equal to row numbers."""
+	cfg = load_dense_config(out_dir)
+	if not texts:
+		return np.load(os.path.join(out_dir, "embeddings.npy"), mmap_mode="r").shape
+	embs = encode(texts, model_name, batch_size)
+	index = read_index(out_dir, cfg)
+	add_vectors(index, embs, cfg)
+	write_index(index, out_dir, cfg)
+	return save_embeddings(embs, out_dir, cfg, append=True)
+
+def write_meta(metas: List[Dict], out_dir: str, chunks_bytes: int = 0, append: bool = False,
+			   manifest_id: Optional[str] = None):
+	"""
+	Row metadata goes to the columnar meta store (see meta_store.py). meta_count.json
+	also records how many bytes of chunks.jsonl are indexed, and which manifest they
+	came from, so an incremental build can seek straight to the first new row.
+	"""
+	n_rows = append_meta_store(metas, out_dir) if append else write_meta_store(metas, out_dir)
 	with open(os.path.join(out_dir, "meta_count.json"), "wb") as f:
-		f.write(orjson.dumps({"n_rows": len(metas)}))
+		f.write(orjson.dumps({"n_rows": n_rows, "chunks_bytes": chunks_bytes, "manifest_id": manifest_id}))
+
+def _check_manifest(chunks_path: str, manifest: Dict):
+	"""Refuse to apply tombstones from a manifest that describes a different chunks.jsonl."""
+	if "chunks_bytes" not in manifest or not os.path.exists(os.path.join(os.path.dirname(chunks_path), MANIFEST_FILE)):
+		return  # older layout: nothing to check against
+	size = os.path.getsize(chunks_path)
+	if manifest["chunks_bytes"] != size:
+		raise RuntimeError(f"manifest.json covers {manifest['chunks_bytes']} bytes of chunks.jsonl, "
+						   f"the file has {size}; re-run ingest first")
+
+def build_all(chunks_path: str, out_dir: str, model_name="BAAI/bge-small-en-v1.5", batch_size=64,
+			  dense_cfg: Optional[Dict] = None, report_queries: int = 0, report_k: int = 10):
+	manifest = load_manifest(os.path.dirname(chunks_path))
+	_check_manifest(chunks_path, manifest)
+	texts, metas = read_chunks(chunks_path)
+	print(f"Loaded chunks: {len(texts)}")
+	live = live_mask(manifest, len(texts))
+	if is_sharded(out_dir):
+		os.remove(os.path.join(out_dir, SHARDS_FILE))  # back to a single index
+
+	n_rows = write_chunk_store(texts, out_dir)
+	print(f"Chunk store written: {n_rows}")
+
+	n_docs, n_terms = build_bm25(texts, out_dir, live)
+	print(f"BM25 index built: {n_docs} docs, {n_terms} terms")
+
+	shape = build_dense(texts, out_dir, model_name, batch_size, dense_cfg, report_queries, report_k)
+	print(f"Dense index built: {shape}")
+
+	write_meta(metas, out_dir, chunks_bytes=os.path.getsize(chunks_path), manifest_id=manifest.get("id"))
+	write_tombstones(np.flatnonzero(~live), out_dir)
+	print("Meta written.")
+
+def build_sharded(chunks_path: str, out_dir: str, n_shards: int, model_name="BAAI/bge-small-en-v1.5",
+				  batch_size=64, dense_cfg: Optional[Dict] = None):
+	"""
+	Split live rows by document into `n_shards` self-contained indexes under
+	out_dir/shard_NNN (see shards.py). Rows are embedded once; BM25 weights in every
+	shard use corpus-wide idf / avgdl. Tombstoned rows are left out entirely.
+	"""
+	manifest = load_manifest(os.path.dirname(chunks_path))
+	_check_manifest(chunks_path, manifest)
+	texts, metas = read_chunks(chunks_path)
+	live = live_mask(manifest, len(texts))
+	groups = assign_shards(metas, live, n_shards)
+	if len(groups) < n_shards:
+		print(f"Only {len(groups)} documents: building {len(groups)} shards instead of {n_shards}")
+	print(f"Loaded chunks: {len(texts)} -> {len(groups)} shards of {[len(g) for g in groups]} rows")
+
+	tokenized = [tokenize(t) for t in texts]
+	stats = corpus_stats(tokenized, live)
+	live_rows = np.flatnonzero(live)
+	embs = encode([texts[r] for r in live_rows], model_name, batch_size)
+	pos = np.full(len(texts), -1, dtype=np.int64)
+	pos[live_rows] = np.arange(len(live_rows))
+
+	cfg = dense_config() if dense_cfg is None else dense_config(**dense_cfg)
+	for name in os.listdir(out_dir) if os.path.isdir(out_dir) else []:
+		if name.startswith("shard_") and os.path.isdir(os.path.join(out_dir, name)):
+			shutil.rmtree(os.path.join(out_dir, name))  # layout of an earlier --shards build
+	for i, rows in enumerate(groups):
+		d = shard_dir(out_dir, i)
+		write_chunk_store([texts[r] for r in rows], d)
+		build_bm25_index([tokenized[r] for r in rows], d, corpus=stats)
+		build_dense([], d, model_name, batch_size, dict(cfg), embs=embs[pos[rows]])
+		write_meta([metas[r] for r in rows], d)
+		write_tombstones(np.zeros(0, dtype=np.int64), d)
+		print(f"Shard {i}: {len(rows)} rows")
+	write_shard_map(out_dir, groups, len(texts), {
+		"dense": cfg, "emb_model": model_name, "chunks_bytes": os.path.getsize(chunks_path),
+		"bm25": {"n_docs": stats["n_docs"], "avgdl": stats["avgdl"]},
+	})
+	print("Shard map written.")
+
+def update_all(chunks_path: str, out_dir: str, model_name="BAAI/bge-small-en-v1.5", batch_size=64):
+	"""
+	Incremental build: index only rows appended to chunks.jsonl since the last build
+	and apply the manifest's tombstones. Cost is proportional to the new rows (plus a
+	vectorized BM25 re-weighting), not to the corpus.
+	"""
+	if is_sharded(out_dir):
+		raise RuntimeError("incremental builds are not supported for sharded indexes; rebuild with --shards")
+	count_path = os.path.join(out_dir, "meta_count.json")
+	if not os.path.exists(count_path):
+		return build_all(chunks_path, out_dir, model_name, batch_size)
+	with open(count_path, "rb") as f:
+		done = orjson.loads(f.read())
+	manifest = load_manifest(os.path.dirname(chunks_path))
+	stale = _stale_offset(chunks_path, manifest, done)
+	if stale:
+		print(f"Full rebuild: {stale}")
+		return build_all(chunks_path, out_dir, model_name, batch_size, dense_cfg=load_dense_config(out_dir))
+
+	texts, metas = read_chunks(chunks_path, offset=done["chunks_bytes"])
+	n_rows = done["n_rows"] + len(texts)
+	if n_rows != manifest["n_rows"]:
+		print(f"Full rebuild: {n_rows} rows after the indexed offset, manifest has {manifest['n_rows']}")
+		return build_all(chunks_path, out_dir, model_name, batch_size, dense_cfg=load_dense_config(out_dir))
+	live = live_mask(manifest, n_rows)
+	print(f"New chunks: {len(texts)} (indexed: {done['n_rows']}, tombstoned: {int((~live).sum())})")
+
+	append_chunk_store(texts, out_dir)
+	meta = update_bm25_index(out_dir, [tokenize(t) for t in texts], live)
+	print(f"BM25 index updated: {meta['n_live']} docs, {meta['n_terms']} terms")
+	shape = update_dense(texts, out_dir, model_name, batch_size)
+	print(f"Dense index updated: {shape}")
+	write_meta(metas, out_dir, chunks_bytes=os.path.getsize(chunks_path), append=True,
+			   manifest_id=manifest.get("id"))
+	write_tombstones(np.flatnonzero(~live), out_dir)
+	print("Meta written.")
+
+def _stale_offset(chunks_path: str, manifest: Dict, done: Dict) -> Optional[str]:
+	"""
+	Why the indexed offset into chunks.jsonl can't be trusted (None if it can): the
+	file was rewritten since the last build (--full, lost manifest), or it no longer
+	lines up with the indexed rows.
+	"""
+	if "chunks_bytes" not in done:
+		return "index built before incremental support; offsets unknown"
+	if done.get("manifest_id") != manifest.get("id"):
+		return "chunks.jsonl was re-ingested from scratch since the last build"
+	if manifest["n_rows"] < done["n_rows"]:
+		return f"manifest has {manifest['n_rows']} rows, index has {done['n_rows']}"
+	offset = done["chunks_bytes"]
+	size = os.path.getsize(chunks_path)
+	if size < offset or manifest.get("chunks_bytes", size) != size:
+		return f"chunks.jsonl is {size} bytes, index covers {offset}, manifest {manifest.get('chunks_bytes')}"
+	if offset:
+		with open(chunks_path, "rb") as f:
+			f.seek(offset - 1)
+			if f.read(1) != b"\n":
+				return f"indexed offset {offset} is not at a row boundary"
+	return None
+
+def compact(chunks_path: str, out_dir: str):
+	"""
+	Drop tombstoned rows for good: rewrite chunks.jsonl and every index with rows
+	renumbered. Reuses stored embeddings, so nothing is re-embedded. The compacted
+	chunks.jsonl and manifest are staged next to the originals and only swapped in by
+	commit_compaction() once the new index is published; until then the served index
+	keeps matching the source files.
+	"""
+	if is_sharded(out_dir):
+		raise RuntimeError("sharded indexes leave tombstoned rows out already; rebuild with --shards")
+	art_dir = os.path.dirname(chunks_path)
+	manifest = load_manifest(art_dir)
+	with open(os.path.join(out_dir, "meta_count.json"), "rb") as f:
+		n_rows = orjson.loads(f.read())["n_rows"]
+	if manifest["n_rows"] != n_rows:
+		raise RuntimeError("chunks.jsonl has unindexed rows; run an incremental build before compacting")
+	live = live_mask(manifest, n_rows)
+	new_row = np.cumsum(live) - 1
+
+	staged = chunks_path + STAGED
+	try:
+		with open(chunks_path, "rb") as f_in, open(staged, "wb") as f_out:
+			for i, line in enumerate(f_in):
+				if live[i]:
+					f_out.write(line)
+		for d in manifest["docs"].values():
+			s, e = d["rows"]
+			start = int(new_row[s]) if e > s else 0
+			d["rows"] = [start, start + (e - s)]
+		# a new id: the old generation's offsets don't apply to the compacted file
+		manifest.update(id=new_manifest()["id"], tombstones=[], n_rows=int(live.sum()),
+						chunks_bytes=os.path.getsize(staged))
+		save_manifest(manifest, art_dir, MANIFEST_FILE + STAGED)
+
+		texts, metas = read_chunks(staged)
+		write_chunk_store(texts, out_dir)
+		build_bm25(texts, out_dir)
+		cfg = load_dense_config(out_dir)
+		stored = StoredEmbeddings(out_dir)
+		embs = stored.all()[live]
+		write_index(make_index(embs, cfg), out_dir, cfg)
+		# keep the stored codes (and int8 scale) as they are; re-quantizing would compound the error
+		kept = np.asarray(stored.data[live])
+		del stored
+		np.save(os.path.join(out_dir, "embeddings.npy"), kept)
+		write_meta(metas, out_dir, chunks_bytes=manifest["chunks_bytes"], manifest_id=manifest["id"])
+		write_tombstones(np.zeros(0, dtype=np.int64), out_dir)
+	except BaseException:
+		discard_compaction(chunks_path)
+		raise
+	print(f"Compacted: {n_rows} -> {len(texts)} rows")
+
+def commit_compaction(chunks_path: str):
+	"""
+	Swap in the chunks.jsonl and manifest staged by compact(); call once the compacted
+	index is published. chunks.jsonl goes first: if we die in between, the old manifest
+	no longer matches the file, so builds refuse it and the next ingest starts over.
+	"""
+	art_dir = os.path.dirname(chunks_path)
+	os.replace(chunks_path + STAGED, chunks_path)
+	os.replace(os.path.join(art_dir, MANIFEST_FILE + STAGED), os.path.join(art_dir, MANIFEST_FILE))
+
+def discard_compaction(chunks_path: str):
+	art_dir = os.path.dirname(chunks_path)
+	for path in (chunks_path + STAGED, os.path.join(art_dir, MANIFEST_FILE + STAGED)):
+		if os.path.exists(path):
+			os.remove(path)
+
+def build_generation(art_dir: str, build: str, fn: Callable[[str], Any],
+					 on_publish: Optional[Callable[[], Any]] = None) -> str:
+	"""
+	Run `fn(out_dir)` against a new generation of art_dir and publish it (see
+	generations.py); running servers pick it up without a restart. Incremental builds
+	and compaction start from a copy of the served generation, which is never modified.
+	`on_publish` runs right after the swap (compaction commits its source files there).
+	"""
+	version, out_dir = new_generation(art_dir, base=build in ("incremental", "compact"))
+	try:
+		fn(out_dir)
+	except BaseException:
+		discard(art_dir, version)
+		raise
+	publish(art_dir, version, {"build": build})
+	if on_publish is not None:
+		on_publish()
+	removed = prune(art_dir)
+	print(f"Published generation {version}" + (f" (pruned {len(removed)})" if removed else ""))
+	return version
 
 if __name__ == "__main__":
 	ap = argparse.ArgumentParser()
@@ -54,17 +334,53 @@ if __name__ == "__main__":
 	ap.add_argument("--out", default=ART)
 	ap.add_argument("--model", default="BAAI/bge-small-en-v1.5")
 	ap.add_argument("--batch", type=int, default=64)
+	ap.add_argument("--index", choices=INDEX_TYPES, default="flat", help="FAISS index type")
+	ap.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4*sqrt(n))")
+	ap.add_argument("--nprobe", type=int, default=None, help="IVF lists probed per query")
+	ap.add_argument("--pq-m", type=int, default=None, help="IVF-PQ sub-quantizers")
+	ap.add_argument("--pq-nbits", type=int, default=None, help="IVF-PQ bits per code")
+	ap.add_argument("--hnsw-m", type=int, default=None, help="HNSW graph degree")
+	ap.add_argument("--ef-construction", type=int, default=None)
+	ap.add_argument("--ef-search", type=int, default=None)
+	ap.add_argument("--train-size", type=int, default=None, help="IVF training sample size")
+	ap.add_argument("--quant", choices=QUANT_TYPES, default=None,
+					help="FAISS vector codes: fp32, fp16/int8 scalar quantization, or binary (sign bits)")
+	ap.add_argument("--store", choices=STORE_TYPES, default=None, help="dtype of the stored embedding matrix")
+	ap.add_argument("--rescore", type=int, default=None,
+					help="rescore k*N shortlisted rows exactly (default 4 for lossy indexes, 0 = off)")
+	ap.add_argument("--report-queries", type=int, default=0, help="Queries for the recall/latency report (0 = skip)")
+	ap.add_argument("--report-k", type=int, default=10)
+	ap.add_argument("--incremental", action="store_true", help="Index only rows added since the last build")
+	ap.add_argument("--compact", action="store_true", help="Physically drop tombstoned rows")
+	ap.add_argument("--shards", type=int, default=0,
+					help="Split the corpus by document into N shard indexes (served by ShardedRetriever)")
+	ap.add_argument("--in-place", action="store_true",
+					help="Write into --out itself instead of publishing a new generation under it")
 	args = ap.parse_args()
 
-	texts, metas = read_chunks(args.chunks)
-	print(f"Loaded chunks: {len(texts)}")
-
-	n_tok = build_bm25(texts, args.out)
-	print(f"BM25 tokens prepared: {n_tok}")
-
-	shape = build_dense(texts, args.out, args.model, args.batch)
-	print(f"Dense index built: {shape}")
-
-	write_meta(metas, args.out)
-	print("Meta written.")	
+	after = None
+	if args.compact:
+		build = "compact"
+		run = lambda out: compact(args.chunks, out)
+		after = lambda: commit_compaction(args.chunks)
+	elif args.incremental:
+		build = "incremental"
+		run = lambda out: update_all(args.chunks, out, args.model, args.batch)
+	else:
+		cfg = dense_config(type=args.index, nlist=args.nlist, nprobe=args.nprobe, pq_m=args.pq_m,
+						   pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction,
+						   ef_search=args.ef_search, train_size=args.train_size, quant=args.quant,
+						   store=args.store, rescore=args.rescore)
+		if args.shards > 0:
+			build = "sharded"
+			run = lambda out: build_sharded(args.chunks, out, args.shards, args.model, args.batch, cfg)
+		else:
+			build = "full"
+			run = lambda out: build_all(args.chunks, out, args.model, args.batch, cfg, args.report_queries, args.report_k)
+	if args.in_place:
+		run(args.out)
+		if after is not None:
+			after()
+	else:
+		build_generation(args.out, build, run, after)
 
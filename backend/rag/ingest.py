@@ -1,12 +1,16 @@
 import os
 import glob
+import time
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Iterator, Tuple
-import fitz  # PyMuPDF
+from typing import List, Dict, Iterator, Tuple, Optional
 import re
 import orjson
-from transformers import AutoTokenizer
-import nltk
+from functools import lru_cache
+from backend.rag.manifest import (MANIFEST_FILE, load_manifest, save_manifest, new_manifest,
+								  file_sha256, n_live, doc_summary)
 
 # ------------------------------
 # Config
@@ -18,11 +22,17 @@ OVERLAP_TOKENS = 100
 # ------------------------------
 # Tokenizer (use embedding model's tokenizer for consistency)
 # ------------------------------
-_tokenizer = AutoTokenizer.from_pretrained(EMB_MODEL)
-_tokenizer.model_max_length = 100_000
+# PyMuPDF, nltk and transformers are imported where used, and the tokenizer is loaded
+# on first use (once per process), so importing this module stays cheap.
+@lru_cache(maxsize=1)
+def get_tokenizer():
+	from transformers import AutoTokenizer
+	tok = AutoTokenizer.from_pretrained(EMB_MODEL)
+	tok.model_max_length = 100_000
+	return tok
 
 def count_tokens(text: str) -> int:
-	return len(_tokenizer.encode(text, add_special_tokens=False, truncation=True))
+	return len(get_tokenizer().encode(text, add_special_tokens=False, truncation=True))
 
 
 # ------------------------------
@@ -37,104 +47,121 @@ def clean_text(t: str) -> str:
 	return t
 
 # ------------------------------
-# Sentence splitting (NLTK)
+# Sentence splitting (NLTK) on top of one offset-mapped tokenization per page
 # ------------------------------
 def split_by_regex(text: str) -> List[str]:
 	splitter = re.compile(r'(?<=[.!?])\s+')
 	parts = splitter.split(text.strip())
 	return [p for p in parts if p.strip()]
 
-def split_long_text_to_token_windows(text: str, window_tokens: int, overlap_tokens: int) -> List[str]:
-	"""Hard-split an oversized segment into token windows to keep lengths under control."""
-	ids = _tokenizer.encode(text, add_special_tokens=False)
-	out = []
-	stride = max(1, window_tokens - overlap_tokens)
-	for start in range(0, len(ids), stride):
-		end = start + window_tokens
-		sub_ids = ids[start:end]
-		if not sub_ids:
-			break
-		out.append(_tokenizer.decode(sub_ids, skip_special_tokens=True))
-	return out
+MAX_SENT_TOKENS = 256  # a "sentence" longer than this is sub-split into token windows
+LONG_SENT_WINDOW = 200
+LONG_SENT_OVERLAP = 50
 
-def split_sentences(text: str) -> List[str]:
-	# fall back if language detection is needed later; for now, assuming English
-	base = nltk.sent_tokenize(text)
-
-	safe: List[str] = []
-	MAX_SENT_TOKENS = 256 # if a "sentence" exceeds this, it will be sub-splited
+def encode_with_offsets(text: str) -> Tuple[List[int], List[int]]:
+	"""Tokenize once; returns per-token (start_chars, end_chars) into `text`."""
+	enc = get_tokenizer()(text, add_special_tokens=False, truncation=True, return_offsets_mapping=True)
+	offs = enc["offset_mapping"]
+	return [o[0] for o in offs], [o[1] for o in offs]
 
-	for seg in base:
-		if count_tokens(seg) > MAX_SENT_TOKENS:
-			# break it into safe windows; use smaller window (e.g., 200) and overlap (50)
-			safe.extend(split_long_text_to_token_windows(seg, window_tokens=200, overlap_tokens=50))
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+	# fall back if language detection is needed later; for now, assuming English
+	import nltk
+	spans = []
+	cursor = 0
+	for sent in nltk.sent_tokenize(text):
+		# punkt returns substrings in order, so a forward search recovers exact offsets
+		i = text.find(sent, cursor)
+		if i < 0 or not sent.strip():
+			continue
+		spans.append((i, i + len(sent)))
+		cursor = i + len(sent)
+	return spans
+
+def token_windows(lo: int, hi: int, window_tokens: int, overlap_tokens: int) -> List[Tuple[int, int]]:
+	"""Hard-split token range [lo, hi) into overlapping windows to keep lengths under control."""
+	stride = max(1, window_tokens - overlap_tokens)
+	return [(s, min(s + window_tokens, hi)) for s in range(lo, hi, stride)]
+
+def split_units(text: str, starts: List[int], target_tokens: int = TARGET_TOKENS,
+				overlap_tokens: int = OVERLAP_TOKENS) -> List[Tuple[int, int]]:
+	"""
+	Sentences of `text` as token ranges [lo, hi) into the page's token arrays.
+	Tokens never straddle a sentence boundary (punkt splits on whitespace), so the
+	range length equals the sentence's own token count.
+	"""
+	units: List[Tuple[int, int]] = []
+	for s, e in sentence_spans(text):
+		lo, hi = bisect_left(starts, s), bisect_left(starts, e)
+		if hi - lo > MAX_SENT_TOKENS:
+			units.extend(token_windows(lo, hi, LONG_SENT_WINDOW, LONG_SENT_OVERLAP))
 		else:
-			safe.append(seg)
-	return [s for s in safe if s.strip()]
-
+			units.append((lo, hi))
+	# ensure no single unit exceeds target by forcibly windowing it
+	out: List[Tuple[int, int]] = []
+	for lo, hi in units:
+		if hi - lo > target_tokens:
+			out.extend(token_windows(lo, hi, target_tokens, overlap_tokens))
+		else:
+			out.append((lo, hi))
+	return out
 
 # ------------------------------
 # Chunking: build ~TARGET_TOKENS chunks with OVERLAP_TOKENS
 # Strategy: add sentences until the target is passed; start next chunk with overlap tail
 # ------------------------------
-def chunk_by_sentences(sentences: List[str],
-					   target_tokens: int = TARGET_TOKENS,
-					   overlap_tokens: int = OVERLAP_TOKENS) -> List[str]:
-	
-	# ensure no single "sentence" exceeds target by forcibly windowing it
-	normalized: List[str] = []
-	for s in sentences:
-		if count_tokens(s) > target_tokens:
-			normalized.extend(split_long_text_to_token_windows(s, window_tokens=target_tokens, overlap_tokens=overlap_tokens))
-		else:
-			normalized.append(s)
-	sentences = normalized
-
-	chunks = []
-	buf: List[str] = []
+def pack_units(units: List[Tuple[int, int]],
+			   target_tokens: int = TARGET_TOKENS,
+			   overlap_tokens: int = OVERLAP_TOKENS) -> List[Tuple[int, int]]:
+	"""Group consecutive units into chunks; returns [first, last) unit index ranges."""
+	n = [hi - lo for lo, hi in units]
+	chunks: List[Tuple[int, int]] = []
+	bs = 0  # buffer is units[bs:i]
 	buf_tok = 0
-
-	def flush_chunk():
-		nonlocal buf
-		if not buf:
-			return None
-		chunk = " ".join(buf).strip()
-		chunks.append(chunk)
-		return chunk
-
 	i = 0
-	while i < len(sentences):
-		s = sentences[i]
-		s_tokens = count_tokens(s)
-		if buf_tok + s_tokens <= target_tokens or not buf:
-			buf.append(s)
-			buf_tok += s_tokens
+	while i < len(units):
+		if buf_tok + n[i] <= target_tokens or bs == i:
+			buf_tok += n[i]
 			i += 1
-		else:
-			# flush current
-			chunk = flush_chunk()
-			# build overlap tail
-			if overlap_tokens > 0:
-				tail = []
-				tail_tok = 0
-				# walk backwards through buf until overlap budget
-				for sent in reversed(buf):
-					st = count_tokens(sent)
-					if tail_tok + st > overlap_tokens and tail:
-						break
-					tail.append(sent)
-					tail_tok += st
-				tail = list(reversed(tail))
-				buf = tail[:] # start next buffer with overlap tail
-				buf_tok = sum(count_tokens(x) for x in buf)
-			else:
-				buf = []
-				buf_tok = 0
-	
-	# flush remainder
-	flush_chunk()
+			continue
+		chunks.append((bs, i))
+		if overlap_tokens <= 0:
+			bs, buf_tok = i, 0
+			continue
+		# walk backwards through the buffer until the overlap budget is spent
+		t, tail_tok = i, 0
+		while t > bs:
+			st = n[t - 1]
+			if tail_tok + st > overlap_tokens and t < i:
+				break
+			t -= 1
+			tail_tok += st
+		if tail_tok + n[i] > target_tokens:
+			# the tail alone can't take the next unit; without this the same tail would
+			# be flushed forever, so start clean instead
+			t, tail_tok = i, 0
+		bs, buf_tok = t, tail_tok
+	if bs < len(units):
+		chunks.append((bs, len(units)))
 	return chunks
 
+def chunk_text(text: str, target_tokens: int = TARGET_TOKENS,
+			   overlap_tokens: int = OVERLAP_TOKENS) -> List[Tuple[int, int, int]]:
+	"""
+	Chunk one page in a single tokenizer pass. Returns (start_char, end_char, n_tokens)
+	with text[start_char:end_char] being the exact chunk text.
+	"""
+	starts, ends = encode_with_offsets(text)
+	units = split_units(text, starts, target_tokens, overlap_tokens)
+	out = []
+	for first, last in pack_units(units, target_tokens, overlap_tokens):
+		lo = units[first][0]
+		hi = max(u[1] for u in units[first:last])
+		if hi <= lo:
+			continue
+		out.append((starts[lo], ends[hi - 1], hi - lo))
+	return out
+
 # ------------------------------
 # Data model
 # ------------------------------
@@ -152,62 +179,175 @@ class ChunkRecord:
 # ------------------------------
 # PDF extraction (page-level)
 # ------------------------------
-def extract_pages(pdf_path: str) -> List[Tuple[int, str]]:
+def extract_pages(pdf_path: str, start: int = 0, end: Optional[int] = None) -> List[Tuple[int, str]]:
+	"""Pages [start, end) as (1-based page number, cleaned text)."""
+	import fitz  # PyMuPDF
 	doc = fitz.open(pdf_path)
 	pages = []
-	for pno in range(len(doc)):
+	for pno in range(start, len(doc) if end is None else min(end, len(doc))):
 		text = doc.load_page(pno).get_text("text")
 		pages.append((pno + 1, clean_text(text)))
 	doc.close()
 	return pages
 
+def page_count(pdf_path: str) -> int:
+	import fitz
+	doc = fitz.open(pdf_path)
+	n = len(doc)
+	doc.close()
+	return n
+
 # ------------------------------
 # Main pipeline
 # ------------------------------
-def ingest_folder(input_dir: str, artifacts_dir: str = "artifacts") -> Dict[str, Dict]:
+PAGES_PER_TASK = 64  # large PDFs are split into page ranges of this size for the worker pool
+# workers are spawned, not forked: /dev/ingest runs inside the threaded server process
+POOL_START_METHOD = "spawn"
+_SPACES = str.maketrans({c: " " for c in "\n\t\r\v\f\u00a0"})
+
+def chunk_pages(pdf_path: str, pages: List[Tuple[int, str]]) -> List[ChunkRecord]:
+	doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
+	records: List[ChunkRecord] = []
+	for page_no, page_text in pages:
+		if not page_text:
+			continue
+		# spans are exact offsets into the cleaned page text; the stored text maps each
+		# whitespace char to a space, one for one, so it is single-line like the old
+		# " ".join(sentences) chunks and text[i] is still page_text[start + i]
+		for idx, (start, end, n_tokens) in enumerate(chunk_text(page_text)):
+			records.append(ChunkRecord(
+								doc_id=doc_id,
+								source_path=pdf_path,
+								page=page_no,
+								chunk_id=f"{doc_id}:{page_no}:{idx+1}",
+								start_char=start,
+								end_char=end,
+								text=page_text[start:end].translate(_SPACES),
+								n_tokens=n_tokens,
+							))
+	return records
+
+def ingest_pdf(pdf_path: str) -> Tuple[int, List[ChunkRecord]]:
+	"""Extract, split and chunk one PDF. Returns (n_pages, chunk records)."""
+	pages = extract_pages(pdf_path)
+	return len(pages), chunk_pages(pdf_path, pages)
+
+def _ingest_task(task: Tuple[str, int, Optional[int]]) -> Tuple[int, int, bytes]:
+	"""
+	Worker unit: one PDF or one page range of it. Returns (n_pages, n_chunks, jsonl bytes);
+	serialization happens here so the parent only concatenates, in task order.
+	"""
+	pdf_path, start, end = task
+	pages = extract_pages(pdf_path, start, end)
+	records = chunk_pages(pdf_path, pages)
+	return len(pages), len(records), b"".join(orjson.dumps(asdict(r)) + b"\n" for r in records)
+
+def _init_worker():
+	get_tokenizer()  # load once per worker, before its first task
+
+def _plan_tasks(pdfs: List[str], workers: int) -> List[Tuple[str, int, Optional[int]]]:
+	if workers <= 1:
+		return [(p, 0, None) for p in pdfs]
+	tasks = []
+	for p in pdfs:
+		n = page_count(p)
+		if n <= PAGES_PER_TASK:
+			tasks.append((p, 0, None))
+		else:
+			tasks.extend((p, s, s + PAGES_PER_TASK) for s in range(0, n, PAGES_PER_TASK))
+	return tasks
+
+def ingest_folder(input_dir: str, artifacts_dir: str = "artifacts",
+				  incremental: bool = True, workers: int = 1,
+				  progress: bool = False) -> Dict[str, Dict]:
+	"""
+	Incremental by default: PDFs are matched against the manifest by path and content
+	hash; only added/changed ones are re-chunked and appended to chunks.jsonl, and the
+	rows of changed/deleted ones are tombstoned. Run index_build --incremental afterwards.
+	The manifest records how many bytes of chunks.jsonl it covers; rows appended by a
+	failed or interrupted run are truncated away, here or at the start of the next run.
+	workers > 1 fans PDFs (and page ranges of large ones) over a process pool; the
+	output is byte-identical to workers=1.
+	"""
 	os.makedirs(artifacts_dir, exist_ok=True)
 	out_jsonl = os.path.join(artifacts_dir, "chunks.jsonl")
 	meta_path = os.path.join(artifacts_dir, "meta.json")
 
-	pdfs = sorted(glob.glob(os.path.join(input_dir, "**", "*.pdf"), recursive=True))
-	meta: Dict[str, Dict] = {}
-	n_chunks = 0
-
-	with open(out_jsonl, "wb") as f_out:
-		for pdf_path in pdfs:
-			doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
-			pages = extract_pages(pdf_path)
-			meta[doc_id] = {"source_path": pdf_path, "n_pages": len(pages)}
-			for page_no, page_text in pages:
-				if not page_text:
-					continue
-				sents = split_sentences(page_text)
-				if not sents:
-					continue
-				chunks = chunk_by_sentences(sents)
-				# Map back to char spans for this page 
-				page_concat = " ".join(sents)
-				for idx, chunk in enumerate(chunks):
-					# naive span find; if duplicates exist, find first occurrence then mark used
-					start = page_concat.find(chunk)
-					end = start + len(chunk) if start != -1 else -1
-					rec = ChunkRecord(
-										doc_id=doc_id,
-										source_path=pdf_path,
-										page=page_no,
-										chunk_id=f"{doc_id}:{page_no}:{idx+1}",
-										start_char=start,
-										end_char=end,
-										text=chunk,
-										n_tokens=count_tokens(chunk),
-									)
-					f_out.write(orjson.dumps(asdict(rec)) + b"\n")
-					n_chunks += 1
+	manifest = load_manifest(artifacts_dir)
+	# a chunks.jsonl without a manifest (older layout) can't be diffed: rebuild it
+	if not incremental or not os.path.exists(out_jsonl) or not os.path.exists(os.path.join(artifacts_dir, MANIFEST_FILE)):
+		manifest = new_manifest()
+		open(out_jsonl, "wb").close()
+	elif "chunks_bytes" in manifest:
+		size = os.path.getsize(out_jsonl)
+		if size > manifest["chunks_bytes"]:
+			# rows appended by a run that died before saving the manifest
+			os.truncate(out_jsonl, manifest["chunks_bytes"])
+		elif size < manifest["chunks_bytes"]:
+			# rows the manifest points at are gone: nothing to diff against
+			manifest = new_manifest()
+			open(out_jsonl, "wb").close()
+	size0 = os.path.getsize(out_jsonl)
 
+	pdfs = sorted(glob.glob(os.path.join(input_dir, "**", "*.pdf"), recursive=True))
+	hashes = {p: file_sha256(p) for p in pdfs}
+
+	docs = manifest["docs"]
+	removed = [p for p, d in docs.items() if hashes.get(p) != d["sha256"]]
+	for p in removed:
+		manifest["tombstones"].append(docs.pop(p)["rows"])
+	todo = [p for p in pdfs if p not in docs]
+
+	row = manifest["n_rows"]
+	n_new = n_pages_done = 0
+	t0 = time.time()
+	tasks = _plan_tasks(todo, workers)
+	pool = None
+	if workers > 1 and len(tasks) > 1:
+		pool = ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+								   mp_context=get_context(POOL_START_METHOD))
+	# map() yields in submission order, so the output is identical to the serial run
+	results = pool.map(_ingest_task, tasks) if pool else map(_ingest_task, tasks)
+	try:
+		with open(out_jsonl, "ab") as f_out:
+			for (pdf_path, _, _), (n_pages, n_chunks, blob) in zip(tasks, results):
+				f_out.write(blob)
+				d = docs.get(pdf_path)
+				if d is None:
+					doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
+					d = docs[pdf_path] = {"doc_id": doc_id, "sha256": hashes[pdf_path],
+										  "n_pages": 0, "rows": [row, row]}
+				d["n_pages"] += n_pages
+				d["rows"][1] += n_chunks
+				row += n_chunks
+				n_new += n_chunks
+				n_pages_done += n_pages
+				if progress:
+					dt = max(time.time() - t0, 1e-9)
+					print(f"[ingest] {pdf_path}: {n_pages_done} pages, {n_new} chunks "
+						  f"({n_pages_done/dt:.1f} pages/s, {n_new/dt:.1f} chunks/s)", flush=True)
+		elapsed = time.time() - t0
+		manifest["n_rows"] = row
+		manifest["chunks_bytes"] = os.path.getsize(out_jsonl)
+		save_manifest(manifest, artifacts_dir)
+	except BaseException:
+		# drop the rows the manifest doesn't know about, or the next run would renumber over them
+		os.truncate(out_jsonl, size0)
+		raise
+	finally:
+		if pool:
+			pool.shutdown()
+
+	n_chunks = n_live(manifest)
 	with open(meta_path, "wb") as f_meta:
-		f_meta.write(orjson.dumps({"docs": meta, "n_chunks": n_chunks}))
+		f_meta.write(orjson.dumps({"docs": doc_summary(manifest), "n_chunks": n_chunks}))
 
-	return {"n_docs": len(pdfs), "n_chunks": n_chunks, "artifacts": {"chunks": out_jsonl, "meta": meta_path}}
+	return {"n_docs": len(pdfs), "n_chunks": n_chunks,
+			"n_added": len(todo), "n_removed": len(removed), "n_new_chunks": n_new,
+			"n_pages": n_pages_done, "elapsed_s": round(elapsed, 3),
+			"pages_per_s": round(n_pages_done / elapsed, 2) if elapsed else None,
+			"chunks_per_s": round(n_new / elapsed, 2) if elapsed else None,
+			"artifacts": {"chunks": out_jsonl, "meta": meta_path}}
 
 # ------------------------------
 # CLI
@@ -217,8 +357,11 @@ if __name__ == "__main__":
 	ap = argparse.ArgumentParser(description="Ingest PDFs and produce chunk artifacts")
 	ap.add_argument("--input", default="data", help="Folder with PDFs")
 	ap.add_argument("--out", default="artifacts", help="Artifacts output folder")
+	ap.add_argument("--full", action="store_true", help="Ignore the manifest and re-ingest everything")
+	ap.add_argument("--workers", type=int, default=1, help="Worker processes (1 = serial)")
 	args = ap.parse_args()
-	stats = ingest_folder(args.input, args.out)
+	stats = ingest_folder(args.input, args.out, incremental=not args.full,
+						  workers=args.workers, progress=True)
 	print(stats)
 
 
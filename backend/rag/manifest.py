@@ -0,0 +1,61 @@
+import os, uuid, hashlib, orjson
+import numpy as np
+from typing import Dict, Optional
+
+MANIFEST_FILE = "manifest.json"
+TOMBSTONES_FILE = "tombstones.npy"
+
+def file_sha256(path: str, block: int = 1 << 20) -> str:
+	h = hashlib.sha256()
+	with open(path, "rb") as f:
+		for buf in iter(lambda: f.read(block), b""):
+			h.update(buf)
+	return h.hexdigest()
+
+def new_manifest() -> Dict:
+	"""
+	docs: {source_path: {doc_id, sha256, n_pages, rows: [start, end)}} where rows are
+	line numbers in chunks.jsonl; tombstones: [[start, end), ...] of rows whose
+	document was removed or changed; n_rows / chunks_bytes: lines and bytes of
+	chunks.jsonl the manifest covers; id: changes whenever chunks.jsonl is rewritten
+	from scratch, so an index built from an earlier file is never updated in place.
+	"""
+	return {"id": uuid.uuid4().hex, "docs": {}, "tombstones": [], "n_rows": 0, "chunks_bytes": 0}
+
+def load_manifest(art_dir: str) -> Dict:
+	path = os.path.join(art_dir, MANIFEST_FILE)
+	if not os.path.exists(path):
+		return new_manifest()
+	with open(path, "rb") as f:
+		return orjson.loads(f.read())
+
+def save_manifest(manifest: Dict, art_dir: str, name: str = MANIFEST_FILE):
+	os.makedirs(art_dir, exist_ok=True)
+	tmp = os.path.join(art_dir, name + ".tmp")
+	with open(tmp, "wb") as f:
+		f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+	os.replace(tmp, os.path.join(art_dir, name))
+
+def live_mask(manifest: Dict, n_rows: Optional[int] = None) -> np.ndarray:
+	n = manifest["n_rows"] if n_rows is None else n_rows
+	live = np.ones(n, dtype=bool)
+	for s, e in manifest["tombstones"]:
+		live[s:min(e, n)] = False
+	return live
+
+def n_live(manifest: Dict) -> int:
+	return sum(e - s for s, e in (d["rows"] for d in manifest["docs"].values()))
+
+def write_tombstones(dead_rows: np.ndarray, art_dir: str):
+	np.save(os.path.join(art_dir, TOMBSTONES_FILE), np.asarray(dead_rows, dtype=np.int64))
+
+def load_tombstones(art_dir: str) -> np.ndarray:
+	path = os.path.join(art_dir, TOMBSTONES_FILE)
+	if not os.path.exists(path):
+		return np.zeros(0, dtype=np.int64)
+	return np.load(path)
+
+def doc_summary(manifest: Dict) -> Dict[str, Dict]:
+	# shape of the historical meta.json "docs" field
+	return {d["doc_id"]: {"source_path": p, "n_pages": d["n_pages"]}
+			for p, d in manifest["docs"].items()}
@@ -0,0 +1,206 @@
+import os, orjson
+import numpy as np
+from bisect import bisect_left
+from typing import Any, List, Dict, Optional, Tuple, Iterable, Iterator
+from backend.rag.filters import RowSet, ranges_to_indices
+
+COLS_FILE = "meta_cols.npy"     # one fixed-width record per row
+DOCS_FILE = "meta_docs.json"    # [[doc_id, source_path], ...], indexed by the doc column
+IDS_FILE = "meta_ids.json"      # {row: chunk_id} for ids that can't be derived
+RANGES_FILE = "meta_doc_ranges.npy"  # (doc, start, end) row runs, sorted by doc: doc -> rows
+LEGACY_FILE = "meta_rows.jsonl"
+
+# start / end: the chunk's char span in its cleaned page text (-1 when not recorded)
+META_DTYPE = np.dtype([("doc", "<i4"), ("page", "<i4"), ("n_tokens", "<i4"), ("chunk_no", "<i4"),
+					   ("start", "<i4"), ("end", "<i4")])
+
+def _chunk_no(chunk_id: str, doc_id: str, page: int) -> int:
+	"""n when chunk_id is ingest's "{doc_id}:{page}:{n}", else -1 (stored verbatim)."""
+	prefix = f"{doc_id}:{page}:"
+	if chunk_id.startswith(prefix):
+		n = chunk_id[len(prefix):]
+		if n.isdigit() and str(int(n)) == n:
+			return int(n)
+	return -1
+
+def _encode(metas: Iterable[Dict], docs: List[List[str]], first_row: int = 0) -> Tuple[np.ndarray, Dict[int, str]]:
+	"""Meta dicts -> records; `docs` is extended in place with documents not seen yet."""
+	doc_idx = {tuple(d): i for i, d in enumerate(docs)}
+	recs, ids = [], {}
+	for row, m in enumerate(metas, start=first_row):
+		key = (m["doc_id"], m["source_path"])
+		d = doc_idx.get(key)
+		if d is None:
+			d = doc_idx[key] = len(docs)
+			docs.append(list(key))
+		n = _chunk_no(m["chunk_id"], m["doc_id"], m["page"])
+		if n < 0:
+			ids[row] = m["chunk_id"]
+		recs.append((d, m["page"], m.get("n_tokens") or 0, n, m.get("start_char", -1), m.get("end_char", -1)))
+	return np.asarray(recs, dtype=META_DTYPE).reshape(-1), ids
+
+def _upgrade(cols: np.ndarray) -> np.ndarray:
+	"""Records of a store written before spans were kept, as META_DTYPE (spans unknown)."""
+	if cols.dtype == META_DTYPE:
+		return cols
+	out = np.full(len(cols), -1, dtype=META_DTYPE)
+	for name in cols.dtype.names:
+		out[name] = cols[name]
+	return out
+
+def doc_ranges(doc_col: np.ndarray) -> np.ndarray:
+	"""(doc, start, end) for every run of consecutive rows of one doc, sorted by (doc, start)."""
+	n = len(doc_col)
+	if not n:
+		return np.zeros((0, 3), dtype=np.int64)
+	doc_col = np.asarray(doc_col, dtype=np.int64)
+	starts = np.flatnonzero(np.r_[True, doc_col[1:] != doc_col[:-1]])
+	ends = np.r_[starts[1:], n]
+	runs = np.stack([doc_col[starts], starts, ends], axis=1)
+	return runs[np.lexsort((runs[:, 1], runs[:, 0]))]
+
+def _save(out_dir: str, cols: np.ndarray, docs: List[List[str]], ids: Dict[int, str]):
+	# write-then-rename: a Retriever may have the previous file mapped
+	for name, write in ((DOCS_FILE, lambda f: f.write(orjson.dumps(docs))),
+						(IDS_FILE, lambda f: f.write(orjson.dumps({str(k): v for k, v in ids.items()}))),
+						(RANGES_FILE, lambda f: np.save(f, doc_ranges(cols["doc"]))),
+						(COLS_FILE, lambda f: np.save(f, cols))):
+		path = os.path.join(out_dir, name)
+		with open(path + ".tmp", "wb") as f:
+			write(f)
+		os.replace(path + ".tmp", path)
+
+def write_meta_store(metas: List[Dict], out_dir: str) -> int:
+	"""
+	Columnar row metadata: doc_id / source_path are interned into a doc table, and
+	per-row doc index, page, token count and chunk number are int32 columns.
+	"""
+	os.makedirs(out_dir, exist_ok=True)
+	docs: List[List[str]] = []
+	cols, ids = _encode(metas, docs)
+	_save(out_dir, cols, docs, ids)
+	legacy = os.path.join(out_dir, LEGACY_FILE)
+	if os.path.exists(legacy):
+		os.remove(legacy)
+	return len(cols)
+
+def append_meta_store(metas: List[Dict], out_dir: str) -> int:
+	"""Append rows to an existing store (or a legacy meta_rows.jsonl); returns the new row count."""
+	old = MetaStore(out_dir)
+	docs = [list(d) for d in old.docs]
+	cols, ids = _encode(metas, docs, first_row=len(old))
+	cols = np.concatenate([_upgrade(np.asarray(old.cols)), cols])
+	ids = {**old.ids, **ids}
+	del old
+	_save(out_dir, cols, docs, ids)
+	legacy = os.path.join(out_dir, LEGACY_FILE)
+	if os.path.exists(legacy):
+		os.remove(legacy)
+	return len(cols)
+
+class MetaStore:
+	"""
+	Read-only row metadata over the memory-mapped columns; no per-row Python objects.
+	"""
+	def __init__(self, art_dir: str):
+		self.art_dir = art_dir
+		if os.path.exists(os.path.join(art_dir, COLS_FILE)):
+			self.cols = np.load(os.path.join(art_dir, COLS_FILE), mmap_mode="r")
+			with open(os.path.join(art_dir, DOCS_FILE), "rb") as f:
+				self.docs: List[Tuple[str, str]] = [tuple(d) for d in orjson.loads(f.read())]
+			with open(os.path.join(art_dir, IDS_FILE), "rb") as f:
+				self.ids: Dict[int, str] = {int(k): v for k, v in orjson.loads(f.read()).items()}
+		else:
+			# artifacts built before the columnar store: convert in memory
+			with open(os.path.join(art_dir, LEGACY_FILE), "rb") as f:
+				docs: List[List[str]] = []
+				self.cols, self.ids = _encode((orjson.loads(line) for line in f if line.strip()), docs)
+			self.docs = [tuple(d) for d in docs]
+		path = os.path.join(art_dir, RANGES_FILE)
+		# stores written before filters don't have the range index; derive it once
+		self.ranges = np.load(path) if os.path.exists(path) else doc_ranges(self.cols["doc"])
+		self._by_id: Optional[Dict[str, List[int]]] = None
+		self._by_source: Optional[Tuple[List[str], List[int]]] = None
+
+	def __len__(self) -> int:
+		return len(self.cols)
+
+	def fields(self, rows: Iterable[int]) -> Iterator[Tuple[str, str, int, str, Optional[int], Optional[int]]]:
+		"""
+		(chunk_id, doc_id, page, source_path, start_char, end_char) per row, gathered with
+		one fancy-index read; the span is None for stores written before spans were kept.
+		"""
+		rows = np.fromiter(rows, dtype=np.int64)
+		for row, (d, page, _, n, *span) in zip(rows.tolist(), self.cols[rows].tolist()):
+			doc_id, source_path = self.docs[d]
+			start, end = span if span and span[0] >= 0 else (None, None)
+			yield (f"{doc_id}:{page}:{n}" if n >= 0 else self.ids[row]), doc_id, page, source_path, start, end
+
+	def n_tokens(self, rows: Iterable[int]) -> np.ndarray:
+		return np.asarray(self.cols["n_tokens"][np.fromiter(rows, dtype=np.int64)])
+
+	def _docs_matching(self, doc_ids: Optional[List[str]], prefix: Optional[str]) -> List[int]:
+		"""Doc-table indices by id (hash lookup) and/or source prefix (bisect over sorted paths)."""
+		if self._by_id is None:
+			by_id: Dict[str, List[int]] = {}
+			for i, (doc_id, _) in enumerate(self.docs):
+				by_id.setdefault(doc_id, []).append(i)
+			order = sorted(range(len(self.docs)), key=lambda i: self.docs[i][1])
+			self._by_source = ([self.docs[i][1] for i in order], order)
+			self._by_id = by_id
+		found = None
+		if doc_ids is not None:
+			found = {i for d in doc_ids for i in self._by_id.get(d, ())}
+		if prefix is not None:
+			paths, order = self._by_source
+			lo = bisect_left(paths, prefix)
+			hi = lo
+			while hi < len(paths) and paths[hi].startswith(prefix):
+				hi += 1
+			by_prefix = set(order[lo:hi])
+			found = by_prefix if found is None else found & by_prefix
+		return sorted(found)
+
+	def select(self, filters: Dict[str, Any], dead: Optional[np.ndarray] = None) -> RowSet:
+		"""
+		Rows matching a normalized filter (see filters.py), minus `dead`. Docs come from
+		the doc -> row-range index, so only their runs are materialized; the page
+		column is read for those rows alone.
+		"""
+		if "doc_ids" in filters or "source_prefix" in filters:
+			docs = np.asarray(self._docs_matching(filters.get("doc_ids"), filters.get("source_prefix")), dtype=np.int64)
+			lo = np.searchsorted(self.ranges[:, 0], docs, side="left")
+			hi = np.searchsorted(self.ranges[:, 0], docs, side="right")
+			runs = self.ranges[ranges_to_indices(lo, hi - lo)]
+			rows = np.sort(ranges_to_indices(runs[:, 1], runs[:, 2] - runs[:, 1]))
+		else:
+			rows = np.arange(len(self), dtype=np.int64)
+		if "page_min" in filters or "page_max" in filters:
+			pages = np.asarray(self.cols["page"][rows])
+			keep = np.ones(len(rows), dtype=bool)
+			if "page_min" in filters:
+				keep &= pages >= filters["page_min"]
+			if "page_max" in filters:
+				keep &= pages <= filters["page_max"]
+			rows = rows[keep]
+		if dead is not None and len(dead):
+			rows = rows[~np.isin(rows, dead)]
+		return RowSet(rows)
+
+_OPEN: Dict[Tuple[str, int], MetaStore] = {}
+
+def open_meta_store(art_dir: str) -> MetaStore:
+	"""Process-wide handle per artifact dir, so callers share one mapping."""
+	path = os.path.join(art_dir, COLS_FILE)
+	if not os.path.exists(path):
+		path = os.path.join(art_dir, LEGACY_FILE)
+	key = (os.path.abspath(art_dir), os.stat(path).st_mtime_ns)
+	if key not in _OPEN:
+		_OPEN[key] = MetaStore(art_dir)
+	return _OPEN[key]
+
+def release_meta_store(art_dir: str):
+	"""Drop the shared handles for `art_dir` (the mapping goes with the last reference)."""
+	path = os.path.abspath(art_dir)
+	for key in [k for k in _OPEN if k[0] == path]:
+		del _OPEN[key]
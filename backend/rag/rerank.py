@@ -1,5 +1,5 @@
 from typing import List, Dict, Tuple
-from sentence_transformers import CrossEncoder
+from backend.obs.tracing import span
 
 class Reranker:
 	"""
@@ -8,11 +8,16 @@ class Reranker:
 	"""
 
 	def __init__(self, model_name: str = "BAAI/bge-reranker-base", max_length: int = 512):
+		from sentence_transformers import CrossEncoder
 		self.model = CrossEncoder(model_name, max_length=max_length)
 
 	def score_pairs(self, query: str, texts: List[str], batch_size: int = 32) -> List[float]:
-		pairs = [(query, t) for t in texts]
-		scores = self.model.predict(pairs, batch_size=batch_size).tolist()
+		return self.score_pair_list([(query, t) for t in texts], batch_size=batch_size)
+
+	def score_pair_list(self, pairs: List[Tuple[str, str]], batch_size: int = 32) -> List[float]:
+		"""Score (query, text) pairs that may span several queries, in shared batches."""
+		with span("cross_encoder", n_pairs=len(pairs), batch_size=batch_size):
+			scores = self.model.predict(pairs, batch_size=batch_size).tolist()
 		return [float(s) for s in scores]
 
 	def rerank(self, query: str, items: List[Dict], text_key: str = "text",
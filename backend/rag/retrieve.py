@@ -1,50 +1,187 @@
-import os, pickle, orjson, numpy as np, faiss, time
-from typing import List, Dict, Tuple, Optional
-from rank_bm25 import BM25Okapi
-from sentence_transformers import SentenceTransformer
-from backend.rag.rerank import Reranker
+import os, numpy as np, faiss, time, hashlib, orjson
+from typing import List, Dict, Tuple, Optional, TYPE_CHECKING
+from backend.models.registry import get_embedder, get_reranker, embed_batcher, rerank_batcher
+from backend.utils.config import EMB_MODEL, RERANK_MODEL
+from backend.rag.chunk_store import open_chunk_store, release_chunk_store
+from backend.rag.meta_store import open_meta_store, release_meta_store
+from backend.rag.generations import GENERATION_FILE, resolve
+from backend.rag.bm25_index import BM25Index, tokenize
+from backend.rag.manifest import load_tombstones
+from backend.rag.dense_index import (EMB_FILE, load_dense_config, search_params, read_index, rescore_factor,
+									 dense_search, dense_search_rows, StoredEmbeddings)
+from backend.rag.filters import RowSet, normalize_filters
+from backend.utils.cache import TTLCache
+from backend.models.batching import MicroBatcher
+from backend.obs.tracing import span
+
+if TYPE_CHECKING:
+	from backend.rag.rerank import Reranker
 
 ART = "artifacts"
 
+# Normalized query embeddings, shared by every Retriever in the process.
+# Keyed on (model name, whitespace-normalized query); 0 disables size/TTL limits respectively.
+QUERY_EMB_CACHE = TTLCache(maxsize=int(os.getenv("EMB_CACHE_SIZE", "4096")),
+						   ttl=float(os.getenv("EMB_CACHE_TTL_S", "3600")))
+
+def normalize_query(query: str) -> str:
+	# whitespace only: case can matter to cased embedding models
+	return " ".join(query.split())
+
+# Artifacts every index build/update/compaction rewrites
+VERSION_FILES = ("faiss.index", "shards.json", "meta_count.json", "meta_cols.npy", "bm25_meta.json", "chunk_offsets.npy", "tombstones.npy")
+
+def index_version(art_dir: str = ART) -> str:
+	"""
+	Name of a published generation (see generations.py); otherwise a short fingerprint
+	of the artifact set (sizes + mtimes), which changes whenever the index is rebuilt.
+	"""
+	gen = os.path.join(art_dir, GENERATION_FILE)
+	if os.path.exists(gen):
+		with open(gen, "rb") as f:
+			return orjson.loads(f.read())["version"]
+	h = hashlib.sha1()
+	for name in VERSION_FILES:
+		path = os.path.join(art_dir, name)
+		if os.path.exists(path):
+			st = os.stat(path)
+			h.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+	return h.hexdigest()[:12]
+
 class Retriever:
-	def __init__(self, art_dir: str = ART, emb_model="BAAI/bge-small-en-v1.5"):
-		self.art_dir = art_dir
-		# Load meta rows
-		self.metas: List[Dict] = []
-		with open(os.path.join(art_dir, "meta_rows.jsonl"), "rb") as f:
-			for line in f:
-				self.metas.append(orjson.loads(line))
-		# Dense
-		self.emb_model = SentenceTransformer(emb_model)
-		self.index = faiss.read_index(os.path.join(art_dir, "faiss.index"))
-		# BM25 (re-create from tokens for portability)
-		with open(os.path.join(art_dir, "bm25_tokens.pkl"), "rb") as f:
-			self.bm25_tokens = pickle.load(f)
-		self.bm25 = BM25Okapi(self.bm25_tokens)
-		self._reranker: Optional[Reranker] = None
-
-	def _ensure_reranker(self):
-		if self._reranker is None:
-			# self._reranker = Reranker("BAAI/bge-reranker-base")
-			self._reranker = Reranker("cross-encoder/ms-marco-MiniLM-L-6-v2")
+	def __init__(self, art_dir: str = ART, emb_model: str = EMB_MODEL, rerank_model: str = RERANK_MODEL):
+		self._init_models(art_dir, emb_model, rerank_model)
+		art_dir = self.art_dir
+		# Row metadata (memory-mapped columns + interned doc table)
+		self.meta = open_meta_store(art_dir)
+		# Index type, quantization and nprobe/efSearch as recorded by index_build
+		self.dense_cfg = load_dense_config(art_dir)
+		self.index = read_index(art_dir, self.dense_cfg)
+		# lossy (quantized / PQ) indexes: shortlist k*rescore rows, re-rank them exactly
+		# against the memory-mapped stored vectors (only the shortlisted rows are read)
+		self._rescore = rescore_factor(self.dense_cfg)
+		# (also what filtered searches over few rows score against)
+		self._stored = StoredEmbeddings(art_dir) if self._rescore or os.path.exists(os.path.join(art_dir, EMB_FILE)) else None
+		# Rows of removed/changed docs stay in the index until compaction; mask them out
+		self._dead = load_tombstones(art_dir)
+		self._dead_sel = None
+		if len(self._dead):
+			self._dead_ids = faiss.IDSelectorBatch(self._dead)  # keep a ref; the Not wrapper doesn't own it
+			self._dead_sel = faiss.IDSelectorNot(self._dead_ids)
+		self._search_params = search_params(self.dense_cfg, self._dead_sel)
+		# BM25 (memory-mapped inverted index)
+		self.bm25 = BM25Index(art_dir)
+		# Chunk texts (packed blob + offsets, memory-mapped once)
+		self.chunks = open_chunk_store(art_dir)
+
+	def _init_models(self, art_dir: str, emb_model: str, rerank_model: str):
+		"""Fields every retriever has, wherever its indexes live (see shards.ShardedRetriever)."""
+		self.art_dir = resolve(art_dir)[1]  # the published generation, if art_dir has them
+		self.index_version = index_version(self.art_dir)
+		self.emb_model_name = emb_model
+		self.emb_model = get_embedder(emb_model)  # shared, pre-warmed
+		self._encode = embed_batcher(emb_model)   # online queries share forward passes across threads
+		self.rerank_model = rerank_model
+
+	def close(self):
+		"""Unmap this index; only once no search is using it (see warmup.Warmup.lease)."""
+		release_chunk_store(self.art_dir)
+		release_meta_store(self.art_dir)
+		self.index = self._stored = self.bm25 = self.chunks = self.meta = None
+
+	@property
+	def reranker(self) -> "Reranker":
+		# loaded on first rerank, then shared process-wide through the registry
+		return get_reranker(self.rerank_model)
+
+	def _score_pairs(self, pairs: List[Tuple[str, str]], batch_size: int = 32) -> List[float]:
+		# with micro-batching on, pairs from concurrent requests are scored together
+		# and the scheduler's max batch size applies instead of `batch_size`
+		scorer = rerank_batcher(self.rerank_model)
+		if isinstance(scorer, MicroBatcher):
+			return scorer(pairs)
+		return self.reranker.score_pair_list(pairs, batch_size=batch_size)
 
 	def _get_text_by_row(self, row_idx: int) -> str:
-		with open(os.path.join(self.art_dir, "chunks.jsonl"), "rb") as f:
-			for i, l in enumerate(f):
-				if i == row_idx:
-					return orjson.loads(l)["text"]
-		return ""
-
-	def dense_search(self, query: str, k=20) -> List[Tuple[int, float]]:
-		q = self.emb_model.encode([query], normalize_embeddings=True)
-		D, I = self.index.search(np.asarray(q, dtype="float32"), k)
-		return [(int(i), float(s)) for i, s in zip(I[0], D[0]) if i != -1]
-
-	def bm25_search(self, query: str, k=20) -> List[Tuple[int, float]]:
-		scores = self.bm25.get_scores(query.split())
-		idx = np.argpartition(-scores, min(k, len(scores)-1))[:k]
-		idx = idx[np.argsort(-scores[idx])]
-		return [(int(i), float(scores[i])) for i in idx]
+		return self.chunks.text(row_idx)
+
+	def embed_query(self, query: str) -> Tuple[np.ndarray, bool]:
+		"""(1, dim) normalized embedding and whether it came from the cache."""
+		q, n_hits = self.embed_queries([query])
+		return q, bool(n_hits)
+
+	def embed_queries(self, queries: List[str]) -> Tuple[np.ndarray, int]:
+		"""
+		(n, dim) normalized embeddings and the number served from the cache.
+		Cache misses are encoded together in one batch.
+		"""
+		with span("embed", n=len(queries)) as sp:
+			q, n_hits = self._embed_queries(queries)
+			sp.set(cache_hits=n_hits)
+		return q, n_hits
+
+	def _embed_queries(self, queries: List[str]) -> Tuple[np.ndarray, int]:
+		keys = [(self.emb_model_name, normalize_query(q)) for q in queries]
+		vecs: Dict[Tuple[str, str], np.ndarray] = {}
+		for key in dict.fromkeys(keys):
+			v = QUERY_EMB_CACHE.get(key)
+			if v is not None:
+				vecs[key] = v
+		n_hits = sum(1 for key in keys if key in vecs)
+		missing = list(dict.fromkeys(key for key in keys if key not in vecs))
+		if missing:
+			enc = np.asarray(self._encode([key[1] for key in missing]), dtype="float32")
+			for key, v in zip(missing, enc):
+				v = v.reshape(1, -1)
+				v.setflags(write=False)
+				QUERY_EMB_CACHE.put(key, v)
+				vecs[key] = v
+		return np.concatenate([vecs[key] for key in keys]), n_hits
+
+	def select(self, filters: Optional[Dict]) -> Optional[RowSet]:
+		"""
+		Rows a filtered search may return (see filters.py), resolved once per search and
+		passed to the dense / BM25 searches as `rows`; None when unfiltered.
+		"""
+		filters = normalize_filters(filters)
+		if filters is None:
+			return None
+		with span("filter") as sp:
+			rows = self.meta.select(filters, self._dead)
+			sp.set(n_rows=len(rows))
+		return rows
+
+	def dense_search(self, query: str, k=20, qvec: Optional[np.ndarray] = None, rows=None) -> List[Tuple[int, float]]:
+		q = self.embed_query(query)[0] if qvec is None else qvec
+		return self.dense_search_many(q, k, rows)[0]
+
+	def dense_search_many(self, qmat: np.ndarray, k=20, rows: Optional[RowSet] = None) -> List[List[Tuple[int, float]]]:
+		"""One FAISS search over the (n, dim) query matrix; with `rows`, only over those rows."""
+		with span("dense_search", index=self.dense_cfg["type"], quant=self.dense_cfg["quant"], k=k,
+				  filter_rows=None if rows is None else len(rows)):
+			if rows is None:
+				D, I = dense_search(self.index, qmat, k, self.dense_cfg, self._search_params, self._stored, self._rescore)
+			else:
+				D, I = dense_search_rows(self.index, qmat, k, self.dense_cfg, rows, self._stored, self._rescore)
+		return [[(int(i), float(s)) for i, s in zip(row_i, row_d) if i != -1] for row_i, row_d in zip(I, D)]
+
+	@staticmethod
+	def _cache_timings(n_hits: int) -> Dict[str, int]:
+		st = QUERY_EMB_CACHE.stats()
+		return {"emb_cache_hit": int(n_hits), "emb_cache_hits": st["hits"], "emb_cache_misses": st["misses"]}
+
+	def bm25_search(self, query: str, k=20, rows=None) -> List[Tuple[int, float]]:
+		# only docs sharing a term with the query are scored; zero-score docs are not returned
+		with span("bm25"):
+			return self.bm25_search_many([tokenize(query)], k, rows)[0]
+
+	def bm25_search_many(self, token_lists: List[List[str]], k=20, rows: Optional[RowSet] = None) -> List[List[Tuple[int, float]]]:
+		return self.bm25.top_k_many(token_lists, k, rows)
+
+	def _rows_info(self, rows: List[int], include_text: bool = True) -> List[Optional[Tuple]]:
+		"""(chunk_id, doc_id, page, source_path, start_char, end_char, text or None) per row; None if unavailable."""
+		return [(*f, self.chunks.text(r) if include_text else None)
+				for r, f in zip(rows, self.meta.fields(rows))]
 
 	@staticmethod
 	def rrf_fuse(d_hits: List[Tuple[int, float]], b_hits: [List[float]], k=10, k_rrf=60):
@@ -58,74 +195,91 @@ class Retriever:
 		return fused # list of (row_idx, fused_score)
 
 	def hybrid(self, query: str, k_dense=20, k_bm25=20, k_final=8,
-				rerank: bool = False, top_m: int = 50) -> List[Dict]:
-		d = self.dense_search(query, k_dense)
-		b = self.bm25_search(query, k_bm25)
+				rerank: bool = False, top_m: int = 50, filters: Optional[Dict] = None,
+				timings: Optional[Dict] = None) -> List[Dict]:
+		"""`timings`, if given, receives the stage timings in search_many()'s keys."""
+		t = {} if timings is None else timings
+		s0 = time.time()
+		rows = self.select(filters)
+		if isinstance(rows, RowSet):
+			t["filter_rows"] = len(rows)
+			t["t_filter_ms"] = int((time.time() - s0)*1000)
+		s0 = time.time()
+		d = self.dense_search(query, k_dense, rows=rows)
+		t["t_dense_ms"] = int((time.time() - s0)*1000)
+		s0 = time.time()
+		b = self.bm25_search(query, k_bm25, rows)
+		t["t_bm25_ms"] = int((time.time() - s0)*1000)
+		s0 = time.time()
 		fused = self.rrf_fuse(d, b, k=max(k_final, top_m))
+		t["t_rrf_ms"] = int((time.time() - s0)*1000)
+		t["t_rerank_ms"] = 0
 
 		candidates: List[Dict] = []
-		for row_idx, fscore in fused:
-			m = self.metas[row_idx]
+		info = self._rows_info([row_idx for row_idx, _ in fused])
+		for (row_idx, fscore), row_info in zip(fused, info):
+			if row_info is None:
+				continue  # its shard did not answer in time
+			chunk_id, doc_id, page, source_path, start, end, text = row_info
 			candidates.append({
 				"row": row_idx,
 				"fused_score": round(float(fscore), 6),
-				"chunk_id": m["chunk_id"],
-				"doc_id": m["doc_id"],
-				"page": m["page"],
-				"source_path": m["source_path"],
-				"text": self._get_text_by_row(row_idx)
+				"chunk_id": chunk_id,
+				"doc_id": doc_id,
+				"page": page,
+				"source_path": source_path,
+				"start_char": start,
+				"end_char": end,
+				"text": text
 			})
 		
 		if not rerank:
 			# Trim to k_final and attach a short snippet for readability
 			out = candidates[:k_final]
 			for it in out:
-				t = it["text"].replace("\n", " ").strip()
-				it["snippet"] = (t[:240] + "...") if len(t) > 240 else t
+				txt = it["text"].replace("\n", " ").strip()
+				it["snippet"] = (txt[:240] + "...") if len(txt) > 240 else txt
 			return out
 
-		self._ensure_reranker()
 		top_pool = candidates[:top_m]
-		reranked = self._reranker.rerank(query, top_pool, text_key="text", top_n=k_final)
+		s0 = time.time()
+		with span("rerank", n_pairs=len(top_pool)):
+			scores = self._score_pairs([(query, it["text"]) for it in top_pool]) if top_pool else []
+		t["t_rerank_ms"] = int((time.time() - s0)*1000)
+		for it, s in zip(top_pool, scores):
+			it["rerank_score"] = round(float(s), 6)
+		reranked = sorted(top_pool, key=lambda x: -x["rerank_score"])[:k_final]
 
 		for it in reranked:
-			t = it["text"].replace("\n", " ").strip()
-			it["snippet"] = (t[:240] + "...") if len(t) > 240 else t
+			txt = it["text"].replace("\n", " ").strip()
+			it["snippet"] = (txt[:240] + "...") if len(txt) > 240 else txt
 		return reranked
 
 	def _short_snippet(self, row_idx: int, n=240) -> str:
-		with open(os.path.join(self.art_dir, "meta_count.json"), "rb") as f:
-			pass
-
-		line = None
-		with open(os.path.join(self.art_dir, "chunks.jsonl"), "rb") as f:
-			for i, l in enumerate(f):
-				if i == row_idx:
-					line = l; break
-		if line is None: return ""
-		rec = orjson.loads(line)
-		t = rec["text"].replace("\n", " ").strip()
+		t = self._get_text_by_row(row_idx).replace("\n", " ").strip()
 		return (t[:n] + "...") if len(t) > n else t
 
 	def _materialize_items(self, pairs, include_text: bool = True) -> List[Dict]:
 		out = []
-		for row_idx, fscore in pairs:
-			m = self.metas[row_idx]
+		info = self._rows_info([row_idx for row_idx, _ in pairs], include_text)
+		for (row_idx, fscore), row_info in zip(pairs, info):
+			if row_info is None:
+				continue  # its shard did not answer in time
+			chunk_id, doc_id, page, source_path, start, end, text = row_info
 			item = {
 				"row": row_idx,
 				"score": float(fscore),
-				"chunk_id": m["chunk_id"],
-				"doc_id": m["doc_id"],
-				"page": m["page"],
-				"source_path": m["source_path"],
+				"chunk_id": chunk_id,
+				"doc_id": doc_id,
+				"page": page,
+				"source_path": source_path,
+				# char span in the page text; lets the context packer merge overlapping chunks
+				"start_char": start,
+				"end_char": end,
 			}
 			if include_text:
 				# full text for downstream (LLM or reranker)
-				with open(os.path.join(self.art_dir, "chunks.jsonl"), "rb") as f:
-					for i, l in enumerate(f):
-						if i == row_idx:
-							item["text"] = orjson.loads(l)["text"]
-							break
+				item["text"] = text
 			t = item.get("text", "")
 			t = t.replace("\n", " ").strip()
 			item["snippet"] = (t[:240] + "...") if len(t) > 240 else t
@@ -135,82 +289,111 @@ class Retriever:
 
 	def search(self, query: str, mode: str = "hybrid",
 				k: int = 8, k_dense: int = 20, k_bm25: int = 20,
-				rerank: bool = False, top_m: int = 50):
+				rerank: bool = False, top_m: int = 50, filters: Optional[Dict] = None):
 		"""
 		mode: 'bm25' | 'dense' | 'hybrid' | 'hybrid_rerank'
+		filters: doc_ids / source_prefix / page_min / page_max (see filters.py)
 		Returns a list of hit dicts aligned with existing /search.
 		"""
-		t0 = time.time()
+		hits, timings = self.search_many([query], mode=mode, k=k, k_dense=k_dense, k_bm25=k_bm25,
+										  rerank=rerank, top_m=top_m, filters=filters)
+		return hits[0], timings
+
+	def search_many(self, queries: List[str], mode: str = "hybrid",
+					k: int = 8, k_dense: int = 20, k_bm25: int = 20,
+					rerank: bool = False, top_m: int = 50, rerank_batch_size: int = 32,
+					filters: Optional[Dict] = None):
+		"""
+		Batched search: one embedding batch, one FAISS search over the query matrix,
+		BM25 postings read once per distinct term, and all (query, chunk) rerank pairs
+		scored in shared batches. Returns (hits per query, stage timings for the batch);
+		each hit list matches search() for that query. `filters` applies to every query.
+		"""
+		with span("search", mode=mode, n_queries=len(queries)):
+			s0 = time.time()
+			rows = self.select(filters)
+			t_filter = time.time() - s0
+			hits, timings = self._search_many(queries, mode, k, k_dense, k_bm25, rerank, top_m, rerank_batch_size, rows)
+		if isinstance(rows, RowSet):
+			timings["filter_rows"] = len(rows)
+			timings["t_filter_ms"] = int(t_filter*1000)
+		return hits, timings
+
+	def _search_many(self, queries, mode, k, k_dense, k_bm25, rerank, top_m, rerank_batch_size, rows=None):
 		t_dense = t_bm25 = t_rrf = t_rerank = 0
+		n_hits = 0
 		mode = mode.lower()
 		if mode == "bm25":
 			s0 = time.time()
-			b = self.bm25_search(query, max(k_bm25, k))
+			with span("bm25"):
+				bs = self.bm25_search_many([tokenize(q) for q in queries], max(k_bm25, k), rows)
 			t_bm25 = time.time() - s0
-			hits = self._materialize_items(b[:k])
+			with span("materialize"):
+				hits = [self._materialize_items(b[:k]) for b in bs]
 			timings = {
 				"t_bm25_ms": int(t_bm25*1000),
 				"t_dense_ms": 0,
 				"t_rrf_ms": 0,
-				"t_rerank_ms": 0
+				"t_rerank_ms": 0,
+				**self._cache_timings(0),
 			}
 			return hits, timings
 
 		if mode == "dense":
 			s0 = time.time()
-			d = self.dense_search(query, max(k_dense, k))
+			qmat, n_hits = self.embed_queries(queries)
+			ds = self.dense_search_many(qmat, max(k_dense, k), rows)
 			t_dense = time.time() - s0
-			hits = self._materialize_items(d[:k])
+			with span("materialize"):
+				hits = [self._materialize_items(d[:k]) for d in ds]
 			timings = {
 				"t_bm25_ms": 0,
 				"t_dense_ms": int(t_dense*1000),
 				"t_rrf_ms": 0,
-				"t_rerank_ms": 0
+				"t_rerank_ms": 0,
+				**self._cache_timings(n_hits),
 			}
 			return hits, timings
 
 		# hybrid family
-		s0 = time.time(); d = self.dense_search(query, k_dense); t_dense = time.time() - s0
-		s0 = time.time(); b = self.bm25_search(query, k_bm25); t_bm25 = time.time() - s0
-		s0 = time.time(); fused = self.rrf_fuse(d, b, k=max(k, top_m)); t_rrf = time.time() - s0
-		candidates = self._materialize_items(fused)
+		s0 = time.time()
+		qmat, n_hits = self.embed_queries(queries)
+		ds = self.dense_search_many(qmat, k_dense, rows)
+		t_dense = time.time() - s0
+		s0 = time.time()
+		with span("bm25"):
+			bs = self.bm25_search_many([tokenize(q) for q in queries], k_bm25, rows)
+		t_bm25 = time.time() - s0
+		s0 = time.time()
+		with span("rrf"):
+			fused = [self.rrf_fuse(d, b, k=max(k, top_m)) for d, b in zip(ds, bs)]
+		t_rrf = time.time() - s0
+		with span("materialize"):
+			candidates = [self._materialize_items(f) for f in fused]
 
 		if mode in ("hybrid_rerank",) or rerank:
-			rr = Reranker("BAAI/bge-reranker-base")
-			pool = candidates[:top_m]
-			texts = [it["text"] for it in pool]
+			pools = [c[:top_m] for c in candidates]
+			pairs = [(q, it["text"]) for q, pool in zip(queries, pools) for it in pool]
 			s0 = time.time()
-			scores = rr.score_pairs(query, texts, batch_size=32)
+			with span("rerank", n_pairs=len(pairs)):
+				scores = self._score_pairs(pairs, rerank_batch_size) if pairs else []
 			t_rerank = time.time() - s0
-			for it, s in zip(pool, scores):
-				it["rerank_score"] = float(s)
-			pool.sort(key=lambda x: -x["rerank_score"])
-			hits = pool[:k]
+			hits, pos = [], 0
+			for pool in pools:
+				for it, s in zip(pool, scores[pos:pos + len(pool)]):
+					it["rerank_score"] = float(s)
+				pos += len(pool)
+				pool.sort(key=lambda x: -x["rerank_score"])
+				hits.append(pool[:k])
 		else:
-			hits = candidates[:k]
+			# plain hybrid (RRF only)
+			hits = [c[:k] for c in candidates]
 
 		timings = {
 			"t_bm25_ms": int(t_bm25*1000),
 			"t_dense_ms": int(t_dense*1000),
 			"t_rrf_ms": int(t_rrf*1000),
 			"t_rerank_ms": int(t_rerank*1000),
+			**self._cache_timings(n_hits),
 		}
-		# plain hybrid (RRF only)
 		return hits, timings
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
@@ -0,0 +1,356 @@
+"""
+Sharded retrieval. `index_build.py --shards N` splits the live corpus by document
+into N artifact dirs (shard_000, ...), each a complete dense + BM25 + meta + text
+index over its rows. BM25 weights use corpus-wide idf / avgdl, so shard scores equal
+those of one index over everything.
+
+ShardedRetriever embeds the query once, fans dense and BM25 searches out to the
+shards, merges their top-k by score, and then fuses, reranks and materializes like
+Retriever. Shards are served in-process (SHARD_MODE=local), by one worker process
+each (SHARD_MODE=process) or over HTTP (SHARD_URLS, one `serve` per shard). A shard
+that misses SHARD_TIMEOUT_S is left out and the result is marked partial.
+"""
+import os, time, heapq, argparse, orjson
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from contextvars import ContextVar
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.utils.config import EMB_MODEL, RERANK_MODEL
+from backend.rag.retrieve import Retriever, ART
+from backend.rag.dense_index import (EMB_FILE, load_dense_config, read_index, rescore_factor, search_params,
+									 dense_search, dense_search_rows, StoredEmbeddings)
+from backend.rag.filters import normalize_filters
+from backend.rag.bm25_index import BM25Index
+from backend.rag.meta_store import open_meta_store, release_meta_store
+from backend.rag.chunk_store import open_chunk_store, release_chunk_store
+from backend.rag.generations import resolve
+from backend.obs.logger import log_event
+from backend.obs.tracing import span
+
+SHARDS_FILE = "shards.json"
+RANGES_FILE = "shard_ranges.npy"  # (start, end, shard) runs of global rows
+ROWS_FILE = "shard_rows.npy"      # per shard: global row of each local row (ascending)
+
+SHARD_MODE = os.getenv("SHARD_MODE", "local")  # local | process
+SHARD_URLS = [u.strip() for u in os.getenv("SHARD_URLS", "").split(",") if u.strip()]
+SHARD_TIMEOUT_S = float(os.getenv("SHARD_TIMEOUT_S", "2"))
+
+def is_sharded(art_dir: str) -> bool:
+	return os.path.exists(os.path.join(art_dir, SHARDS_FILE))
+
+def shard_dir(art_dir: str, i: int) -> str:
+	return os.path.join(art_dir, f"shard_{i:03d}")
+
+# ------------------------------
+# Build side
+# ------------------------------
+def assign_shards(metas: List[Dict], live: np.ndarray, n_shards: int) -> List[np.ndarray]:
+	"""
+	Live rows per shard (ascending). Whole documents go to the least-loaded shard,
+	largest first, so shards stay within one document of each other in size. There
+	are never more shards than documents: an empty shard would have no index to train.
+	"""
+	docs: Dict[Tuple[str, str], List[int]] = {}
+	for row, m in enumerate(metas):
+		if live[row]:
+			docs.setdefault((m["doc_id"], m["source_path"]), []).append(row)
+	n_shards = max(1, min(n_shards, len(docs)))
+	heap = [(0, i) for i in range(n_shards)]
+	groups: List[List[int]] = [[] for _ in range(n_shards)]
+	for rows in sorted(docs.values(), key=lambda r: (-len(r), r[0])):
+		load, i = heapq.heappop(heap)
+		groups[i].extend(rows)
+		heapq.heappush(heap, (load + len(rows), i))
+	return [np.asarray(sorted(g), dtype=np.int64) for g in groups]
+
+def write_shard_map(out_dir: str, groups: List[np.ndarray], n_rows: int, info: Dict):
+	owner = np.full(n_rows, -1, dtype=np.int64)
+	for i, rows in enumerate(groups):
+		owner[rows] = i
+		np.save(os.path.join(shard_dir(out_dir, i), ROWS_FILE), rows)
+	# run-length encode the owner column: one entry per document-sized run
+	if n_rows:
+		starts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+		ends = np.r_[starts[1:], n_rows]
+		runs = np.stack([starts, ends, owner[starts]], axis=1)
+		runs = runs[runs[:, 2] >= 0]
+	else:
+		runs = np.zeros((0, 3), dtype=np.int64)
+	np.save(os.path.join(out_dir, RANGES_FILE), runs)
+	with open(os.path.join(out_dir, SHARDS_FILE), "wb") as f:
+		f.write(orjson.dumps({**info, "n_rows": n_rows, "n_shards": len(groups),
+							  "shards": [{"dir": os.path.basename(shard_dir(out_dir, i)), "n_rows": len(g)}
+										 for i, g in enumerate(groups)]},
+							 option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+
+# ------------------------------
+# Shard worker
+# ------------------------------
+class ShardSearcher:
+	"""One shard's indexes. Rows in and out are global row numbers."""
+	def __init__(self, path: str):
+		self.path = path
+		self.rows = np.load(os.path.join(path, ROWS_FILE))
+		self.dense_cfg = load_dense_config(path)
+		self.index = read_index(path, self.dense_cfg)
+		self._rescore = rescore_factor(self.dense_cfg)
+		self._stored = StoredEmbeddings(path) if self._rescore or os.path.exists(os.path.join(path, EMB_FILE)) else None
+		self._params = search_params(self.dense_cfg)
+		self.bm25 = BM25Index(path)
+		self.meta = open_meta_store(path)
+		self.chunks = open_chunk_store(path)
+
+	def ping(self) -> int:
+		return len(self.rows)
+
+	def dense(self, qmat: np.ndarray, k: int, filters: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+		# filters are resolved against this shard's own meta store (local rows)
+		qmat = np.asarray(qmat, dtype="float32")
+		if filters:
+			D, I = dense_search_rows(self.index, qmat, k, self.dense_cfg, self.meta.select(filters),
+									 self._stored, self._rescore)
+		else:
+			D, I = dense_search(self.index, qmat, k, self.dense_cfg, self._params, self._stored, self._rescore)
+		return [[(int(self.rows[i]), float(s)) for i, s in zip(ri, rd) if i != -1] for ri, rd in zip(I, D)]
+
+	def bm25_many(self, token_lists: List[List[str]], k: int, filters: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+		rows = self.meta.select(filters) if filters else None
+		return [[(int(self.rows[i]), s) for i, s in hits] for hits in self.bm25.top_k_many(token_lists, k, rows)]
+
+	def fetch(self, rows: List[int], include_text: bool = True) -> List[Tuple]:
+		"""(chunk_id, doc_id, page, source_path, start_char, end_char, text or None) per global row."""
+		local = np.searchsorted(self.rows, np.asarray(rows, dtype=np.int64)).tolist()
+		return [(*f, self.chunks.text(r) if include_text else None)
+				for r, f in zip(local, self.meta.fields(local))]
+
+	def close(self):
+		release_chunk_store(self.path)
+		release_meta_store(self.path)
+		self.index = self._stored = self.bm25 = self.chunks = self.meta = None
+
+# ------------------------------
+# Transports: submit(method, *args) -> Future
+# ------------------------------
+class LocalShard:
+	"""In-process shard on its own threads (FAISS and the numpy BM25 kernels release the GIL)."""
+	def __init__(self, path: str, threads: int = 4):
+		self.name = path
+		self.searcher = ShardSearcher(path)
+		self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"shard:{os.path.basename(path)}")
+
+	def submit(self, method: str, *args) -> Future:
+		return self._pool.submit(getattr(self.searcher, method), *args)
+
+	def close(self):
+		self._pool.shutdown(wait=True)  # searches that outlived their deadline finish first
+		self.searcher.close()
+
+_WORKER: Optional[ShardSearcher] = None
+
+def _init_worker(path: str):
+	global _WORKER
+	_WORKER = ShardSearcher(path)
+
+def _call_worker(method: str, *args):
+	return getattr(_WORKER, method)(*args)
+
+class ProcessShard:
+	"""Shard owned by one worker process (spawned: no fork of the parent's threads)."""
+	def __init__(self, path: str):
+		self.name = path
+		self._pool = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"),
+										 initializer=_init_worker, initargs=(path,))
+		self._pool.submit(_call_worker, "ping")  # start loading now, not on the first query
+
+	def submit(self, method: str, *args) -> Future:
+		return self._pool.submit(_call_worker, method, *args)
+
+	def close(self):
+		self._pool.shutdown(wait=True)
+
+class HttpShard:
+	"""
+	Remote shard served by `python -m backend.rag.shards serve`. `client` may be any
+	httpx.Client-compatible object, e.g. fastapi's TestClient over shard_app() as a
+	local stand-in.
+	"""
+	_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="shard-http")
+
+	def __init__(self, url: str, client: Any = None, timeout: float = SHARD_TIMEOUT_S):
+		self.name = url
+		if client is None:
+			import httpx
+			client = httpx.Client(base_url=url, timeout=timeout)
+		self.client = client
+
+	def _post(self, method: str, *args):
+		r = self.client.post(f"/{method}", content=orjson.dumps(list(args), option=orjson.OPT_SERIALIZE_NUMPY),
+							 headers={"Content-Type": "application/json"})
+		r.raise_for_status()
+		out = orjson.loads(r.content)
+		if method == "fetch":
+			return [tuple(x) for x in out]
+		if method == "ping":
+			return out
+		return [[(int(row), float(s)) for row, s in hits] for hits in out]
+
+	def submit(self, method: str, *args) -> Future:
+		return self._POOL.submit(self._post, method, *args)
+
+	def close(self):
+		# the shard server keeps running; only our connection pool goes
+		if hasattr(self.client, "close"):
+			self.client.close()
+
+def shard_app(path: str):
+	"""HTTP worker for one shard: POST /{dense,bm25_many,fetch,ping} with a JSON list of arguments."""
+	from fastapi import FastAPI, Request, Response
+	from fastapi.concurrency import run_in_threadpool
+	searcher = ShardSearcher(path)
+	app = FastAPI(title=f"docuchat shard {os.path.basename(path)}")
+
+	@app.get("/health")
+	def health():
+		return {"status": "ok", "shard": path, "n_rows": searcher.ping()}
+
+	@app.post("/{method}")
+	async def call(method: str, request: Request):
+		if method not in ("dense", "bm25_many", "fetch", "ping"):
+			return Response(status_code=404)
+		args = orjson.loads(await request.body())
+		if method == "dense":
+			args[0] = np.asarray(args[0], dtype="float32")
+		# FAISS / BM25 block; keep them off the event loop so searches run concurrently
+		out = await run_in_threadpool(getattr(searcher, method), *args)
+		return Response(orjson.dumps(out), media_type="application/json")
+
+	return app
+
+# ------------------------------
+# Coordinator
+# ------------------------------
+# (shard, error) pairs of the search in progress, for its timings
+_FAILED: ContextVar[Optional[List[Tuple[int, str]]]] = ContextVar("shard_failures", default=None)
+
+def connect_shards(art_dir: str, info: Dict) -> List[Any]:
+	if SHARD_URLS:
+		if len(SHARD_URLS) != info["n_shards"]:
+			raise ValueError(f"SHARD_URLS lists {len(SHARD_URLS)} workers for {info['n_shards']} shards")
+		return [HttpShard(u) for u in SHARD_URLS]
+	paths = [os.path.join(art_dir, s["dir"]) for s in info["shards"]]
+	if SHARD_MODE == "process":
+		return [ProcessShard(p) for p in paths]
+	return [LocalShard(p) for p in paths]
+
+class ShardedRetriever(Retriever):
+	"""Retriever over a sharded artifact dir: same API, searches scatter-gathered across shards."""
+	def __init__(self, art_dir: str = ART, emb_model: str = EMB_MODEL, rerank_model: str = RERANK_MODEL,
+				 shards: Optional[List[Any]] = None, timeout: float = SHARD_TIMEOUT_S):
+		self._init_models(art_dir, emb_model, rerank_model)
+		art_dir = self.art_dir
+		with open(os.path.join(art_dir, SHARDS_FILE), "rb") as f:
+			self.info = orjson.loads(f.read())
+		# the indexes live in the shards; row text and metadata come through _rows_info
+		self.meta = self.index = self._stored = self.bm25 = self.chunks = None
+		self._rescore = 0
+		self._dead = np.zeros(0, dtype=np.int64)
+		self._dead_sel = self._search_params = None
+		self.dense_cfg = self.info["dense"]
+		self.timeout = timeout
+		self.shards = shards if shards is not None else connect_shards(art_dir, self.info)
+		runs = np.load(os.path.join(art_dir, RANGES_FILE))
+		self._starts, self._ends, self._owner = runs[:, 0], runs[:, 1], runs[:, 2]
+
+	def close(self):
+		for s in self.shards:
+			s.close()
+
+	def _gather(self, calls: Dict[int, Tuple]) -> Dict[int, Any]:
+		"""Run {shard: (method, *args)} concurrently; shards that fail or time out are left out."""
+		deadline = time.perf_counter() + self.timeout
+		futs = {i: self.shards[i].submit(*call) for i, call in calls.items()}
+		out, failed = {}, []
+		for i, fut in futs.items():
+			try:
+				out[i] = fut.result(timeout=max(deadline - time.perf_counter(), 0.0))
+			except Exception as e:
+				failed.append((i, type(e).__name__))
+		if failed:
+			log_event({"route": "shards", "stage": "scatter", "method": next(iter(calls.values()))[0],
+					   "failed": [{"shard": i, "error": e} for i, e in failed]})
+			acc = _FAILED.get()
+			if acc is not None:
+				acc.extend(failed)
+		return out
+
+	@staticmethod
+	def _merge(per_shard: List[List[List[Tuple[int, float]]]], n: int, k: int) -> List[List[Tuple[int, float]]]:
+		# highest score first, lower row on ties (as a single index orders them)
+		return [heapq.nsmallest(k, (h for res in per_shard for h in res[j]), key=lambda h: (-h[1], h[0]))
+				for j in range(n)]
+
+	def select(self, filters: Optional[Dict]) -> Optional[Dict]:
+		# each shard resolves the filter against its own rows; `rows` is the filter itself
+		return normalize_filters(filters)
+
+	def dense_search_many(self, qmat: np.ndarray, k=20, rows: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+		with span("dense_search", index=self.dense_cfg["type"], shards=len(self.shards), k=k):
+			res = self._gather({i: ("dense", np.asarray(qmat, dtype="float32"), k, rows) for i in range(len(self.shards))})
+		return self._merge(list(res.values()), len(qmat), k)
+
+	def bm25_search_many(self, token_lists: List[List[str]], k=20, rows: Optional[Dict] = None) -> List[List[Tuple[int, float]]]:
+		res = self._gather({i: ("bm25_many", token_lists, k, rows) for i in range(len(self.shards))})
+		return self._merge(list(res.values()), len(token_lists), k)
+
+	def _shard_of(self, rows: np.ndarray) -> np.ndarray:
+		j = np.searchsorted(self._starts, rows, side="right") - 1
+		ok = (j >= 0) & (rows < self._ends[np.maximum(j, 0)])
+		return np.where(ok, self._owner[np.maximum(j, 0)], -1)
+
+	def _rows_info(self, rows: List[int], include_text: bool = True) -> List[Optional[Tuple]]:
+		"""One fetch per shard holding any of `rows`; rows whose shard failed come back None."""
+		arr = np.asarray(rows, dtype=np.int64)
+		owner = self._shard_of(arr)
+		by_shard = {int(i): arr[owner == i].tolist() for i in np.unique(owner) if i >= 0}
+		res = self._gather({i: ("fetch", r, include_text) for i, r in by_shard.items()})
+		info: Dict[int, Tuple] = {}
+		for i, got in res.items():
+			info.update(zip(by_shard[i], got))
+		return [info.get(r) for r in rows]
+
+	def _get_text_by_row(self, row_idx: int) -> str:
+		got = self._rows_info([row_idx])[0]
+		return got[-1] if got else ""
+
+	def search_many(self, queries: List[str], mode: str = "hybrid", k: int = 8, k_dense: int = 20,
+					k_bm25: int = 20, rerank: bool = False, top_m: int = 50, rerank_batch_size: int = 32,
+					filters: Optional[Dict] = None):
+		failed: List[Tuple[int, str]] = []
+		token = _FAILED.set(failed)
+		try:
+			hits, timings = super().search_many(queries, mode, k, k_dense, k_bm25, rerank, top_m, rerank_batch_size, filters)
+		finally:
+			_FAILED.reset(token)
+		timings["n_shards"] = len(self.shards)
+		timings["partial"] = bool(failed)
+		if failed:
+			timings["shards_failed"] = sorted({i for i, _ in failed})
+		return hits, timings
+
+def open_retriever(art_dir: str = ART, **kw) -> Retriever:
+	"""ShardedRetriever for a sharded artifact dir (or published generation), else Retriever."""
+	art_dir = resolve(art_dir)[1]
+	return ShardedRetriever(art_dir, **kw) if is_sharded(art_dir) else Retriever(art_dir, **kw)
+
+if __name__ == "__main__":
+	ap = argparse.ArgumentParser(description="Serve one shard over HTTP for a remote coordinator (SHARD_URLS)")
+	sub = ap.add_subparsers(dest="cmd", required=True)
+	sv = sub.add_parser("serve")
+	sv.add_argument("--shard", required=True, help="shard dir, e.g. artifacts/shard_000")
+	sv.add_argument("--host", default="0.0.0.0")
+	sv.add_argument("--port", type=int, default=8101)
+	args = ap.parse_args()
+	import uvicorn
+	uvicorn.run(shard_app(args.shard), host=args.host, port=args.port)
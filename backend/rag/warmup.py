@@ -0,0 +1,251 @@
+"""
+Start-up warm-up: loads the process's single Retriever / Answerer in a background
+thread, runs a few searches through every retrieval path (FAISS, BM25 postings,
+embedder and cross-encoder batchers) so the first real request doesn't pay for
+cold pages and lazy init, and records per-component status for /ready.
+
+Hot reload: `watch()` polls the artifact dir's CURRENT pointer (see generations.py).
+A newly published generation is loaded and warmed alongside the one being served,
+then swapped in; requests hold a `lease()` on the generation they started with, and
+the old one is released when its last lease ends.
+"""
+import os, time, threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional
+
+from backend.utils.config import EMB_MODEL, RERANK_MODEL
+from backend.rag.generations import current_version, resolve
+
+if TYPE_CHECKING:
+	from backend.rag.retrieve import Retriever
+	from backend.rag.answer import Answerer
+
+WARMUP = os.getenv("WARMUP", "1") == "1"                # 0: load on the first request instead
+WARMUP_RERANK = os.getenv("WARMUP_RERANK", "1") == "1"  # also load and warm the cross-encoder
+RELOAD_POLL_S = float(os.getenv("RELOAD_POLL_S", "2"))  # check for a new generation every N s; 0 = never
+OPTIONAL = ("reranker",)  # may fail without failing readiness; status reports "degraded"
+WARMUP_QUERIES = ("what is this document about", "summary of the main results",
+				  "definition and example", "how does the method work")
+
+class Generation:
+	"""One loaded artifact generation and the number of requests using it."""
+	def __init__(self, path: str, retriever: "Retriever"):
+		self.path = path
+		self.retriever = retriever
+		self.version: str = retriever.index_version
+		self.active = 0
+		self.retired = False
+		self._ans: Optional["Answerer"] = None
+		self._lock = threading.Lock()
+
+	@property
+	def loaded_answerer(self) -> bool:
+		return self._ans is not None
+
+	def answerer(self) -> "Answerer":
+		if self._ans is None:
+			with self._lock:
+				if self._ans is None:
+					from backend.rag.answer import Answerer
+					self._ans = Answerer(art_dir=self.path, retriever=self.retriever)
+		return self._ans
+
+	def close(self):
+		self.retriever.close()
+		self._ans = None
+
+class Warmup:
+	"""
+	Owns the shared Retriever / Answerer of the served generation; `run()` loads and
+	warms them, `status()` reports progress, `reload()` switches generations.
+	"""
+	def __init__(self, art_dir: str = "artifacts", rerank: bool = WARMUP_RERANK):
+		self.art_dir = art_dir
+		self.rerank = rerank
+		self._gen: Optional[Generation] = None
+		self._lock = threading.Lock()         # one load, however many callers race for it
+		self._lease_lock = threading.Lock()   # guards the swap and lease counts
+		self._reload_lock = threading.Lock()  # one reload at a time
+		self._failed_version: Optional[str] = None
+		self._stop = threading.Event()
+		self._thread: Optional[threading.Thread] = None
+		self._watcher: Optional[threading.Thread] = None
+		self.t_start: Optional[float] = None
+		self.t_end: Optional[float] = None
+		names = ["embedder"] + (["reranker"] if rerank else []) + ["index", "answerer", "queries"]
+		self.components: Dict[str, Dict[str, Any]] = {n: {"status": "pending"} for n in names}
+
+	@staticmethod
+	def _load(path: str) -> Generation:
+		from backend.rag.shards import open_retriever
+		return Generation(path, open_retriever(path))
+
+	def _current(self) -> Generation:
+		if self._gen is None:
+			with self._lock:
+				if self._gen is None:
+					self._gen = self._load(resolve(self.art_dir)[1])
+		return self._gen
+
+	def retriever(self) -> "Retriever":
+		return self._current().retriever
+
+	def answerer(self) -> "Answerer":
+		return self._current().answerer()
+
+	def version(self) -> Optional[str]:
+		"""Version being served; before the first load, the published one (if any)."""
+		gen = self._gen
+		return gen.version if gen is not None else current_version(self.art_dir)
+
+	def acquire(self) -> Generation:
+		self._current()
+		with self._lease_lock:
+			gen = self._gen
+			gen.active += 1
+		return gen
+
+	def release(self, gen: Generation):
+		with self._lease_lock:
+			gen.active -= 1
+			idle = gen.retired and gen.active == 0
+		if idle:
+			self._close(gen)
+
+	@contextmanager
+	def lease(self) -> Iterator[Generation]:
+		"""The served generation, kept open until the block exits even if a reload swaps it out."""
+		gen = self.acquire()
+		try:
+			yield gen
+		finally:
+			self.release(gen)
+
+	def _close(self, gen: Generation):
+		from backend.obs.logger import log_event
+		def close():
+			gen.close()
+			log_event({"route": "reload", "stage": "released", "version": gen.version})
+		# off the request thread: shutting down shard workers can take a moment
+		threading.Thread(target=close, name="release", daemon=True).start()
+
+	def reload(self) -> bool:
+		"""
+		Load the published generation if it isn't the one being served, warm it, then
+		swap it in. Requests already running keep the old one until they finish.
+		"""
+		from backend.obs.logger import log_event
+		with self._reload_lock:
+			version, path = resolve(self.art_dir)
+			cur = self._gen
+			if cur is None or version is None or version in (cur.version, self._failed_version):
+				return False
+			t0 = time.perf_counter()
+			try:
+				new = self._load(path)
+				if cur.loaded_answerer:
+					new.answerer()
+				self._queries(new.retriever)
+			except Exception as e:
+				# keep serving the current one; retried once a newer generation is published
+				self._failed_version = version
+				log_event({"route": "reload", "stage": "failed", "version": version,
+						   "error": f"{type(e).__name__}: {e}"})
+				return False
+			with self._lease_lock:
+				old, self._gen = self._gen, new
+				old.retired = True
+				draining = old.active
+			if not draining:
+				self._close(old)
+			log_event({"route": "reload", "stage": "swapped", "from": old.version, "to": new.version,
+					   "ms": int((time.perf_counter() - t0) * 1000), "draining": draining})
+			return True
+
+	def watch(self, interval: float = RELOAD_POLL_S) -> threading.Thread:
+		"""Poll for newly published generations (only once something has been loaded)."""
+		def loop():
+			while not self._stop.wait(interval):
+				if self._gen is not None:
+					self.reload()
+		if self._watcher is None:
+			self._watcher = threading.Thread(target=loop, name="reload", daemon=True)
+			self._watcher.start()
+		return self._watcher
+
+	def stop(self):
+		self._stop.set()
+
+	def _step(self, name: str, fn: Callable[[], Any]) -> bool:
+		comp = self.components[name]
+		comp["status"] = "loading"
+		t0 = time.perf_counter()
+		try:
+			fn()
+		except Exception as e:
+			comp.update(status="failed", error=f"{type(e).__name__}: {e}")
+			return False
+		finally:
+			comp["ms"] = int((time.perf_counter() - t0) * 1000)
+		comp["status"] = "ready"
+		return True
+
+	def _queries(self, ret: Optional["Retriever"] = None):
+		ret = ret or self.retriever()
+		rerank = self.rerank and self.components["reranker"]["status"] == "ready"
+		modes = ("bm25", "dense", "hybrid") + (("hybrid_rerank",) if rerank else ())
+		for mode in modes:
+			for q in WARMUP_QUERIES:
+				ret.search(q, mode=mode, k=8, k_dense=24, k_bm25=24, rerank=mode == "hybrid_rerank", top_m=16)
+		ret.search_many(list(WARMUP_QUERIES), mode="hybrid", k=8, k_dense=24, k_bm25=24)
+
+	def run(self):
+		from backend.models.registry import get_embedder, get_reranker
+		from backend.obs.logger import log_event
+		self.t_start = time.time()
+		steps = [("embedder", lambda: get_embedder(EMB_MODEL))]
+		if self.rerank:
+			steps.append(("reranker", lambda: get_reranker(RERANK_MODEL)))
+		steps += [("index", self.retriever), ("answerer", self.answerer), ("queries", self._queries)]
+		for i, (name, fn) in enumerate(steps):
+			if not self._step(name, fn) and name != "reranker":
+				# later steps depend on this one; leave them for the first request to retry
+				for later, _ in steps[i + 1:]:
+					self.components[later]["status"] = "skipped"
+				break
+		self.t_end = time.time()
+		log_event({"route": "startup", "stage": "warmup", **self.status()})
+
+	def start(self) -> threading.Thread:
+		if self._thread is None:
+			self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+			self._thread.start()
+		return self._thread
+
+	def ready(self) -> bool:
+		# the reranker is optional: without it searches run unreranked (see _queries)
+		return all(c["status"] == "ready" or (n in OPTIONAL and c["status"] == "failed")
+				   for n, c in self.components.items())
+
+	def degraded(self) -> List[str]:
+		return [n for n in OPTIONAL if self.components.get(n, {}).get("status") == "failed"]
+
+	def use_rerank(self, requested: bool) -> bool:
+		"""`requested`, unless the reranker failed to load at start-up (degraded mode)."""
+		return requested and "reranker" not in self.degraded()
+
+	def status(self) -> Dict[str, Any]:
+		if self.ready():
+			state = "degraded" if self.degraded() else "ready"
+		elif any(c["status"] == "failed" for c in self.components.values()):
+			state = "failed"
+		else:
+			state = "loading" if self.t_start else "not_started"
+		end = self.t_end or (time.time() if self.t_start else None)
+		return {
+			"status": state,
+			"elapsed_ms": int((end - self.t_start) * 1000) if self.t_start else None,
+			"index_version": self.version(),
+			"components": {n: dict(c) for n, c in self.components.items()},
+			**({"degraded": self.degraded()} if self.degraded() else {}),
+		}
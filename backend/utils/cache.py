@@ -0,0 +1,52 @@
+import time, threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class TTLCache:
+	"""
+	Thread-safe LRU cache with an optional per-entry time-to-live.
+	maxsize <= 0 disables caching; ttl <= 0 means entries never expire.
+	"""
+	def __init__(self, maxsize: int = 1024, ttl: float = 0):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key: Hashable, default: Any = None) -> Any:
+		with self._lock:
+			item = self._data.get(key)
+			if item is not None:
+				value, expires = item
+				if not expires or expires > time.monotonic():
+					self._data.move_to_end(key)
+					self.hits += 1
+					return value
+				del self._data[key]
+			self.misses += 1
+			return default
+
+	def put(self, key: Hashable, value: Any):
+		if self.maxsize <= 0:
+			return
+		expires = time.monotonic() + self.ttl if self.ttl > 0 else 0
+		with self._lock:
+			self._data[key] = (value, expires)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+				self.evictions += 1
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self) -> int:
+		return len(self._data)
+
+	def stats(self) -> Dict[str, int]:
+		return {"hits": self.hits, "misses": self.misses,
+				"evictions": self.evictions, "size": len(self._data)}
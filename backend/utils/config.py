@@ -4,3 +4,6 @@ load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai")
+
+EMB_MODEL = os.getenv("EMB_MODEL", "BAAI/bge-small-en-v1.5")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base")
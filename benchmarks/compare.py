@@ -0,0 +1,64 @@
+"""
+Diff two benchmark result files (benchmarks/run.py output): per corpus size, build
+and load times, artifact size, p50/p95/QPS per (mode, concurrency), and entry-point
+import time. Exits 1 if any metric regressed by more than --threshold.
+"""
+import sys, argparse, orjson
+from typing import Dict, List, Tuple
+
+def load(path: str) -> Dict:
+	with open(path, "rb") as f:
+		return orjson.loads(f.read())
+
+def _rows(res: Dict) -> Dict[Tuple, float]:
+	"""(n_chunks, metric...) -> value, with the direction of "better" encoded in the name."""
+	out = {}
+	for c in res["corpora"]:
+		n = c["n_chunks"]
+		if "build_s" in c.get("build", {}):
+			out[(n, "build_s")] = c["build"]["build_s"]
+		out[(n, "artifact_mib")] = round(c["build"]["artifacts"]["total_bytes"] / 2**20, 2)
+		out[(n, "retriever_load_s")] = c["load"]["retriever_load_s"]
+		for r in c["latency"]:
+			key = f"{r['mode']}@c{r['concurrency']}"
+			out[(n, key, "p50_ms")] = r["p50_ms"]
+			out[(n, key, "p95_ms")] = r["p95_ms"]
+			out[(n, key, "qps")] = r["qps"]
+	for m in res.get("startup", {}).get("imports", []):
+		if m.get("import_ms") is not None:
+			out[("startup", m["module"], "import_ms")] = m["import_ms"]
+	for r in res.get("ingest", []):
+		out[("ingest", f"w{r['workers']}", "pages_per_s")] = r["pages_per_s"]
+	return out
+
+def compare(old: Dict, new: Dict, threshold: float) -> List[Tuple]:
+	a, b = _rows(old), _rows(new)
+	rows = []
+	for key in sorted(a.keys() & b.keys(), key=str):
+		x, y = a[key], b[key]
+		if not x:
+			continue
+		change = (y - x) / x
+		higher_better = key[-1] in ("qps", "pages_per_s")
+		worse = -change if higher_better else change
+		rows.append((key, x, y, change, worse > threshold))
+	return rows
+
+def main():
+	ap = argparse.ArgumentParser()
+	ap.add_argument("old")
+	ap.add_argument("new")
+	ap.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+	args = ap.parse_args()
+	old, new = load(args.old), load(args.new)
+	print(f"old: {old['env'].get('commit', '')[:10]}  new: {new['env'].get('commit', '')[:10]}")
+	rows = compare(old, new, args.threshold)
+	for key, x, y, change, regressed in rows:
+		name = " ".join(str(k) for k in key)
+		print(f"{'!!' if regressed else '  '} {name:40s} {x:>12} -> {y:<12} {change:+.1%}")
+	n_bad = sum(r[-1] for r in rows)
+	print(f"\n{n_bad} regression(s) beyond {args.threshold:.0%}")
+	return 1 if n_bad else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Synthetic corpus generator: writes chunks.jsonl (+ manifest.json) in the format
+ingest.py produces, with a Zipf-distributed vocabulary so BM25 posting lengths and
+embedding neighbourhoods look like real text. Streams to disk, so 10M chunks needs
+no more memory than 10k. Also samples queries whose source row is known.
+"""
+import os, orjson, argparse
+import numpy as np
+from typing import Dict, List
+
+from backend.rag.manifest import new_manifest, save_manifest
+
+SYLLABLES = ["ka", "lo", "mi", "re", "tu", "sa", "ne", "po", "di", "va", "shi", "on",
+			 "el", "ar", "um", "ix", "qua", "ber", "tor", "lin", "gra", "fen", "dor", "pel"]
+
+def make_vocab(size: int, seed: int = 0) -> List[str]:
+	"""`size` distinct pseudo-words of 2-4 syllables."""
+	rng = np.random.default_rng(seed)
+	vocab, seen = [], set()
+	while len(vocab) < size:
+		w = "".join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+		if w not in seen:
+			seen.add(w)
+			vocab.append(w)
+	return vocab
+
+def _sentences(rng, vocab: List[str], cdf: np.ndarray, n_words: int) -> str:
+	ids = np.searchsorted(cdf, rng.random(n_words))
+	words = [vocab[i] for i in ids]
+	out, pos = [], 0
+	while pos < n_words:
+		n = int(rng.integers(8, 20))
+		sent = words[pos:pos + n]
+		sent[0] = sent[0].capitalize()
+		out.append(" ".join(sent) + ".")
+		pos += n
+	return " ".join(out)
+
+def generate(out_dir: str, n_chunks: int, chunks_per_doc: int = 50, words_per_chunk: int = 120,
+			 vocab_size: int = 50_000, zipf_s: float = 1.1, n_queries: int = 1000, seed: int = 0) -> Dict:
+	"""
+	Write `out_dir`/chunks.jsonl, manifest.json and queries.jsonl. Queries are 3-6
+	words drawn from a random chunk (its row is recorded as `row`).
+	"""
+	os.makedirs(out_dir, exist_ok=True)
+	rng = np.random.default_rng(seed)
+	vocab = make_vocab(vocab_size, seed)
+	p = 1.0 / np.arange(1, vocab_size + 1) ** zipf_s
+	cdf = np.cumsum(p / p.sum())
+	query_rows = set(rng.choice(n_chunks, size=min(n_queries, n_chunks), replace=False).tolist())
+	manifest = new_manifest()
+	queries = []
+	with open(os.path.join(out_dir, "chunks.jsonl"), "wb") as f:
+		for row in range(n_chunks):
+			d, c = divmod(row, chunks_per_doc)
+			doc_id = f"synth_{d:07d}"
+			text = _sentences(rng, vocab, cdf, words_per_chunk)
+			f.write(orjson.dumps({
+				"doc_id": doc_id,
+				"source_path": f"synthetic/{doc_id}.pdf",
+				"page": c // 4 + 1,
+				"chunk_id": f"{doc_id}:{c // 4 + 1}:{c % 4 + 1}",
+				"start_char": 0,
+				"end_char": len(text),
+				"text": text,
+				"n_tokens": words_per_chunk,
+			}) + b"\n")
+			if c == 0:
+				manifest["docs"][f"synthetic/{doc_id}.pdf"] = {
+					"doc_id": doc_id, "sha256": "", "n_pages": (chunks_per_doc + 3) // 4,
+					"rows": [row, min(row + chunks_per_doc, n_chunks)]}
+			if row in query_rows:
+				# verbatim span: tokens match the chunk exactly, as BM25 tokenizes it
+				words = text.split()
+				n = int(rng.integers(3, 7))
+				i = int(rng.integers(0, max(len(words) - n, 1)))
+				queries.append({"query": " ".join(words[i:i + n]), "row": row})
+	manifest["n_rows"] = n_chunks
+	manifest["chunks_bytes"] = os.path.getsize(os.path.join(out_dir, "chunks.jsonl"))
+	save_manifest(manifest, out_dir)
+	rng.shuffle(queries)
+	with open(os.path.join(out_dir, "queries.jsonl"), "wb") as f:
+		for q in queries:
+			f.write(orjson.dumps(q) + b"\n")
+	return {"n_chunks": n_chunks, "n_docs": len(manifest["docs"]), "words_per_chunk": words_per_chunk,
+			"vocab_size": vocab_size, "zipf_s": zipf_s, "n_queries": len(queries), "seed": seed,
+			"chunks_bytes": os.path.getsize(os.path.join(out_dir, "chunks.jsonl"))}
+
+def load_queries(path: str) -> List[Dict]:
+	with open(path, "rb") as f:
+		return [orjson.loads(line) for line in f if line.strip()]
+
+def write_pdfs(out_dir: str, n_pdfs: int, pages_per_pdf: int = 20, words_per_page: int = 400,
+			   vocab_size: int = 20_000, seed: int = 0) -> int:
+	"""Synthetic PDFs for the ingest benchmark (needs PyMuPDF). Returns total pages."""
+	import fitz
+	os.makedirs(out_dir, exist_ok=True)
+	rng = np.random.default_rng(seed)
+	vocab = make_vocab(vocab_size, seed)
+	p = 1.0 / np.arange(1, vocab_size + 1) ** 1.1
+	cdf = np.cumsum(p / p.sum())
+	for i in range(n_pdfs):
+		doc = fitz.open()
+		for _ in range(pages_per_pdf):
+			page = doc.new_page()
+			page.insert_textbox(page.rect + (36, 36, -36, -36), _sentences(rng, vocab, cdf, words_per_page),
+								fontsize=8)
+		doc.save(os.path.join(out_dir, f"synth_{i:04d}.pdf"))
+		doc.close()
+	return n_pdfs * pages_per_pdf
+
+if __name__ == "__main__":
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--out", default="benchmarks/data/synth_10k")
+	ap.add_argument("--chunks", type=int, default=10_000)
+	ap.add_argument("--chunks-per-doc", type=int, default=50)
+	ap.add_argument("--words", type=int, default=120, help="words per chunk")
+	ap.add_argument("--vocab", type=int, default=50_000)
+	ap.add_argument("--queries", type=int, default=1000)
+	ap.add_argument("--seed", type=int, default=0)
+	args = ap.parse_args()
+	info = generate(args.out, args.chunks, args.chunks_per_doc, args.words, args.vocab,
+					n_queries=args.queries, seed=args.seed)
+	print(orjson.dumps(info, option=orjson.OPT_INDENT_2).decode())
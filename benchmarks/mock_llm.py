@@ -0,0 +1,184 @@
+"""
+OpenAI-compatible mock LLM server, and a load run of the LLM gateway against it.
+The mock answers /v1/chat/completions (plain and streamed) after a configurable
+latency, can inject 429s (with Retry-After / x-ratelimit headers) and 5xx errors,
+and reports the highest number of concurrent requests it saw at GET /stats.
+
+	python -m benchmarks.mock_llm serve --port 8199
+	OPENAI_BASE_URL=http://127.0.0.1:8199/v1 OPENAI_API_KEY=x uvicorn backend.app:app
+
+	python -m benchmarks.mock_llm load --requests 200 --concurrency 64 --dup 0.5 --p429 0.1
+"""
+import os, sys, time, json, random, asyncio, threading, argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+def mock_app(latency_ms: float = 200, token_ms: float = 5, n_tokens: int = 40,
+			 p429: float = 0.0, p500: float = 0.0, retry_after: float = 0.2, seed: int = 0):
+	from fastapi import FastAPI, Request
+	from fastapi.responses import JSONResponse, StreamingResponse
+	app = FastAPI(title="mock llm")
+	rng = random.Random(seed)
+	stats = {"requests": 0, "completions": 0, "status_429": 0, "status_500": 0, "concurrent": 0, "max_concurrent": 0}
+	lock = threading.Lock()
+
+	def enter():
+		with lock:
+			stats["requests"] += 1
+			stats["concurrent"] += 1
+			stats["max_concurrent"] = max(stats["max_concurrent"], stats["concurrent"])
+			r = rng.random()
+		return 429 if r < p429 else 500 if r < p429 + p500 else 200
+
+	def leave(status: int):
+		with lock:
+			stats["concurrent"] -= 1
+			stats["completions" if status == 200 else f"status_{status}"] += 1
+
+	def usage(body: Dict) -> Dict:
+		p = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+		return {"prompt_tokens": p, "completion_tokens": n_tokens, "total_tokens": p + n_tokens}
+
+	def error(status: int) -> JSONResponse:
+		headers = {}
+		if status == 429:
+			headers = {"retry-after": f"{retry_after:g}", "x-ratelimit-remaining-requests": "0",
+					   "x-ratelimit-reset-requests": f"{int(retry_after * 1000)}ms"}
+		return JSONResponse({"error": {"message": f"mock {status}", "type": "mock", "code": status}},
+							status_code=status, headers=headers)
+
+	@app.get("/stats")
+	def get_stats():
+		with lock:
+			return dict(stats)
+
+	@app.post("/v1/chat/completions")
+	async def completions(request: Request):
+		body = await request.json()
+		status = enter()
+		try:
+			await asyncio.sleep(latency_ms / 1000)
+		except BaseException:
+			leave(status)
+			raise
+		if status != 200:
+			leave(status)
+			return error(status)
+		base = {"id": "mock", "created": int(time.time()), "model": body.get("model", "mock")}
+		words = [f"tok{i}" for i in range(n_tokens)]
+		if not body.get("stream"):
+			leave(status)
+			return {**base, "object": "chat.completion", "usage": usage(body),
+					"choices": [{"index": 0, "finish_reason": "stop",
+								 "message": {"role": "assistant", "content": " ".join(words)}}]}
+
+		async def events():
+			try:
+				for i, w in enumerate(words):
+					await asyncio.sleep(token_ms / 1000)
+					chunk = {**base, "object": "chat.completion.chunk",
+							 "choices": [{"index": 0, "finish_reason": None, "delta": {"content": w if i == 0 else " " + w}}]}
+					yield f"data: {json.dumps(chunk)}\n\n"
+				if (body.get("stream_options") or {}).get("include_usage"):
+					yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage(body)})}\n\n"
+				yield "data: [DONE]\n\n"
+			finally:
+				leave(status)
+
+		return StreamingResponse(events(), media_type="text/event-stream")
+
+	return app
+
+def serve_in_thread(app, port: int):
+	"""Start uvicorn on a daemon thread; returns once it accepts connections."""
+	import uvicorn
+	server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+	threading.Thread(target=server.run, name="mock-llm", daemon=True).start()
+	while not server.started:
+		time.sleep(0.01)
+	return server
+
+def _pct(a: List[float], q: float) -> float:
+	return round(sorted(a)[min(int(len(a) * q), len(a) - 1)], 1) if a else 0.0
+
+def load(port: int, n: int, concurrency: int, dup: float, stream: bool, seed: int = 0) -> Dict:
+	"""
+	`n` requests, `concurrency` at a time, through get_llm(); a `dup` fraction of them
+	repeat one prompt, which the gateway should coalesce.
+	"""
+	os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+	os.environ.setdefault("OPENAI_API_KEY", "mock")
+	os.environ["MODEL_PROVIDER"] = "openai"
+	import httpx
+	from backend.models.llm import get_llm, llm_stats
+	llm = get_llm()
+	rng = random.Random(seed)
+	prompts = ["same question" if rng.random() < dup else f"question {i}" for i in range(n)]
+	lat: List[float] = []
+	errors: Dict[str, int] = {}
+
+	def record(t0: float, err: BaseException = None):
+		if err is None:
+			lat.append((time.perf_counter() - t0) * 1000)
+		else:
+			errors[type(err).__name__] = errors.get(type(err).__name__, 0) + 1
+
+	def one(p: str):
+		t0 = time.perf_counter()
+		try:
+			llm.generate(p, max_tokens=64, temperature=0.0)
+			record(t0)
+		except Exception as e:
+			record(t0, e)
+
+	async def one_stream(p: str, sem: asyncio.Semaphore):
+		async with sem:
+			t0 = time.perf_counter()
+			try:
+				async for _ in llm.astream(p, max_tokens=64, temperature=0.0, usage={}):
+					pass
+				record(t0)
+			except Exception as e:
+				record(t0, e)
+
+	async def run_streams():
+		sem = asyncio.Semaphore(concurrency)
+		await asyncio.gather(*(one_stream(p, sem) for p in prompts))
+
+	t0 = time.perf_counter()
+	if stream:
+		asyncio.run(run_streams())
+	else:
+		with ThreadPoolExecutor(max_workers=concurrency) as pool:
+			list(pool.map(one, prompts))
+	wall = time.perf_counter() - t0
+	return {
+		"requests": n, "concurrency": concurrency, "dup": dup, "stream": stream,
+		"wall_s": round(wall, 3), "ok": len(lat), "errors": errors,
+		"p50_ms": _pct(lat, 0.5), "p95_ms": _pct(lat, 0.95),
+		"gateway": llm_stats(),
+		"server": httpx.get(f"http://127.0.0.1:{port}/stats").json(),
+	}
+
+if __name__ == "__main__":
+	ap = argparse.ArgumentParser()
+	ap.add_argument("cmd", choices=("serve", "load"))
+	ap.add_argument("--port", type=int, default=8199)
+	ap.add_argument("--latency-ms", type=float, default=200)
+	ap.add_argument("--token-ms", type=float, default=5)
+	ap.add_argument("--tokens", type=int, default=40)
+	ap.add_argument("--p429", type=float, default=0.0, help="fraction of requests answered 429")
+	ap.add_argument("--p500", type=float, default=0.0, help="fraction of requests answered 500")
+	ap.add_argument("--retry-after", type=float, default=0.2)
+	ap.add_argument("--requests", type=int, default=200)
+	ap.add_argument("--concurrency", type=int, default=64)
+	ap.add_argument("--dup", type=float, default=0.5, help="fraction of requests sharing one prompt")
+	ap.add_argument("--stream", action="store_true")
+	args = ap.parse_args()
+	app = mock_app(args.latency_ms, args.token_ms, args.tokens, args.p429, args.p500, args.retry_after)
+	if args.cmd == "serve":
+		import uvicorn
+		uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+		sys.exit(0)
+	serve_in_thread(app, args.port)
+	print(json.dumps(load(args.port, args.requests, args.concurrency, args.dup, args.stream), indent=2))
@@ -0,0 +1,191 @@
+"""
+Retrieval benchmark suite. For each corpus size: generate a synthetic corpus, build
+artifacts with index_build, then measure build time, artifact size, load time, and
+per-mode latency percentiles / QPS at several concurrency levels. Optionally
+benchmarks PDF ingest throughput. Results go to one JSON file per run, to diff
+between commits with benchmarks/compare.py.
+
+Runs offline: models must already be in the local Hugging Face cache.
+"""
+import os
+
+# never reach for the network; fail fast if a model isn't cached
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import sys, time, shutil, platform, subprocess, argparse, orjson
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from benchmarks.corpus import generate, load_queries, write_pdfs
+from benchmarks.startup import startup_profile
+from backend.utils.config import EMB_MODEL, RERANK_MODEL
+
+MODES = ("bm25", "dense", "hybrid", "hybrid_rerank")
+
+def _git() -> Dict:
+	def run(*cmd):
+		try:
+			return subprocess.run(["git", *cmd], capture_output=True, text=True, timeout=10).stdout.strip()
+		except (OSError, subprocess.SubprocessError):
+			return ""
+	return {"commit": run("rev-parse", "HEAD"), "dirty": bool(run("status", "--porcelain", "--untracked-files=no"))}
+
+def environment() -> Dict:
+	return {
+		**_git(),
+		"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"cpu_count": os.cpu_count(),
+		"emb_model": EMB_MODEL,
+		"rerank_model": RERANK_MODEL,
+	}
+
+def dir_size(path: str) -> Dict[str, int]:
+	sizes = {name: os.path.getsize(os.path.join(path, name)) for name in sorted(os.listdir(path))
+			 if os.path.isfile(os.path.join(path, name))}
+	return {"total_bytes": sum(sizes.values()), "files": sizes}
+
+def percentiles(lat_ms: List[float]) -> Dict[str, float]:
+	a = np.asarray(lat_ms)
+	out = {f"p{q}_ms": round(float(np.percentile(a, q)), 3) for q in (50, 90, 95, 99)}
+	out["mean_ms"] = round(float(a.mean()), 3)
+	return out
+
+def bench_build(corpus_dir: str, art_dir: str, dense_cfg: Dict, batch: int) -> Dict:
+	from backend.rag.index_build import build_all
+	if os.path.isdir(art_dir):
+		shutil.rmtree(art_dir)
+	t0 = time.perf_counter()
+	build_all(os.path.join(corpus_dir, "chunks.jsonl"), art_dir, EMB_MODEL, batch, dense_cfg)
+	return {"build_s": round(time.perf_counter() - t0, 3), "artifacts": dir_size(art_dir)}
+
+def bench_load(art_dir: str, rerank: bool):
+	"""Models first (their own timings from the registry), then the Retriever's index load."""
+	from backend.models.registry import get_embedder, get_reranker, model_stats
+	from backend.rag.shards import open_retriever
+	get_embedder(EMB_MODEL)
+	if rerank:
+		get_reranker(RERANK_MODEL)
+	t0 = time.perf_counter()
+	ret = open_retriever(art_dir)
+	return ret, {"retriever_load_s": round(time.perf_counter() - t0, 3), "models": model_stats()}
+
+def bench_queries(ret, queries: List[Dict], mode: str, concurrency: int, k: int) -> Dict:
+	from backend.rag.retrieve import QUERY_EMB_CACHE
+	QUERY_EMB_CACHE.clear()  # every level starts cold, as with fresh user queries
+	rerank = mode == "hybrid_rerank"
+
+	def one(item):
+		t0 = time.perf_counter()
+		hits, _ = ret.search(item["query"], mode=mode, k=k, k_dense=max(20, k * 3), k_bm25=max(20, k * 3),
+							 rerank=rerank, top_m=40)
+		return (time.perf_counter() - t0) * 1000, any(h["row"] == item["row"] for h in hits)
+
+	t0 = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=concurrency) as pool:
+		results = list(pool.map(one, queries))
+	wall = time.perf_counter() - t0
+	lat = [r[0] for r in results]
+	return {"mode": mode, "concurrency": concurrency, "n_queries": len(queries),
+			"qps": round(len(queries) / wall, 2), **percentiles(lat),
+			f"hit@{k}": round(sum(r[1] for r in results) / len(results), 4)}
+
+def bench_ingest(work_dir: str, n_pdfs: int, pages: int, workers: List[int]) -> List[Dict]:
+	from backend.rag.ingest import ingest_folder
+	pdf_dir = os.path.join(work_dir, f"pdfs_{n_pdfs}x{pages}")
+	if not os.path.isdir(pdf_dir):
+		write_pdfs(pdf_dir, n_pdfs, pages)
+	out = []
+	for w in workers:
+		art = os.path.join(work_dir, f"ingest_w{w}")
+		shutil.rmtree(art, ignore_errors=True)
+		stats = ingest_folder(pdf_dir, art, incremental=False, workers=w)
+		out.append({"workers": w, **{k: stats[k] for k in ("n_pages", "n_new_chunks", "elapsed_s",
+															"pages_per_s", "chunks_per_s")}})
+		print(f"  ingest workers={w}: {out[-1]['pages_per_s']} pages/s, {out[-1]['chunks_per_s']} chunks/s")
+	return out
+
+def main():
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--sizes", default="10000", help="comma-separated corpus sizes in chunks (e.g. 10000,100000,1000000)")
+	ap.add_argument("--work-dir", default="benchmarks/data")
+	ap.add_argument("--out", default="benchmarks/results")
+	ap.add_argument("--modes", default=",".join(MODES))
+	ap.add_argument("--concurrency", default="1,4,16")
+	ap.add_argument("--queries", type=int, default=200, help="queries per (mode, concurrency) run")
+	ap.add_argument("--rerank-queries", type=int, default=50, help="queries per hybrid_rerank run")
+	ap.add_argument("--warmup", type=int, default=20)
+	ap.add_argument("--k", type=int, default=8)
+	ap.add_argument("--index", default="flat", help="FAISS index type (see index_build --index)")
+	ap.add_argument("--quant", default=None, help="FAISS vector codes (see index_build --quant)")
+	ap.add_argument("--store", default=None, help="stored embedding dtype (see index_build --store)")
+	ap.add_argument("--rescore", type=int, default=None, help="rescoring shortlist factor (see index_build --rescore)")
+	ap.add_argument("--batch", type=int, default=64, help="embedding batch size for the build")
+	ap.add_argument("--reuse", action="store_true", help="reuse existing corpora and artifacts")
+	ap.add_argument("--ingest-pdfs", type=int, default=0, help="also benchmark ingest on N synthetic PDFs")
+	ap.add_argument("--ingest-pages", type=int, default=20)
+	ap.add_argument("--ingest-workers", default="1,4")
+	ap.add_argument("--seed", type=int, default=0)
+	args = ap.parse_args()
+
+	from backend.rag.dense_index import dense_config
+	dense_cfg = dense_config(type=args.index, quant=args.quant, store=args.store, rescore=args.rescore)
+	modes = [m for m in args.modes.split(",") if m]
+	levels = [int(c) for c in args.concurrency.split(",")]
+	result = {"env": environment(), "args": vars(args), "corpora": []}
+
+	# before anything here imports the RAG stack; each profile runs in a fresh interpreter
+	result["startup"] = startup_profile()
+	for m in result["startup"]["imports"]:
+		print(f"Import {m['module']}: {m.get('import_ms')} ms, heavy: {m.get('heavy_imports') or 'none'}")
+
+	if args.ingest_pdfs:
+		print(f"Ingest: {args.ingest_pdfs} PDFs x {args.ingest_pages} pages")
+		result["ingest"] = bench_ingest(args.work_dir, args.ingest_pdfs, args.ingest_pages,
+										[int(w) for w in args.ingest_workers.split(",")])
+
+	for n in [int(s) for s in args.sizes.split(",")]:
+		corpus_dir = os.path.join(args.work_dir, f"synth_{n}")
+		art_dir = os.path.join(corpus_dir, "artifacts")
+		entry: Dict = {"n_chunks": n}
+		print(f"\n=== {n} chunks ===")
+		if not (args.reuse and os.path.exists(os.path.join(corpus_dir, "queries.jsonl"))):
+			t0 = time.perf_counter()
+			entry["corpus"] = generate(corpus_dir, n, n_queries=max(args.queries, args.rerank_queries) + args.warmup,
+									   seed=args.seed)
+			entry["corpus"]["generate_s"] = round(time.perf_counter() - t0, 3)
+		if not (args.reuse and os.path.exists(os.path.join(art_dir, "meta_count.json"))):
+			entry["build"] = bench_build(corpus_dir, art_dir, dict(dense_cfg), args.batch)
+			print(f"  build: {entry['build']['build_s']}s, {entry['build']['artifacts']['total_bytes'] / 2**20:.1f} MiB")
+		else:
+			entry["build"] = {"artifacts": dir_size(art_dir)}
+
+		ret, entry["load"] = bench_load(art_dir, "hybrid_rerank" in modes)
+		print(f"  retriever load: {entry['load']['retriever_load_s']}s")
+
+		queries = load_queries(os.path.join(corpus_dir, "queries.jsonl"))
+		warm, queries = queries[:args.warmup], queries[args.warmup:]
+		entry["latency"] = []
+		for mode in modes:
+			qs = queries[:args.rerank_queries if mode == "hybrid_rerank" else args.queries]
+			bench_queries(ret, warm, mode, 1, args.k)
+			for c in levels:
+				r = bench_queries(ret, qs, mode, c, args.k)
+				entry["latency"].append(r)
+				print(f"  {mode:13s} c={c:<3d} qps={r['qps']:<8} p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+					  f"hit@{args.k}={r[f'hit@{args.k}']}")
+		result["corpora"].append(entry)
+		del ret
+
+	os.makedirs(args.out, exist_ok=True)
+	sha = (result["env"]["commit"] or "nogit")[:10]
+	path = os.path.join(args.out, f"bench-{time.strftime('%Y%m%d-%H%M%S')}-{sha}.json")
+	with open(path, "wb") as f:
+		f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2))
+	print(f"\nResults: {path}")
+
+if __name__ == "__main__":
+	sys.exit(main())
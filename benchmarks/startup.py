@@ -0,0 +1,66 @@
+"""
+Startup cost: `python -X importtime` profiles of the service and CLI entry points,
+and wall time from interpreter start to a served /health. Flags any heavy ML module
+that an entry point imports eagerly.
+"""
+import os, sys, json, argparse, subprocess
+from typing import Dict, List
+
+HEAVY = ("torch", "transformers", "sentence_transformers", "faiss", "fitz", "nltk", "numpy", "openai")
+ENTRY_POINTS = ("backend.app", "backend.obs.report")
+
+HEALTH_SNIPPET = """
+import time; t0 = time.perf_counter()
+import backend.app as a
+t1 = time.perf_counter()
+a.health()
+print(t1 - t0, time.perf_counter() - t0)
+"""
+
+def _env() -> Dict[str, str]:
+	env = dict(os.environ)
+	root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+	env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+	return env
+
+def import_profile(module: str, top: int = 15) -> Dict:
+	"""Cumulative import time of `module` (fresh interpreter), its slowest imports, and eager heavy modules."""
+	p = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+					   capture_output=True, text=True, env=_env())
+	if p.returncode != 0:
+		return {"module": module, "error": p.stderr.strip().splitlines()[-1:]}
+	rows = []
+	for line in p.stderr.splitlines():
+		if not line.startswith("import time:") or "self [us]" in line:
+			continue
+		_, self_us, cum_us, name = [x.strip() for x in line.replace("import time:", "|").split("|")]
+		rows.append({"name": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cum_us) / 1000})
+	total = next((r["cumulative_ms"] for r in rows if r["name"] == module), None)
+	names = {r["name"] for r in rows}
+	return {
+		"module": module,
+		"import_ms": total,
+		"n_modules": len(rows),
+		"heavy_imports": [h for h in HEAVY if h in names],
+		"slowest": sorted(rows, key=lambda r: -r["self_ms"])[:top],
+	}
+
+def health_time() -> Dict:
+	"""Seconds from a fresh interpreter to importing the app and serving /health."""
+	p = subprocess.run([sys.executable, "-c", HEALTH_SNIPPET], capture_output=True, text=True, env=_env())
+	if p.returncode != 0:
+		return {"error": p.stderr.strip().splitlines()[-1:]}
+	import_s, health_s = (float(x) for x in p.stdout.split())
+	return {"app_import_s": round(import_s, 4), "health_s": round(health_s, 4)}
+
+def startup_profile(modules: List[str] = ENTRY_POINTS) -> Dict:
+	return {"health": health_time(), "imports": [import_profile(m) for m in modules]}
+
+if __name__ == "__main__":
+	ap = argparse.ArgumentParser()
+	ap.add_argument("--modules", default=",".join(ENTRY_POINTS))
+	args = ap.parse_args()
+	prof = startup_profile(args.modules.split(","))
+	print(json.dumps(prof, indent=2))
+	# eager ML imports on an entry point are a regression
+	sys.exit(1 if any(m.get("heavy_imports") for m in prof["imports"]) else 0)
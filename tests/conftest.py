@@ -0,0 +1,65 @@
+import os, sys, tempfile, zlib
+import pytest
+
+# events logged under test (shard failures, LLM retries) go to a scratch dir, not runtime/
+os.environ.setdefault("OBS_LOG_PATH", os.path.join(tempfile.mkdtemp(prefix="docuchat-tests-"), "requests.log"))
+
+# tests import the app as `backend.*` from the repo root, like the CLI entry points
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+orjson = pytest.importorskip("orjson")
+
+DIM = 16
+
+def fake_encode(texts, *args, **kwargs):
+	"""Deterministic unit vectors per text, standing in for the sentence-transformer."""
+	if not len(texts):
+		return np.zeros((0, DIM), dtype="float32")
+	v = np.stack([np.random.default_rng(zlib.crc32(t.encode())).standard_normal(DIM) for t in texts])
+	return (v / np.linalg.norm(v, axis=1, keepdims=True)).astype("float32")
+
+def chunk_record(doc_id: str, i: int, words: str) -> dict:
+	return {"doc_id": doc_id, "source_path": f"data/{doc_id}.pdf", "page": i // 3 + 1,
+			"chunk_id": f"{doc_id}:{i // 3 + 1}:{i % 3 + 1}", "start_char": 0, "end_char": len(words),
+			"text": words, "n_tokens": len(words.split())}
+
+VOCAB = ("alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho "
+		 "sigma tau upsilon phi chi psi omega").split()
+
+def write_corpus(art_dir: str, docs, dead=()) -> str:
+	"""chunks.jsonl + manifest for `docs` [(doc_id, n_chunks)], with the docs in `dead` tombstoned."""
+	from backend.rag.manifest import new_manifest, save_manifest
+	manifest = new_manifest()
+	path = os.path.join(art_dir, "chunks.jsonl")
+	with open(path, "wb") as f:
+		for doc_id, n in docs:
+			rng = np.random.default_rng(zlib.crc32(doc_id.encode()))
+			row = manifest["n_rows"]
+			for i in range(n):
+				f.write(orjson.dumps(chunk_record(doc_id, i, " ".join(rng.choice(VOCAB, 12)))) + b"\n")
+			rows = [row, row + n]
+			if doc_id in dead:
+				manifest["tombstones"].append(rows)
+			else:
+				manifest["docs"][f"data/{doc_id}.pdf"] = {"doc_id": doc_id, "sha256": doc_id, "n_pages": 1, "rows": rows}
+			manifest["n_rows"] = row + n
+	manifest["chunks_bytes"] = os.path.getsize(path)
+	save_manifest(manifest, art_dir)
+	return path
+
+class FakeReranker:
+	def score_pair_list(self, pairs, batch_size=32):
+		return [zlib.crc32(f"{q}\0{t}".encode()) / 2**32 for q, t in pairs]
+
+@pytest.fixture
+def fake_models(monkeypatch):
+	"""Index builds and retrievers use fake_encode and FakeReranker instead of the HF models."""
+	pytest.importorskip("faiss")
+	pytest.importorskip("dotenv")
+	from backend.rag import index_build, retrieve
+	monkeypatch.setattr(index_build, "encode", fake_encode)
+	monkeypatch.setattr(retrieve, "get_embedder", lambda name: None)
+	monkeypatch.setattr(retrieve, "embed_batcher", lambda name: fake_encode)
+	monkeypatch.setattr(retrieve, "rerank_batcher", lambda name: None)
+	monkeypatch.setattr(retrieve, "get_reranker", lambda name: FakeReranker())
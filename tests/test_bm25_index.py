@@ -0,0 +1,44 @@
+import numpy as np
+import rank_bm25
+
+from backend.rag.bm25_index import BM25Index, build_bm25_index, update_bm25_index, tokenize
+
+CORPUS = [
+	"the quick brown fox jumps over the lazy dog",
+	"a quick brown dog outpaces a quick fox",
+	"lorem ipsum dolor sit amet",
+	"the dog sleeps",
+	"fox fox fox",
+	"ipsum and the lazy afternoon",
+	"brown bread and brown sugar",
+]
+QUERIES = ["quick fox", "the dog", "brown brown", "ipsum lazy", "missing term", "fox the the"]
+
+def test_scores_match_rank_bm25(tmp_path):
+	tokenized = [tokenize(t) for t in CORPUS]
+	build_bm25_index(tokenized, str(tmp_path))
+	index = BM25Index(str(tmp_path))
+	ref = rank_bm25.BM25Okapi(tokenized)
+	for q in QUERIES:
+		np.testing.assert_allclose(index.get_scores(tokenize(q)), ref.get_scores(tokenize(q)), rtol=1e-5, atol=1e-6)
+
+def test_top_k_is_sorted_and_skips_zero_scores(tmp_path):
+	build_bm25_index([tokenize(t) for t in CORPUS], str(tmp_path))
+	index = BM25Index(str(tmp_path))
+	hits = index.top_k(tokenize("quick fox"), k=10)
+	scores = index.get_scores(tokenize("quick fox"))
+	assert [r for r, _ in hits] == sorted(np.flatnonzero(scores), key=lambda r: (-scores[r], r))
+	assert index.top_k(tokenize("missing term")) == []
+
+def test_update_equals_full_build(tmp_path):
+	tokenized = [tokenize(t) for t in CORPUS]
+	live = np.ones(len(CORPUS), dtype=bool)
+	live[[1, 4]] = False  # tombstoned rows drop out of idf / avgdl and the postings
+	full, inc = tmp_path / "full", tmp_path / "inc"
+	build_bm25_index(tokenized, str(full), live)
+	build_bm25_index(tokenized[:4], str(inc), live[:4])
+	update_bm25_index(str(inc), tokenized[4:], live)
+	a, b = BM25Index(str(full)), BM25Index(str(inc))
+	for q in QUERIES:
+		np.testing.assert_allclose(a.get_scores(tokenize(q)), b.get_scores(tokenize(q)), rtol=1e-6)
+		assert not a.get_scores(tokenize(q))[~live].any()
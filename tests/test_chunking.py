@@ -0,0 +1,55 @@
+import re
+from functools import partial
+import pytest
+
+pytest.importorskip("orjson")
+
+from backend.rag import ingest
+from backend.rag.ingest import chunk_pages, pack_units
+
+def _words(text):
+	spans = [m.span() for m in re.finditer(r"\S+", text)]
+	return [s for s, _ in spans], [e for _, e in spans]
+
+def _sentences(text):
+	return [m.span() for m in re.finditer(r"\S.*?[.!?](?=\s|$)|\S.*\S", text, re.S)]
+
+@pytest.fixture(autouse=True)
+def _no_models(monkeypatch):
+	# word tokens and regex sentences stand in for the embedder's tokenizer and punkt
+	monkeypatch.setattr(ingest, "encode_with_offsets", _words)
+	monkeypatch.setattr(ingest, "sentence_spans", _sentences)
+	monkeypatch.setattr(ingest, "chunk_text", partial(ingest.chunk_text, target_tokens=12, overlap_tokens=4))
+
+PAGE = ("The first sentence has six words.\nA second one\tspans a line break.  "
+		"Third: short. " + " ".join(f"w{i}" for i in range(30)) + ". Last one here.")
+
+def test_chunk_offsets_round_trip():
+	recs = chunk_pages("data/doc.pdf", [(1, PAGE), (2, "")])
+	assert recs and all(r.page == 1 for r in recs)
+	for r in recs:
+		raw = PAGE[r.start_char:r.end_char]
+		assert len(r.text) == len(raw) and "\n" not in r.text and "\t" not in r.text
+		assert r.text.split() == raw.split()
+		assert r.n_tokens == len(raw.split())
+	assert recs[0].start_char == 0 and recs[-1].end_char == len(PAGE)
+	assert [r.chunk_id for r in recs] == [f"doc:1:{i + 1}" for i in range(len(recs))]
+
+def test_chunks_cover_the_page_with_overlap():
+	recs = chunk_pages("doc.pdf", [(1, PAGE)])
+	assert len(recs) > 3
+	for a, b in zip(recs, recs[1:]):
+		assert b.start_char <= a.end_char + 2 and b.end_char > a.end_char
+
+@pytest.mark.parametrize("sizes", [[3, 3, 3, 3], [13], [5, 20, 1], [4, 4, 4, 4, 4, 4]])
+def test_pack_units_progresses(sizes):
+	units, lo = [], 0
+	for n in sizes:
+		units.append((lo, lo + n))
+		lo += n
+	chunks = pack_units(units, 10, 4)
+	assert chunks[0][0] == 0 and chunks[-1][1] == len(units)
+	for (a0, a1), (b0, b1) in zip(chunks, chunks[1:]):
+		assert a0 < b0 <= a1 < b1
+	for a, b in chunks:
+		assert b - a == 1 or sum(sizes[a:b]) <= 10
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from backend.rag.filters import RowSet, normalize_filters, filters_key, ranges_to_indices
+from backend.rag.meta_store import write_meta_store, open_meta_store
+from backend.rag.bm25_index import BM25Index, build_bm25_index, tokenize
+from conftest import chunk_record
+
+def test_normalize_filters():
+	assert normalize_filters(None) is None
+	assert normalize_filters({"doc_ids": [], "source_prefix": ""}) == {"doc_ids": []}
+	assert normalize_filters({"doc_ids": "a", "page_min": "2"}) == {"doc_ids": ["a"], "page_min": 2}
+	assert normalize_filters({"doc_ids": ["b", "a", "b"]}) == {"doc_ids": ["a", "b"]}
+	assert filters_key(normalize_filters({"page_max": 3, "doc_ids": ["b", "a"]})) == "doc_ids=a,b;page_max=3"
+	with pytest.raises(ValueError):
+		normalize_filters({"author": "x"})
+
+def test_ranges_to_indices():
+	got = ranges_to_indices(np.array([5, 0, 9]), np.array([2, 0, 3]))
+	assert got.tolist() == [5, 6, 9, 10, 11]
+
+def test_rowset_positions_match_membership():
+	rng = np.random.default_rng(0)
+	rows = RowSet(np.sort(rng.choice(1000, 120, replace=False)))
+	for ids in (np.arange(1000), np.sort(rng.choice(1000, 40, replace=False))):
+		want = np.flatnonzero(np.isin(ids, rows.rows))
+		assert rows.positions(ids).tolist() == want.tolist()
+		assert rows.contains(ids).tolist() == np.isin(ids, rows.rows).tolist()
+
+@pytest.fixture
+def store(tmp_path):
+	# docs interleave page by page, as incremental appends leave them
+	metas = []
+	for i in range(9):
+		for doc in ("alpha", "beta", "hr_policy"):
+			m = chunk_record(doc, i, f"{doc} row {i}")
+			if doc == "hr_policy":
+				m["source_path"] = "data/hr/policy.pdf"
+			metas.append(m)
+	write_meta_store(metas, str(tmp_path))
+	return metas, open_meta_store(str(tmp_path))
+
+def _brute(metas, f, dead=()):
+	keep = []
+	for row, m in enumerate(metas):
+		if row in dead:
+			continue
+		if "doc_ids" in f and m["doc_id"] not in f["doc_ids"]:
+			continue
+		if "source_prefix" in f and not m["source_path"].startswith(f["source_prefix"]):
+			continue
+		if m["page"] < f.get("page_min", m["page"]) or m["page"] > f.get("page_max", m["page"]):
+			continue
+		keep.append(row)
+	return keep
+
+@pytest.mark.parametrize("raw", [
+	{"doc_ids": ["alpha"]},
+	{"doc_ids": ["alpha", "hr_policy"], "page_min": 2},
+	{"source_prefix": "data/hr/"},
+	{"source_prefix": "data/", "doc_ids": ["beta"], "page_max": 2},
+	{"page_min": 2, "page_max": 2},
+	{"doc_ids": ["nope"]},
+])
+def test_select_matches_brute_force(store, raw):
+	metas, meta = store
+	f = normalize_filters(raw)
+	assert meta.select(f).rows.tolist() == _brute(metas, f)
+	dead = np.array([0, 3, 4, 10], dtype=np.int64)
+	assert meta.select(f, dead).rows.tolist() == _brute(metas, f, set(dead.tolist()))
+
+def test_bm25_filtered_search_equals_post_filter(store, tmp_path):
+	metas, meta = store
+	build_bm25_index([tokenize(m["text"]) for m in metas], str(tmp_path))
+	index = BM25Index(str(tmp_path))
+	rows = meta.select(normalize_filters({"doc_ids": ["beta", "hr_policy"], "page_max": 2}))
+	q = [tokenize("beta row 1"), tokenize("policy row")]
+	full = index.top_k_many(q, k=len(metas))
+	filtered = index.top_k_many(q, k=len(metas), rows=rows)
+	allowed = set(rows.rows.tolist())
+	for a, b in zip(full, filtered):
+		assert b == [h for h in a if h[0] in allowed]
+	assert index.top_k_many(q, k=5, rows=RowSet(np.zeros(0, dtype=np.int64))) == [[], []]
@@ -0,0 +1,30 @@
+import pytest
+
+from backend.rag.generate import estimate_tokens, merge_chunks, pack_context
+
+PAGE = "One fact here. Two facts there. Three is a much longer sentence about things. Four. Five ends it."
+
+def _hit(start, end, page=1, doc="d"):
+	return {"doc_id": doc, "page": page, "text": PAGE[start:end], "start_char": start, "end_char": end}
+
+def test_overlapping_hits_merge_into_one_block():
+	blocks = merge_chunks([_hit(30, 80), _hit(0, 45), _hit(0, 20, page=2)])
+	assert [(b["page"], b["text"]) for b in blocks] == [(1, PAGE[0:80]), (2, PAGE[0:20])]
+	assert blocks[0]["n_chunks"] == 2
+
+@pytest.mark.parametrize("budget", [5, 12, 20, 30, 60, 1000])
+def test_pack_context_stays_in_budget(budget):
+	hits = [_hit(0, len(PAGE)), {"doc_id": "e", "page": 3, "text": "Short. Also short."}, _hit(0, 14, page=4)]
+	context, stats = pack_context(hits, budget)
+	assert stats["context_tokens"] == estimate_tokens(context) <= budget
+	for line in filter(None, context.split("\n")):
+		header, body = line.split("] ", 1)
+		src = PAGE if header == "[d:1" or header == "[d:4" else "Short. Also short."
+		# a block is a contiguous prefix of its source: no gaps under one header
+		assert src.startswith(body)
+
+def test_pack_context_drops_repeated_sentences():
+	hits = [_hit(0, 31), {"doc_id": "x", "page": 9, "text": "two facts there. New one."}]
+	context, stats = pack_context(hits, 1000)
+	assert stats["context_dup_sentences"] == 1
+	assert context.endswith("[x:9] New one.")
@@ -0,0 +1,121 @@
+import os
+import numpy as np
+import orjson
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("dotenv")
+
+from backend.rag import index_build
+from backend.rag.bm25_index import BM25Index, tokenize
+from backend.rag.chunk_store import ChunkStore
+from backend.rag.dense_index import load_dense_config, read_index, dense_search, dense_search_rows, StoredEmbeddings
+from backend.rag.filters import RowSet
+from backend.rag.manifest import MANIFEST_FILE, load_manifest, new_manifest, save_manifest, load_tombstones
+from backend.rag.meta_store import MetaStore
+from conftest import chunk_record, fake_encode
+
+WORDS = "alpha beta gamma delta epsilon zeta eta theta iota kappa lambda".split()
+
+@pytest.fixture(autouse=True)
+def _fake_embedder(monkeypatch):
+	monkeypatch.setattr(index_build, "encode", fake_encode)
+
+def _doc_rows(doc_id: str, n: int):
+	rng = np.random.default_rng(sum(map(ord, doc_id)))
+	return [chunk_record(doc_id, i, " ".join(rng.choice(WORDS, 8))) for i in range(n)]
+
+def _ingest(art, manifest, docs, tombstone=()):
+	"""What ingest_folder does to chunks.jsonl and the manifest, without PDFs."""
+	for p in tombstone:
+		manifest["tombstones"].append(manifest["docs"].pop(p)["rows"])
+	with open(os.path.join(art, "chunks.jsonl"), "ab") as f:
+		for doc_id, n in docs:
+			row = manifest["n_rows"]
+			for rec in _doc_rows(doc_id, n):
+				f.write(orjson.dumps(rec) + b"\n")
+			manifest["docs"][f"data/{doc_id}.pdf"] = {"doc_id": doc_id, "sha256": doc_id, "n_pages": 1,
+													   "rows": [row, row + n]}
+			manifest["n_rows"] = row + n
+	manifest["chunks_bytes"] = os.path.getsize(os.path.join(art, "chunks.jsonl"))
+	save_manifest(manifest, art)
+
+def _snapshot(out):
+	meta = MetaStore(out)
+	bm25 = BM25Index(out)
+	cfg = load_dense_config(out)
+	index = read_index(out, cfg)
+	q = fake_encode(["alpha beta", "kappa lambda theta"])
+	return {
+		"texts": ChunkStore(out).texts(range(len(meta))),
+		"meta": list(meta.fields(range(len(meta)))),
+		"bm25": [bm25.get_scores(tokenize(t)).round(5).tolist() for t in ("alpha beta", "theta", "iota iota zeta")],
+		"dense": [a.tolist() for a in dense_search(index, q, 5, cfg)],
+		"embs": StoredEmbeddings(out).all().tolist(),
+		"dead": load_tombstones(out).tolist(),
+	}
+
+def test_incremental_equals_full(tmp_path):
+	art, inc, full = str(tmp_path), str(tmp_path / "inc"), str(tmp_path / "full")
+	chunks = os.path.join(art, "chunks.jsonl")
+	manifest = new_manifest()
+	_ingest(art, manifest, [("a", 5), ("b", 4)])
+	index_build.build_all(chunks, inc)
+	_ingest(art, manifest, [("c", 3), ("b", 6)], tombstone=["data/b.pdf"])
+	index_build.update_all(chunks, inc)
+	index_build.build_all(chunks, full)
+	assert _snapshot(inc) == _snapshot(full)
+	assert load_tombstones(inc).tolist() == [5, 6, 7, 8]
+
+def test_update_rebuilds_after_reingest_from_scratch(tmp_path, capsys):
+	art, out = str(tmp_path), str(tmp_path / "idx")
+	chunks = os.path.join(art, "chunks.jsonl")
+	manifest = new_manifest()
+	_ingest(art, manifest, [("a", 5)])
+	index_build.build_all(chunks, out)
+	# --full: chunks.jsonl rewritten under a new manifest, now longer than the indexed offset
+	open(chunks, "wb").close()
+	manifest = new_manifest()
+	_ingest(art, manifest, [("b", 4), ("c", 4)])
+	index_build.update_all(chunks, out)
+	assert "Full rebuild" in capsys.readouterr().out
+	assert [f[1] for f in MetaStore(out).fields(range(8))] == ["b"] * 4 + ["c"] * 4
+
+def test_dense_filtered_search_equals_post_filter(tmp_path):
+	art, out = str(tmp_path), str(tmp_path / "idx")
+	_ingest(art, new_manifest(), [("a", 6), ("b", 6), ("c", 6)])
+	index_build.build_all(os.path.join(art, "chunks.jsonl"), out)
+	cfg = load_dense_config(out)
+	index = read_index(out, cfg)
+	q = fake_encode(["gamma delta"])
+	rows = RowSet(np.arange(6, 12))
+	D, I = dense_search(index, q, 18, cfg)
+	want = [i for i in I[0].tolist() if 6 <= i < 12][:4]
+	_, got = dense_search_rows(index, q, 4, cfg, rows, StoredEmbeddings(out))
+	assert got[0].tolist() == want
+
+def test_failed_compaction_leaves_sources_alone(tmp_path, monkeypatch):
+	art = str(tmp_path)
+	chunks = os.path.join(art, "chunks.jsonl")
+	manifest = new_manifest()
+	_ingest(art, manifest, [("a", 4), ("b", 4)])
+	_ingest(art, manifest, [], tombstone=["data/a.pdf"])
+	index_build.build_generation(art, "full", lambda out: index_build.build_all(chunks, out))
+	before = open(chunks, "rb").read(), load_manifest(art)
+
+	def boom(*a, **kw):
+		raise RuntimeError("disk full")
+	monkeypatch.setattr(index_build, "write_index", boom)
+	with pytest.raises(RuntimeError):
+		index_build.build_generation(art, "compact", lambda out: index_build.compact(chunks, out),
+									 lambda: index_build.commit_compaction(chunks))
+	assert (open(chunks, "rb").read(), load_manifest(art)) == before
+	assert sorted(os.listdir(art)) == ["CURRENT", "chunks.jsonl", "generations", MANIFEST_FILE]
+
+	monkeypatch.undo()
+	monkeypatch.setattr(index_build, "encode", fake_encode)
+	index_build.build_generation(art, "compact", lambda out: index_build.compact(chunks, out),
+								 lambda: index_build.commit_compaction(chunks))
+	m = load_manifest(art)
+	assert m["n_rows"] == 4 and m["tombstones"] == [] and m["docs"]["data/b.pdf"]["rows"] == [0, 4]
+	assert m["chunks_bytes"] == os.path.getsize(chunks)
@@ -0,0 +1,53 @@
+import glob
+import os
+from functools import partial
+import pytest
+
+from backend.rag import ingest
+from backend.rag.ingest import ingest_folder
+from backend.rag.manifest import load_manifest
+from test_chunking import _sentences, _words
+
+def _page_count(path):
+	with open(path) as f:
+		return int(f.read())
+
+def _extract_pages(path, start=0, end=None):
+	n = _page_count(path)
+	name = os.path.basename(path)
+	return [(p + 1, " ".join(f"{name} page {p + 1} sentence {i} says {'w ' * (i % 7)}something." for i in range(6)))
+			for p in range(start, n if end is None else min(end, n))]
+
+@pytest.fixture
+def pdfs(tmp_path, monkeypatch):
+	monkeypatch.setattr(ingest, "encode_with_offsets", _words)
+	monkeypatch.setattr(ingest, "sentence_spans", _sentences)
+	monkeypatch.setattr(ingest, "chunk_text", partial(ingest.chunk_text, target_tokens=20, overlap_tokens=5))
+	monkeypatch.setattr(ingest, "extract_pages", _extract_pages)
+	monkeypatch.setattr(ingest, "page_count", _page_count)
+	monkeypatch.setattr(ingest, "get_tokenizer", lambda: None)
+	monkeypatch.setattr(ingest, "PAGES_PER_TASK", 4)
+	# the fakes above only reach the workers through fork; pytest runs no other threads
+	monkeypatch.setattr(ingest, "POOL_START_METHOD", "fork")
+	src = tmp_path / "data"
+	(src / "sub").mkdir(parents=True)
+	for name, n in [("a.pdf", 3), ("big.pdf", 11), ("sub/c.pdf", 1), ("d.pdf", 4)]:
+		(src / name).write_text(str(n))
+	return str(src)
+
+def _run(src, art, workers):
+	stats = ingest_folder(src, art, incremental=False, workers=workers)
+	with open(os.path.join(art, "chunks.jsonl"), "rb") as f:
+		blob = f.read()
+	m = load_manifest(art)
+	return stats, blob, {k: v for k, v in m.items() if k != "id"}
+
+def test_parallel_output_is_byte_identical(pdfs, tmp_path):
+	# big.pdf is split into three page ranges
+	assert len(ingest._plan_tasks(glob.glob(os.path.join(pdfs, "**", "*.pdf"), recursive=True), 3)) == 6
+	s1, blob1, m1 = _run(pdfs, str(tmp_path / "serial"), 1)
+	s3, blob3, m3 = _run(pdfs, str(tmp_path / "parallel"), 3)
+	assert blob1 and blob3 == blob1
+	assert m3 == m1
+	assert m1["docs"][os.path.join(pdfs, "big.pdf")]["n_pages"] == 11
+	assert (s3["n_pages"], s3["n_new_chunks"]) == (s1["n_pages"], s1["n_new_chunks"]) == (19, m1["n_rows"])
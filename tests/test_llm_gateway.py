@@ -0,0 +1,114 @@
+import threading
+import time
+from contextlib import contextmanager
+import pytest
+
+pytest.importorskip("dotenv")
+
+from backend.models import llm as llm_mod
+from backend.models.llm import LLMBase, LLMGateway, LLMUnavailable
+
+class Status(Exception):
+	def __init__(self, status_code: int):
+		super().__init__(f"HTTP {status_code}")
+		self.status_code = status_code
+
+class FakeLLM(LLMBase):
+	"""Scripted provider: raises the queued errors in turn, then answers."""
+	provider = "fake"
+	model = "m"
+
+	def __init__(self, errors=(), release: threading.Event = None):
+		self.errors = list(errors)
+		self.release = release
+		self.calls = 0
+
+	def _generate(self, prompt, max_tokens, temperature):
+		self.calls += 1
+		if self.release is not None:
+			assert self.release.wait(5)
+		if self.errors:
+			raise self.errors.pop(0)
+		return f"answer to {prompt}", {"prompt_tokens": 3, "completion_tokens": 4}
+
+WAITING = []
+
+@pytest.fixture(autouse=True)
+def _quiet(monkeypatch):
+	real_span = llm_mod.span
+
+	@contextmanager
+	def span(name, **attrs):
+		if name == "llm_coalesced":
+			WAITING.append(name)
+		with real_span(name, **attrs):
+			yield
+	WAITING.clear()
+	monkeypatch.setattr(llm_mod, "span", span)
+	monkeypatch.setattr(llm_mod, "log_event", lambda ev: None)
+
+def _gateway(**kw):
+	return LLMGateway(**{"max_inflight": 4, "queue_timeout": 5, "max_retries": 2,
+						 "backoff": 0.001, "backoff_max": 0.01, "coalesce": True, **kw})
+
+def _concurrent(gw, fake, prompts, followers):
+	results = [None] * len(prompts)
+
+	def call(i):
+		try:
+			results[i] = gw.generate(fake, prompts[i], 64, 0.0)
+		except Exception as e:
+			results[i] = e
+	threads = [threading.Thread(target=call, args=(i,)) for i in range(len(prompts))]
+	for t in threads:
+		t.start()
+	# hold the leaders' provider calls until every follower waits on one of them
+	deadline = time.monotonic() + 5
+	while len(WAITING) < followers and time.monotonic() < deadline:
+		time.sleep(0.001)
+	fake.release.set()
+	for t in threads:
+		t.join(5)
+	return results
+
+def test_identical_concurrent_calls_coalesce():
+	gw, fake = _gateway(), FakeLLM(release=threading.Event())
+	results = _concurrent(gw, fake, ["q"] * 5, followers=4)
+	assert fake.calls == 1
+	assert {r[0] for r in results} == {"answer to q"}
+	assert sum(bool(r[1].get("coalesced")) for r in results) == 4
+	s = gw.stats()
+	assert (s["calls"], s["provider_calls"], s["coalesced"]) == (5, 1, 4)
+	assert gw._flights == {}
+
+def test_distinct_prompts_do_not_coalesce():
+	gw, fake = _gateway(), FakeLLM(release=threading.Event())
+	results = _concurrent(gw, fake, ["q1", "q2", "q1"], followers=1)
+	assert fake.calls == 2
+	assert [r[0] for r in results] == ["answer to q1", "answer to q2", "answer to q1"]
+
+def test_coalesced_callers_share_the_leaders_error():
+	gw, fake = _gateway(max_retries=0), FakeLLM([Status(503)], release=threading.Event())
+	results = _concurrent(gw, fake, ["q"] * 3, followers=2)
+	assert fake.calls == 1
+	assert all(isinstance(r, LLMUnavailable) for r in results)
+	# the flight is landed, so the next call goes to the provider again
+	assert gw.generate(fake, "q", 64, 0.0)[0] == "answer to q"
+
+def test_transient_errors_are_retried():
+	gw, fake = _gateway(), FakeLLM([Status(429), ConnectionError("reset")])
+	text, usage = gw.generate(fake, "q", 64, 0.0)
+	assert text == "answer to q" and usage["retries"] == 2 and fake.calls == 3
+	assert gw.stats()["retries"] == 2
+
+def test_gives_up_after_max_retries():
+	gw, fake = _gateway(), FakeLLM([Status(500)] * 3)
+	with pytest.raises(LLMUnavailable):
+		gw.generate(fake, "q", 64, 0.0)
+	assert fake.calls == 3 and gw.stats()["failed"] == 1
+
+def test_non_transient_error_is_raised_as_is():
+	gw, fake = _gateway(), FakeLLM([Status(400)])
+	with pytest.raises(Status):
+		gw.generate(fake, "q", 64, 0.0)
+	assert fake.calls == 1 and gw.stats()["retries"] == 0
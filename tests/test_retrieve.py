@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import VOCAB, write_corpus
+
+QUERIES = ["alpha beta gamma", "omega", "kappa lambda mu nu", "alpha beta gamma", "nothing matches"]
+# past FAISS's BLAS threshold (20 queries), where a batch is scored differently
+MANY = QUERIES + [" ".join(VOCAB[i:i + 3]) for i in range(len(VOCAB) - 2)]
+FILTERS = [None, {"doc_ids": ["d1", "d3"], "page_max": 2}]
+
+@pytest.fixture
+def retriever(tmp_path, fake_models):
+	from backend.rag.index_build import build_all
+	from backend.rag.retrieve import Retriever
+	art = str(tmp_path)
+	build_all(write_corpus(art, [(f"d{i}", 7) for i in range(5)], dead=["d2"]), art)
+	r = Retriever(art, "fake-emb", "fake-rerank")
+	yield r
+	r.close()
+
+def _rows(hits):
+	return [h["row"] for h in hits]
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("mode", ["bm25", "dense", "hybrid", "hybrid_rerank"])
+def test_search_many_matches_search_loop(retriever, mode, filters):
+	batch, _ = retriever.search_many(MANY, mode=mode, k=5, filters=filters)
+	assert batch == [retriever.search(q, mode=mode, k=5, filters=filters)[0] for q in MANY]
+	assert any(batch)
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_search_many_matches_single_query_paths(retriever, filters):
+	rows = retriever.select(filters)
+	bm25, _ = retriever.search_many(QUERIES, mode="bm25", k=5, filters=filters)
+	dense, _ = retriever.search_many(QUERIES, mode="dense", k=5, filters=filters)
+	hybrid, _ = retriever.search_many(QUERIES, mode="hybrid", k=5, filters=filters)
+	reranked, _ = retriever.search_many(QUERIES, mode="hybrid_rerank", k=5, filters=filters)
+	for i, q in enumerate(QUERIES):
+		assert _rows(bm25[i]) == [r for r, _ in retriever.bm25_search(q, 20, rows)][:5]
+		assert _rows(dense[i]) == [r for r, _ in retriever.dense_search(q, 20, rows=rows)][:5]
+		assert _rows(hybrid[i]) == _rows(retriever.hybrid(q, k_final=5, filters=filters))
+		assert _rows(reranked[i]) == _rows(retriever.hybrid(q, k_final=5, rerank=True, filters=filters))
+	# tombstoned d2 (rows 14-20) never comes back
+	assert not {r for hits in bm25 + dense + hybrid for r in _rows(hits)} & set(range(14, 21))
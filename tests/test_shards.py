@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import Future
+import numpy as np
+import orjson
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("dotenv")
+
+from backend.rag.index_build import build_all, build_sharded
+from backend.rag.retrieve import Retriever
+from backend.rag.shards import SHARDS_FILE, LocalShard, ShardedRetriever
+from conftest import write_corpus
+
+MODES = ["bm25", "dense", "hybrid", "hybrid_rerank"]
+QUERIES = ["alpha beta gamma", "omega psi", "kappa lambda mu nu", "nothing matches"]
+FILTERS = [None, {"doc_ids": ["d1", "d4", "d6"]}, {"page_max": 2, "source_prefix": "data/d"}]
+
+@pytest.fixture
+def built(tmp_path, fake_models):
+	art = str(tmp_path)
+	chunks = write_corpus(art, [(f"d{i}", 3 + i % 4) for i in range(8)], dead=["d2", "d5"])
+	build_all(chunks, os.path.join(art, "full"))
+	build_sharded(chunks, os.path.join(art, "sharded"), 3)
+	return os.path.join(art, "full"), os.path.join(art, "sharded")
+
+def _local_shards(sharded_dir):
+	with open(os.path.join(sharded_dir, SHARDS_FILE), "rb") as f:
+		return [LocalShard(os.path.join(sharded_dir, s["dir"])) for s in orjson.loads(f.read())["shards"]]
+
+def _scores(hits):
+	return [h.get("rerank_score", h.get("score", 0.0)) for q in hits for h in q]
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("mode", MODES)
+def test_sharded_matches_unsharded(built, mode, filters):
+	full, sharded_dir = built
+	single = Retriever(full, "fake-emb", "fake-rerank")
+	sharded = ShardedRetriever(sharded_dir, "fake-emb", "fake-rerank", shards=_local_shards(sharded_dir))
+	try:
+		want, _ = single.search_many(QUERIES, mode=mode, k=6, filters=filters)
+		got, timings = sharded.search_many(QUERIES, mode=mode, k=6, filters=filters)
+	finally:
+		single.close()
+		sharded.close()
+	assert timings["n_shards"] == 3 and timings["partial"] is False
+	assert [[h["row"] for h in q] for q in got] == [[h["row"] for h in q] for q in want]
+	# corpus-wide idf / avgdl: BM25 scores match the unsharded index, not just the order
+	np.testing.assert_allclose(_scores(got), _scores(want), rtol=1e-5)
+
+class DeadShard:
+	"""A shard that fails every call, or (hang=True) never answers."""
+	def __init__(self, hang: bool = False):
+		self.hang = hang
+
+	def submit(self, method, *args):
+		fut = Future()
+		if not self.hang:
+			fut.set_exception(ConnectionError("shard down"))
+		return fut
+
+	def close(self):
+		pass
+
+@pytest.mark.parametrize("hang", [False, True])
+def test_failed_shard_gives_partial_results(built, hang):
+	shards = _local_shards(built[1])
+	shards[2].close()
+	sharded = ShardedRetriever(built[1], "fake-emb", "fake-rerank", shards=shards[:2] + [DeadShard(hang)], timeout=0.2)
+	try:
+		got, timings = sharded.search_many(QUERIES, mode="hybrid", k=6)
+	finally:
+		sharded.close()
+	assert timings["partial"] is True and timings["shards_failed"] == [2]
+	all_rows = np.arange(sharded._ends.max())
+	lost = set(all_rows[sharded._shard_of(all_rows) == 2].tolist())
+	# the other shards still answer
+	assert lost and all(got[:3]) and not {h["row"] for q in got for h in q} & lost